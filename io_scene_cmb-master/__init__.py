@@ -18,7 +18,33 @@ from bpy_extras.io_utils import ImportHelper
 # ################################################################
 # Import/Export
 # ################################################################
-class ImportCmb(bpy.types.Operator, ImportHelper):
+class ModelImportOptions(object):
+    '''Options shared by every operator that imports models'''
+    mesh_builder = EnumProperty(
+        name="Mesh Builder",
+        description="How meshes are created",
+        items=(('BULK', "Bulk", "Fill the mesh data from arrays with foreach_set"),
+               ('BMESH', "BMesh", "Create vertices and faces one at a time with bmesh")),
+        default='BULK')
+    report_build_time = BoolProperty(
+        name="Report Build Time",
+        description="Report how long the mesh builder took for each model, to compare them",
+        default=False)
+    use_texture_cache = BoolProperty(
+        name="Cache Decoded Textures",
+        description="Keep decoded textures on disk so they aren't decoded again on later imports",
+        default=True)
+    use_scene_cache = BoolProperty(
+        name="Cache Decoded Models",
+        description="Keep decoded meshes, textures and baked animations on disk, so importing the same file again skips decoding them",
+        default=True)
+    decode_in_workers = BoolProperty(
+        name="Decode Textures in Workers",
+        description="Decode textures in forked worker processes. Faster for many large textures, "
+                    "but forking blender can occasionally hang the import",
+        default=False)
+
+class ImportCmb(bpy.types.Operator, ImportHelper, ModelImportOptions):
     bl_idname = "import.cmb"
     bl_label = "Import CMB"
 
@@ -33,7 +59,7 @@ class ImportCmb(bpy.types.Operator, ImportHelper):
         return load_cmb(self, context)
 
 
-class ImportZar(bpy.types.Operator, ImportHelper):
+class ImportZar(bpy.types.Operator, ImportHelper, ModelImportOptions):
     bl_idname = "import.zar"
     bl_label = "Import ZAR"
 
@@ -41,6 +67,20 @@ class ImportZar(bpy.types.Operator, ImportHelper):
     filter_glob = StringProperty(default="*.zar", options={'HIDDEN'})
     files = bpy.props.CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
     directory = bpy.props.StringProperty(subtype='FILE_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+    animation_keyframes = EnumProperty(
+        name="Animation Keyframes",
+        description="Which frames of each animation get keyframes",
+        items=(('ALL', "Every Frame", "Key every frame of every channel"),
+               ('SPARSE', "Sparse", "Only key the frames needed to stay within the location and rotation tolerances, with matching handles")),
+        default='ALL')
+    animation_location_tolerance = FloatProperty(
+        name="Location Tolerance",
+        description="How far sparse location keyframes may stray from the original animation on any frame, in blender units",
+        default=0.0001, min=0.0, precision=5)
+    animation_rotation_tolerance = FloatProperty(
+        name="Rotation Tolerance",
+        description="How far each component of sparse rotation keyframes may stray from the original animation's quaternions on any frame",
+        default=0.0001, min=0.0, precision=5)
 
 
     def execute( self, context ):
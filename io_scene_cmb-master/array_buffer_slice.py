@@ -1,10 +1,14 @@
-import io, struct
+import io, mmap, os, struct
 
+# Slices of the same array share one memoryview of it. Closing any of them
+# releases that view and closes the array if it can be (like mapFile's mmap),
+# after which none of them can be read anymore.
 class ArrayBufferSlice:
-    def __init__(self, array, offset = 0, length = -1):
+    def __init__(self, array, offset = 0, length = -1, view = None):
         self.__array = array
+        self.__view = view if view is not None else memoryview(array)
         self.__offset = offset
-        self.__length = length if length != -1 else len(array) - offset
+        self.__length = length if length != -1 else len(self.__view) - offset
 
     def slice(self, offset, length = -1):
         if length == -1:
@@ -18,7 +22,8 @@ class ArrayBufferSlice:
 
         return ArrayBufferSlice(self.__array,
                                 self.__offset + offset,
-                                length)
+                                length,
+                                self.__view)
 
     def __len__(self):
         return self.__length
@@ -30,13 +35,95 @@ class ArrayBufferSlice:
         assert index >= 0, "Index is negative!"
         assert index < self.__length, "Index is past bounds of array!"
 
-        return self.__array[self.__offset + index]
+        return self.__view[self.__offset + index]
+
+    # Note: None of these copy the underlying bytes
+    def getBuffer(self):
+        return self.__view[self.__offset:self.__offset+self.__length]
 
     def decode(self, format):
-        return self.__array[self.__offset:self.__offset+self.__length].decode(format)
+        return str(self.getBuffer(), format)
 
-    def unpack(self, format):
-        return struct.unpack(format, self.__array[self.__offset:self.__offset+self.__length])
+    def unpack(self, format, offset = 0):
+        return struct.unpack_from(format, self.__view, self.__offset + offset)
 
     def toStream(self):
-        return io.BytesIO(self.__array[self.__offset:self.__offset+self.__length])
+        return ArrayBufferStream(self.getBuffer())
+
+    # Returns the offset of sub within the slice, or -1 if it isn't found
+    def find(self, sub, start = 0):
+        end = self.__offset + self.__length
+        if hasattr(self.__array, "find"):# bytes, bytearray and mmap search without copying
+            index = self.__array.find(sub, self.__offset + start, end)
+        else:
+            index = self.__view[:end].tobytes().find(sub, self.__offset + start)
+        return index - self.__offset if index != -1 else -1
+
+    def close(self):
+        self.__view.release()
+        if hasattr(self.__array, "close"):
+            try:
+                self.__array.close()
+            except BufferError:# Something still has a view of it, it's closed once that's garbage collected
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Maps a whole file into memory read-only, so slices of it are only paged in when used.
+# Close the slice once done with it, the file can't be moved or deleted on Windows while it's mapped
+def mapFile(filePath):
+    with open(filePath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ArrayBufferSlice(b"")# Empty files can't be mapped
+        return ArrayBufferSlice(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+class ArrayBufferStream(io.RawIOBase):
+    '''A read-only file-like object over a memoryview, like io.BytesIO but without copying the bytes up front'''
+    def __init__(self, view):
+        self.__view = view
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    # Same as io.BytesIO.getbuffer, a view of all of the stream's bytes
+    def getbuffer(self):
+        return self.__view[:]
+
+    def close(self):
+        if not self.closed:
+            self.__view.release()
+        super().close()
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += len(self.__view)
+
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+
+        self.__position = offset
+        return self.__position
+
+    def read(self, size = -1):
+        start = min(self.__position, len(self.__view))
+        end = len(self.__view) if (size is None or size < 0) else min(start + size, len(self.__view))
+        self.__position = end
+        return self.__view[start:end].tobytes()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
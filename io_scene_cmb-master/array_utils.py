@@ -0,0 +1,88 @@
+import numpy as np
+
+# NumPy versions of the helpers in quaternion_utils/utils, for transforming
+# many bones or frames at once. Quaternions are (..., 4) arrays in the same
+# w, x, y, z order as mathutils, and they're combined the same way.
+
+def multiplyQuaternions(a, b):
+    '''Same as mathutils' a * b'''
+    aw, ax, ay, az = np.moveaxis(np.asarray(a, np.float64), -1, 0)
+    bw, bx, by, bz = np.moveaxis(np.asarray(b, np.float64), -1, 0)
+    return np.stack((
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ), -1)
+
+def fromAxisAngles(axis, radians):
+    radians = np.asarray(radians, np.float64)
+    q = np.zeros(radians.shape + (4,))
+    q[..., 0] = np.cos(radians / 2)
+    q[..., 1:] = np.multiply.outer(np.sin(radians / 2), axis)
+    return q
+
+def fromEulerAnglesArray(radians):
+    '''Same as quaternion_utils.fromEulerAngles for (..., 3) arrays of angles'''
+    radians = np.asarray(radians, np.float64)
+    x = fromAxisAngles((1,0,0), radians[..., 0])
+    y = fromAxisAngles((0,1,0), radians[..., 1])
+    z = fromAxisAngles((0,0,1), radians[..., 2])
+    q = multiplyQuaternions(multiplyQuaternions(z, y), x)
+
+    q[q[..., 0] < 0] *= -1
+    return q
+
+def fromEulerAnglesSlopesArray(radians, slopes):
+    '''Returns the slopes of fromEulerAnglesArray(radians) when the angles change by slopes
+
+    Both are (..., 3) arrays that broadcast together, and the slopes are
+    (..., 4) with the same sign flips as the quaternions.
+    '''
+    radians = np.asarray(radians, np.float64)
+    slopes = np.asarray(slopes, np.float64)
+    x = fromAxisAngles((1,0,0), radians[..., 0])
+    y = fromAxisAngles((0,1,0), radians[..., 1])
+    z = fromAxisAngles((0,0,1), radians[..., 2])
+
+    # Turning about an axis by a changes its quaternion by itself times (0, axis * a / 2)
+    dx = multiplyQuaternions(x, (0, 0.5, 0, 0)) * slopes[..., 0, np.newaxis]
+    dy = multiplyQuaternions(y, (0, 0, 0.5, 0)) * slopes[..., 1, np.newaxis]
+    dz = multiplyQuaternions(z, (0, 0, 0, 0.5)) * slopes[..., 2, np.newaxis]
+    zy = multiplyQuaternions(z, y)
+    q = multiplyQuaternions(zy, x)
+    dq = (multiplyQuaternions(zy, dx) +
+          multiplyQuaternions(multiplyQuaternions(z, dy), x) +
+          multiplyQuaternions(multiplyQuaternions(dz, y), x))
+
+    return dq * np.where(q[..., 0] < 0, -1.0, 1.0)[..., np.newaxis]
+
+def normalizeQuaternions(q):
+    return q / np.sqrt(np.sum(q * q, -1))[..., np.newaxis]
+
+def invertQuaternions(q):
+    '''Same as mathutils' Quaternion.invert()'''
+    inverse = q * (1, -1, -1, -1)
+    return inverse / np.sum(q * q, -1)[..., np.newaxis]
+
+def quaternionsToMatrices(q):
+    '''Same as mathutils' Quaternion.to_matrix(), as (..., 3, 3) arrays'''
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), -1),
+        np.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), -1),
+        np.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), -1),
+    ), -2)
+
+def makeQuaternionsContinuous(q):
+    '''Flips the sign of quaternions along the first axis so each one is on the same side as the one before it
+
+    Same as negating each quaternion whose dot product with the previous
+    (already flipped) one is negative, to keep interpolation from spinning the
+    long way around.
+    '''
+    q = np.array(q, np.float64)
+    for i in range(1, len(q)):
+        flip = np.sum(q[i - 1] * q[i], -1) < 0
+        q[i][flip] *= -1
+    return q
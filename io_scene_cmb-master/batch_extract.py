@@ -0,0 +1,234 @@
+'''Extracts every model in a romfs dump without blender
+
+Usage: python batch_extract.py <romfs directory> <output directory> [--jobs N] [--mip-levels | --mip-size N]
+
+Every .zar, .zsi and .cmb file is parsed in a pool of worker processes. For
+each one, a JSON summary of its models is written to <output>/<path>.json and
+their decoded textures to <output>/<path>/<model>/<texture>.png. An index of
+every file and whether it was extracted is written to <output>/index.json.
+
+Only the full size level of each texture is decoded, unless every mip level is
+asked for (written as <texture>_mip<level>.png), or only the level closest to
+a given size, which is much cheaper for previews.
+'''
+
+import argparse, json, os, re, sys, time, traceback
+import numpy as np
+
+if not __package__:
+    # Run as a script, load the addon's modules as a package without running its blender __init__
+    from script_package import registerPackage
+    __package__ = registerPackage()
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .array_buffer_slice import mapFile
+from .cmb import getCmbStartOffset, isCmb, readCmb
+from .ctrTexture import DecodeBufferRGBA, DecodeMipLevelsRGBA
+from .png_writer import writePng
+from .texture_cache import TextureCache
+from .zar import Zar
+
+ModelExtensions = (".zar", ".zsi", ".cmb")
+
+class ExtractOptions(object):
+    def __init__(self):
+        self.outputDir = "."
+        self.exportTextures = True
+        self.textureCacheDir = None
+        self.exportMipLevels = False# Decode every mip level instead of only the full size one
+        self.mipTargetSize = None# Only decode the mip level closest to this size
+
+def findModelFiles(romfsDir):
+    '''Returns the path of every model file under romfsDir, relative to it'''
+    paths = []
+    for dirPath, dirNames, fileNames in os.walk(romfsDir):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            if fileName.lower().endswith(ModelExtensions):
+                paths.append(os.path.relpath(os.path.join(dirPath, fileName), romfsDir))
+    return paths
+
+def getSafeName(name):
+    return re.sub(r"[^\w.-]", "_", name) or "_"
+
+def summarizeCmb(cmb):
+    return {
+        "name": cmb.name,
+        "boneCount": len(cmb.skeleton),
+        "materialCount": len(cmb.materials),
+        "meshCount": len(cmb.meshes),
+        "shapes": [{
+            "primitiveSetCount": len(shape.primitiveSets),
+            "vertexCount": max([int(np.max(pset.primitive.indices)) + 1 for pset in shape.primitiveSets if len(pset.primitive.indices) > 0] or [0]),
+            "indexCount": sum(len(pset.primitive.indices) for pset in shape.primitiveSets),
+        } for shape in cmb.shapes],
+        "textures": [{
+            "name": t.name,
+            "width": t.width,
+            "height": t.height,
+            "format": t.imageFormat.name,
+            "isETC1": t.isETC1,
+            "mipmapCount": t.mimapCount,
+        } for t in cmb.textures],
+    }
+
+def extractTextures(f, cmb, startOff, modelDir, options, textureCache):
+    '''Decodes every texture of a model to PNGs
+
+    Returns a list of (MipLevel or None, path) pairs for each texture, where
+    None means the full size texture was decoded the usual way.
+    '''
+    if cmb.texDataOfs == 0:
+        return [[] for _ in cmb.textures]
+
+    os.makedirs(modelDir, exist_ok=True)
+    paths = []
+    usedNames = set()
+    for i, t in enumerate(cmb.textures):
+        name = getSafeName(t.name)
+        if name in usedNames:
+            name = "{}_{}".format(name, i)
+        usedNames.add(name)
+
+        f.seek(cmb.texDataOfs + t.dataOffset + startOff)
+        data = f.read(t.dataLength)
+        if options.exportMipLevels or options.mipTargetSize is not None:
+            levels = DecodeMipLevelsRGBA(data, t.width, t.height, t.mimapCount, t.imageFormat, t.isETC1, textureCache,
+                                         None if options.exportMipLevels else options.mipTargetSize)
+        else:
+            levels = [(None, DecodeBufferRGBA(data, t.width, t.height, t.imageFormat, t.isETC1, textureCache))]
+
+        texturePaths = []
+        for level, pixels in levels:
+            if level is None or level.index == 0:
+                path = os.path.join(modelDir, name + ".png")
+                writePng(path, t.width, t.height, pixels)
+            else:
+                path = os.path.join(modelDir, "{}_mip{}.png".format(name, level.index))
+                writePng(path, level.width, level.height, pixels)
+            texturePaths.append((level, path))
+        paths.append(texturePaths)
+    return paths
+
+def extractCmb(bytes, modelDir, options, textureCache):
+    '''Returns the summary of the model in a .cmb or .zsi, or None if there isn't one'''
+    with bytes.toStream() as f:
+        startOff = getCmbStartOffset(f)
+        if not isCmb(f, startOff):
+            return None
+
+        cmb = readCmb(f, startOff)
+        summary = summarizeCmb(cmb)
+        if options.exportTextures:
+            modelDir = os.path.join(modelDir, getSafeName(cmb.name))
+            paths = extractTextures(f, cmb, startOff, modelDir, options, textureCache)
+            for textureSummary, texturePaths in zip(summary["textures"], paths):
+                textureSummary["png"] = os.path.relpath(texturePaths[0][1], options.outputDir) if texturePaths else None
+                if options.exportMipLevels or options.mipTargetSize is not None:
+                    textureSummary["mipLevels"] = [{
+                        "level": level.index,
+                        "width": level.width,
+                        "height": level.height,
+                        "png": os.path.relpath(path, options.outputDir),
+                    } for level, path in texturePaths]
+        return summary
+
+def extractFile(relPath, romfsDir, options):
+    '''Extracts one model file, returning a short result for the index'''
+    start = time.time()
+    path = os.path.join(romfsDir, relPath)
+    outputPath = os.path.join(options.outputDir, relPath)
+    textureCache = TextureCache(options.textureCacheDir) if options.textureCacheDir else None
+
+    summary = { "path": relPath, "models": [] }
+    try:
+        if relPath.lower().endswith(".zar"):
+            with Zar(path) as zar:
+                summary["files"] = {
+                    filetype.typeName: zar.getFilenames(filetype.typeName)
+                    for filetype in zar.filetypesSection.filetypes
+                }
+                for file in zar.getFiles("cmb") or []:
+                    model = extractCmb(file.bytes, outputPath, options, textureCache)
+                    if model is not None:
+                        model["filename"] = file.filename
+                        summary["models"].append(model)
+        else:
+            with mapFile(path) as bytes:
+                model = extractCmb(bytes, outputPath, options, textureCache)
+            if model is not None:
+                summary["models"].append(model)
+            elif relPath.lower().endswith(".cmb"):# Scene .zsi files without a model are fine
+                raise ValueError("Expected magic text to be cmb!")
+    except Exception:
+        summary["error"] = traceback.format_exc()
+
+    os.makedirs(os.path.dirname(outputPath) or ".", exist_ok=True)
+    with open(outputPath + ".json", "wt") as f:
+        json.dump(summary, f, indent=2)
+
+    return {
+        "path": relPath,
+        "modelCount": len(summary["models"]),
+        "textureCount": sum(len(model["textures"]) for model in summary["models"]),
+        "error": summary.get("error"),
+        "seconds": round(time.time() - start, 3),
+    }
+
+def extractAll(romfsDir, options, jobs = None):
+    '''Extracts every model file under romfsDir with a pool of worker processes
+
+    Yields each file's result as soon as it's done, in no particular order.
+    '''
+    relPaths = findModelFiles(romfsDir)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs <= 1 or len(relPaths) <= 1:
+        for relPath in relPaths:
+            yield extractFile(relPath, romfsDir, options)
+        return
+
+    with ProcessPoolExecutor(min(jobs, len(relPaths))) as pool:
+        futures = [pool.submit(extractFile, relPath, romfsDir, options) for relPath in relPaths]
+        for future in as_completed(futures):
+            yield future.result()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Extracts summaries and textures from every model in a romfs dump, without blender.")
+    parser.add_argument("romfs", help="directory to search for .zar, .zsi and .cmb files")
+    parser.add_argument("output", help="directory to write summaries and textures to")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--texture-cache", metavar="DIR", help="reuse textures decoded by previous runs from this directory")
+    parser.add_argument("--no-textures", action="store_true", help="only write summaries")
+    mipGroup = parser.add_mutually_exclusive_group()
+    mipGroup.add_argument("--mip-levels", action="store_true", help="also decode every smaller mip level of each texture")
+    mipGroup.add_argument("--mip-size", type=int, metavar="N", help="only decode the mip level whose largest side is closest to N pixels")
+    args = parser.parse_args(argv)
+
+    options = ExtractOptions()
+    options.outputDir = args.output
+    options.exportTextures = not args.no_textures
+    options.textureCacheDir = args.texture_cache
+    options.exportMipLevels = args.mip_levels
+    options.mipTargetSize = args.mip_size
+    os.makedirs(options.outputDir, exist_ok=True)
+
+    start = time.time()
+    results = []
+    for result in extractAll(args.romfs, options, args.jobs):
+        results.append(result)
+        status = "FAILED" if result["error"] else "{} models, {} textures".format(result["modelCount"], result["textureCount"])
+        print("[{}] {}: {}".format(len(results), result["path"], status))
+
+    results.sort(key=lambda result: result["path"])
+    with open(os.path.join(options.outputDir, "index.json"), "wt") as f:
+        json.dump(results, f, indent=2)
+
+    failed = sum(1 for result in results if result["error"])
+    print("Extracted {} files ({} failed) in {:.1f}s".format(len(results), failed, time.time() - start))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
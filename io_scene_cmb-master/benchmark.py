@@ -0,0 +1,203 @@
+'''Times the importer's parsing and decoding on synthetic files, without blender
+
+Usage: python benchmark.py [--output results.json] [--compare baseline.json] [--repeat N] [--filter TEXT]
+
+Synthetic .cmb, .csab and .zar files are generated from a fixed seed (see
+synthetic.py), so results from different runs and commits are comparable as
+long as the fixture options are the same. Each benchmark is called once to warm
+up, then timed --repeat times. The results are written as JSON, and if a
+previous results file is given, every benchmark whose fastest time got slower
+than --threshold times its old fastest time is reported as a regression.
+'''
+
+import argparse, io, json, os, platform, sys, tempfile, time
+import numpy as np
+
+if not __package__:
+    # Run as a script, load the addon's modules as a package without running its blender __init__
+    from script_package import registerPackage
+    __package__ = registerPackage()
+
+from .array_buffer_slice import ArrayBufferSlice
+from .cmb import readCmb
+from .cmb_scene import buildScene
+from .csab2 import CsabParser, getAnimFrame, sampleAnimationTrack, sampleAnimationTrackFrames
+from .csab_bake import bakeAnimation, bakeSparseAnimation
+from .ctrTexture import DecodeBuffer, DecodeBuffers, DecodePool
+from .synthetic import makeCmb, makeCsab, makeZar
+from .zar import Zar
+
+class BenchmarkOptions(object):
+    def __init__(self):
+        self.boneCount = 40
+        self.meshCount = 6
+        self.gridSize = 40# Vertices along each side of a mesh
+        self.textureSize = 128# One texture of every format
+        self.duration = 120# Frames in each animation
+        self.keyframeCount = 16# Keyframes in each animation track
+        self.repeat = 5
+
+    def getFixtureOptions(self):
+        '''Everything that changes what's being timed, results are only comparable when these match'''
+        return {
+            "boneCount": self.boneCount,
+            "meshCount": self.meshCount,
+            "gridSize": self.gridSize,
+            "textureSize": self.textureSize,
+            "duration": self.duration,
+            "keyframeCount": self.keyframeCount,
+        }
+
+# Animations of each kind of track the parser reads
+AnimationKinds = (
+    ("hermite", True, False),
+    ("hermiteShort", True, True),
+    ("linear", False, False),
+)
+
+def getBenchmarks(options, directory, decodePool):
+    '''Returns a list of (name, function) for everything to time, with fixtures written to directory'''
+    cmbBytes = makeCmb("benchmark", options.boneCount, options.meshCount, options.gridSize, options.textureSize)
+    csabBytes = {
+        name: makeCsab(options.boneCount, options.duration, options.keyframeCount, isHermite=isHermite, isRotationShort=isRotationShort)
+        for name, isHermite, isRotationShort in AnimationKinds
+    }
+
+    zarPath = os.path.join(directory, "benchmark.zar")
+    with open(zarPath, "wb") as f:
+        f.write(makeZar([("cmb", "benchmark.cmb", cmbBytes)] +
+                        [("csab", name + ".csab", data) for name, data in sorted(csabBytes.items())]))
+
+    def readZar():
+        # Unmapped every time, or the temp directory can't be deleted on Windows
+        with Zar(zarPath) as zar:
+            return zar.getFiles("cmb"), zar.getFiles("csab")
+
+    cmb = readCmb(io.BytesIO(cmbBytes), 0)
+    textureJobs = []
+    for t in cmb.textures:
+        start = cmb.texDataOfs + t.dataOffset
+        textureJobs.append((t.imageFormat.name, (cmbBytes[start:start + t.dataLength], t.width, t.height, t.imageFormat, t.isETC1)))
+
+    csabs = { name: CsabParser(cmb).parse(name, ArrayBufferSlice(data)) for name, data in csabBytes.items() }
+    csab = csabs["hermite"]
+    tracks = []
+    for node in csab.animationNodes:
+        tracks += [node.translationX, node.translationY, node.translationZ, node.rotationX, node.rotationY, node.rotationZ]
+    tracks = [track for track in tracks if track is not None]
+    frames = np.arange(csab.duration + 1)
+
+    def sampleEachFrame():
+        for track in tracks:
+            for frame in range(csab.duration + 1):
+                sampleAnimationTrack(track, getAnimFrame(csab, frame))
+
+    def sampleAllFrames():
+        for track in tracks:
+            sampleAnimationTrackFrames(track, frames)
+
+    benchmarks = [
+        ("zar.Zar", readZar),
+        ("cmb.readCmb", lambda: readCmb(io.BytesIO(cmbBytes), 0)),
+        ("cmb_scene.buildScene", lambda: buildScene(io.BytesIO(cmbBytes), cmb, 0, decodeTextures=False)),
+    ]
+    for name, job in textureJobs:
+        benchmarks.append(("ctrTexture.DecodeBuffer[{}]".format(name), lambda job=job: DecodeBuffer(*job)))
+    benchmarks.append(("ctrTexture.DecodeBuffers", lambda: DecodeBuffers([job for _, job in textureJobs])))
+    benchmarks.append(("ctrTexture.DecodeBuffers[pool]", lambda: DecodeBuffers([job for _, job in textureJobs], decodePool)))
+    for name, _, _ in AnimationKinds:
+        benchmarks.append(("csab2.CsabParser.parse[{}]".format(name), lambda name=name: CsabParser(cmb).parse(name, ArrayBufferSlice(csabBytes[name]))))
+    benchmarks += [
+        ("csab2.sampleAnimationTrack", sampleEachFrame),
+        ("csab2.sampleAnimationTrackFrames", sampleAllFrames),
+        ("csab_bake.bakeAnimation", lambda: bakeAnimation(csab, cmb.skeleton)),
+        ("csab_bake.bakeSparseAnimation", lambda: bakeSparseAnimation(csab, cmb.skeleton)),
+    ]
+    return benchmarks
+
+def timeFunction(function, repeat):
+    '''Returns the seconds each of repeat calls took, after one call to warm up'''
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+def runBenchmarks(options, nameFilter = None):
+    '''Times every benchmark whose name contains nameFilter, returning the results as a JSON-able dict'''
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "fixtures": options.getFixtureOptions(),
+        "repeat": options.repeat,
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory() as directory, DecodePool() as decodePool:
+        for name, function in getBenchmarks(options, directory, decodePool):
+            if nameFilter and nameFilter not in name:
+                continue
+            times = timeFunction(function, options.repeat)
+            results["benchmarks"][name] = {
+                "min": min(times),
+                "median": float(np.median(times)),
+                "mean": float(np.mean(times)),
+            }
+            print("{:<48} {:>10.2f} ms".format(name, min(times) * 1000))
+    return results
+
+def findRegressions(results, baseline, threshold):
+    '''Returns (name, old seconds, new seconds) for every benchmark more than threshold times slower than in baseline'''
+    if results["fixtures"] != baseline.get("fixtures"):
+        print("Warning: the baseline was run with different fixtures, times aren't comparable")
+
+    regressions = []
+    for name, result in sorted(results["benchmarks"].items()):
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is not None and result["min"] > old["min"] * threshold:
+            regressions.append((name, old["min"], result["min"]))
+    return regressions
+
+def main(argv = None):
+    options = BenchmarkOptions()
+    parser = argparse.ArgumentParser(description="Times the importer's parsing and decoding on synthetic files, without blender.")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="FILE", help="results of an earlier run to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="how many times slower than the earlier run counts as a regression (default: 1.25)")
+    parser.add_argument("-r", "--repeat", type=int, default=options.repeat, help="timed calls of each benchmark (default: {})".format(options.repeat))
+    parser.add_argument("-k", "--filter", metavar="TEXT", help="only run benchmarks whose name contains TEXT")
+    parser.add_argument("--bones", type=int, default=options.boneCount, help="bones in the model and animations (default: {})".format(options.boneCount))
+    parser.add_argument("--meshes", type=int, default=options.meshCount, help="meshes in the model (default: {})".format(options.meshCount))
+    parser.add_argument("--grid", type=int, default=options.gridSize, help="vertices along each side of a mesh (default: {})".format(options.gridSize))
+    parser.add_argument("--texture-size", type=int, default=options.textureSize, help="width and height of each texture (default: {})".format(options.textureSize))
+    parser.add_argument("--frames", type=int, default=options.duration, help="frames in each animation (default: {})".format(options.duration))
+    parser.add_argument("--keyframes", type=int, default=options.keyframeCount, help="keyframes in each animation track (default: {})".format(options.keyframeCount))
+    args = parser.parse_args(argv)
+
+    options.boneCount = args.bones
+    options.meshCount = args.meshes
+    options.gridSize = args.grid
+    options.textureSize = args.texture_size
+    options.duration = args.frames
+    options.keyframeCount = args.keyframes
+    options.repeat = args.repeat
+
+    results = runBenchmarks(options, args.filter)
+    if args.output:
+        with open(args.output, "wt") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, "rt") as f:
+            baseline = json.load(f)
+        regressions = findRegressions(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print("REGRESSION {}: {:.2f} ms -> {:.2f} ms ({:.2f}x)".format(name, old * 1000, new * 1000, new / old))
+        print("{} regressions against {}".format(len(regressions), args.compare))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
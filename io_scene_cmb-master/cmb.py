@@ -1,15 +1,35 @@
-import sys, os
-from .io_utils import (align, readDataType, readString, readArray, readFloat,
+import sys, os, struct
+import numpy as np
+from functools import lru_cache
+from .io_utils import (align, readString, readArray, readFloat,
                     readUInt32, readInt32, readUShort,
                     readShort, readByte, readUByte)
 from .cmbEnums import *
 from .common import GLOBAL_SCALE
+from .vertex_decoder import getDataTypeDtype
 
 Version = CmbVersion.OoT3D
 
 def applyGlobalScale(values):
     return list(map(lambda x: x * GLOBAL_SCALE, values))
 
+# Fixed size records are unpacked whole with a precompiled struct.Struct from
+# their getLayout(version), then their fields are taken in order by readValues
+def readRecord(f, layout):
+    return iter(layout.unpack(f.read(layout.size)))
+
+# Reads count records of cls stored one after another, with a single read
+def readRecords(f, cls, count):
+    layout = cls.getLayout(Version)
+    return [cls().readValues(iter(values)) for values in layout.iter_unpack(f.read(layout.size * count))]
+
+def takeList(values, count):
+    return [next(values) for _ in range(count)]
+
+# Same as readString for fixed length strings that were already read
+def decodeString(data):
+    return data.decode("ASCII").replace("\x00", '')
+
 class Cmb(object):
     def __init__(self):
         self.version = Version
@@ -41,7 +61,7 @@ class Cmb(object):
         for shape in sklm.shapes:
             for pset in shape.primitiveSets:
                 f.seek((header.faceIndicesOfs + pset.primitive.offset * 2) + startOff)# Always * 2 even if ubyte is used...
-                pset.primitive.indices = [int(readDataType(f, pset.primitive.dataType)) for _ in range(pset.primitive.indicesCount)]
+                pset.primitive.indices = readIndices(f, pset.primitive.dataType, pset.primitive.indicesCount)
 
         self.skeleton = skl.bones
         self.materials = mat.materials# TODO: Combiners
@@ -58,6 +78,14 @@ class Cmb(object):
 
         return self
 
+# Reads face indices as one array of their data type, instead of one value at a time
+def readIndices(f, dataType, count):
+    dtype = getDataTypeDtype(dataType)
+    indices = np.frombuffer(f.read(count * dtype.itemsize), dtype, count)
+    if dtype.kind == 'f':# Same as int() on each value
+        indices = indices.astype(np.int32)
+    return indices
+
 class CmbHeader(object):
     def __init__(self):
         self.magic = "cmb\x20"
@@ -78,23 +106,32 @@ class CmbHeader(object):
         self.textureDataOfs = 0# Texture data buffer Offset
         self.unk0 = 0# Always 0
 
+    # The version comes first, it decides the layout of the rest
+    PrefixLayout = struct.Struct("<4sII")
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<I16sII" + ("I" if version > 6 else "") + "7I" + ("I" if version > 6 else ""))
+
     def read(self,f):
-        self.magic = readString(f, 4)
-        self.filesize = readUInt32(f)
-        self.version = readUInt32(f)
-        self.unused = readUInt32(f)
-        self.name = readString(f, 16)
-        self.faceIndicesCount = readUInt32(f)
-        self.sklOfs = readUInt32(f)
-        self.qtrsOfs = readUInt32(f) if (self.version > 6) else 0
-        self.matsOfs = readUInt32(f)
-        self.texOfs = readUInt32(f)
-        self.sklmOfs = readUInt32(f)
-        self.lutsOfs = readUInt32(f)
-        self.vatrOfs = readUInt32(f)
-        self.faceIndicesOfs = readUInt32(f)
-        self.textureDataOfs = readUInt32(f)
-        self.unk0 = readUInt32(f) if (self.version > 6) else 0
+        magic, self.filesize, self.version = readRecord(f, CmbHeader.PrefixLayout)
+        self.magic = decodeString(magic)
+
+        values = readRecord(f, CmbHeader.getLayout(self.version))
+        self.unused = next(values)
+        self.name = decodeString(next(values))
+        self.faceIndicesCount = next(values)
+        self.sklOfs = next(values)
+        self.qtrsOfs = next(values) if (self.version > 6) else 0
+        self.matsOfs = next(values)
+        self.texOfs = next(values)
+        self.sklmOfs = next(values)
+        self.lutsOfs = next(values)
+        self.vatrOfs = next(values)
+        self.faceIndicesOfs = next(values)
+        self.textureDataOfs = next(values)
+        self.unk0 = next(values) if (self.version > 6) else 0
 
         global Version
         Version = self.version
@@ -271,16 +308,26 @@ class TexMapper(object):
         self.lodBias = 0.0
         self.borderColor = [0,0,0,255]
 
+    Format = "hhHHHHff4B"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<" + TexMapper.Format)
+
     def read(self,f):
-        self.textureID = readShort(f)# Not an int because "-1" is 0xFFFF0000 and not 0xFFFFFFFF
-        readShort(f)# Alignment
-        self.minFilter = readUShort(f)
-        self.magFilter = readUShort(f)
-        self.wrapS = readUShort(f)
-        self.wrapT = readUShort(f)
-        self.minLodBias = readFloat(f)
-        self.lodBias = readFloat(f)
-        self.borderColor = readArray(f, 4, DataTypes.UByte)
+        return self.readValues(readRecord(f, TexMapper.getLayout(Version)))
+
+    def readValues(self, values):
+        self.textureID = next(values)# Not an int because "-1" is 0xFFFF0000 and not 0xFFFFFFFF
+        next(values)# Alignment
+        self.minFilter = next(values)
+        self.magFilter = next(values)
+        self.wrapS = next(values)
+        self.wrapT = next(values)
+        self.minLodBias = next(values)
+        self.lodBias = next(values)
+        self.borderColor = takeList(values, 4)
         return self
 
 class TexCoords(object):
@@ -293,14 +340,24 @@ class TexCoords(object):
         self.rotation = 0.0
         self.translation = [0.0, 0.0]
 
+    Format = "4B2ff2f"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<" + TexCoords.Format)
+
     def read(self,f):
-        self.matrixMode = TextureMatrixMode(readUByte(f))
-        self.referenceCameraIndex = readUByte(f)
-        self.mappingMethod = TextureMappingType(readUByte(f))
-        self.coordinateIndex = readUByte(f)
-        self.scale = readArray(f, 2)
-        self.rotation = readFloat(f)
-        self.translation = readArray(f, 2)
+        return self.readValues(readRecord(f, TexCoords.getLayout(Version)))
+
+    def readValues(self, values):
+        self.matrixMode = TextureMatrixMode(next(values))
+        self.referenceCameraIndex = next(values)
+        self.mappingMethod = TextureMappingType(next(values))
+        self.coordinateIndex = next(values)
+        self.scale = takeList(values, 2)
+        self.rotation = next(values)
+        self.translation = takeList(values, 2)
         return self
 
 class Sampler(object):
@@ -317,11 +374,21 @@ class Sampler(object):
 	    # Four = 4.0,
 	    # Eight = 8.0
 
+    Format = "BbHf"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<" + Sampler.Format)
+
     def read(self,f):
-        self.isAbs = readUByte(f) != 0
-        self.index = readByte(f)
-        self.input = LutInput(readUShort(f))
-        self.scale = readFloat(f)
+        return self.readValues(readRecord(f, Sampler.getLayout(Version)))
+
+    def readValues(self, values):
+        self.isAbs = next(values) != 0
+        self.index = next(values)
+        self.input = LutInput(next(values))
+        self.scale = next(values)
         return self
 
 class Combiner(object):
@@ -346,26 +413,34 @@ class Combiner(object):
         self.operandAlpha2 = TexCombinerAlphaOp.Alpha
         self.constColorIndex = 0
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<18Hi")
+
     def read(self,f):
-        self.combinerModeColor = TexCombineMode(readUShort(f))
-        self.combinerModeAlpha = TexCombineMode(readUShort(f))
-        self.scaleColor = TexCombineScale(readUShort(f))
-        self.scaleAlpha = TexCombineScale(readUShort(f))
-        self.bufferColor = TexCombinerSource(readUShort(f))
-        self.bufferAlpha = TexCombinerSource(readUShort(f))
-        self.sourceColor0 = TexCombinerSource(readUShort(f))
-        self.sourceColor1 = TexCombinerSource(readUShort(f))
-        self.sourceColor2 = TexCombinerSource(readUShort(f))
-        self.operandColor0 = TexCombinerColorOp(readUShort(f))
-        self.operandColor1 = TexCombinerColorOp(readUShort(f))
-        self.operandColor2 = TexCombinerColorOp(readUShort(f))
-        self.sourceAlpha0 = TexCombinerSource(readUShort(f))
-        self.sourceAlpha1 = TexCombinerSource(readUShort(f))
-        self.sourceAlpha2 = TexCombinerSource(readUShort(f))
-        self.operandAlpha0 = TexCombinerAlphaOp(readUShort(f))
-        self.operandAlpha1 = TexCombinerAlphaOp(readUShort(f))
-        self.operandAlpha2 = TexCombinerAlphaOp(readUShort(f))
-        self.constColorIndex = readInt32(f)
+        return self.readValues(readRecord(f, Combiner.getLayout(Version)))
+
+    def readValues(self, values):
+        self.combinerModeColor = TexCombineMode(next(values))
+        self.combinerModeAlpha = TexCombineMode(next(values))
+        self.scaleColor = TexCombineScale(next(values))
+        self.scaleAlpha = TexCombineScale(next(values))
+        self.bufferColor = TexCombinerSource(next(values))
+        self.bufferAlpha = TexCombinerSource(next(values))
+        self.sourceColor0 = TexCombinerSource(next(values))
+        self.sourceColor1 = TexCombinerSource(next(values))
+        self.sourceColor2 = TexCombinerSource(next(values))
+        self.operandColor0 = TexCombinerColorOp(next(values))
+        self.operandColor1 = TexCombinerColorOp(next(values))
+        self.operandColor2 = TexCombinerColorOp(next(values))
+        self.sourceAlpha0 = TexCombinerSource(next(values))
+        self.sourceAlpha1 = TexCombinerSource(next(values))
+        self.sourceAlpha2 = TexCombinerSource(next(values))
+        self.operandAlpha0 = TexCombinerAlphaOp(next(values))
+        self.operandAlpha1 = TexCombinerAlphaOp(next(values))
+        self.operandAlpha2 = TexCombinerAlphaOp(next(values))
+        self.constColorIndex = next(values)
         return self
 
 class Texture(object):
@@ -380,16 +455,24 @@ class Texture(object):
         self.dataOffset = 0
         self.name = "Dummy"
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<IHBBHHII16s")
+
     def read(self,f):
-        self.dataLength = readUInt32(f)
-        self.mimapCount = readUShort(f)
-        self.isETC1 = readUByte(f) != 0
-        self.isCubemap = readUByte(f) != 0
-        self.width = readUShort(f)
-        self.height = readUShort(f)
-        self.imageFormat = GLTextureFormat(readUInt32(f))
-        self.dataOffset = readUInt32(f)
-        self.name = readString(f, 16)
+        return self.readValues(readRecord(f, Texture.getLayout(Version)))
+
+    def readValues(self, values):
+        self.dataLength = next(values)
+        self.mimapCount = next(values)
+        self.isETC1 = next(values) != 0
+        self.isCubemap = next(values) != 0
+        self.width = next(values)
+        self.height = next(values)
+        self.imageFormat = GLTextureFormat(next(values))
+        self.dataOffset = next(values)
+        self.name = decodeString(next(values))
         return self
 
 class Material(object):
@@ -465,84 +548,99 @@ class Material(object):
         self.zPassOP = StencilTestOp.Keep
         self.Unk1 = 0
 
+    # Everything up to the blend mode, the rest comes after 4 byte alignment
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<6Bh" + ("Ihh" if version > 10 else "II")
+            + TexMapper.Format * 3 + TexCoords.Format * 3
+            + "4B4B4B4B4B" + "4B" * 6 + "4f"
+            + "HHI" + "IH6B"
+            + Sampler.Format * 6
+            + "I6h" + "BBHBBHB")
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getBlendLayout(version):
+        return struct.Struct("<HHIHHI4f" + ("4B4HI" if version > 6 else ""))
+
     def read(self,f):
-        self.isFragmentLightingEnabled = readUByte(f) != 0
-        self.isVertexLightingEnabled = readUByte(f) != 0
-        self.isHemiSphereLightingEnabled = readUByte(f) != 0
-        self.isHemiSphereOcclusionEnabled = readUByte(f) != 0
-        self.faceCulling = CullMode(readUByte(f))
-        self.isPolygonOffsetEnabled = readUByte(f) != 0
-        self.polygonOffset = float(readShort(f) / 65534)
+        values = readRecord(f, Material.getLayout(Version))
+        self.isFragmentLightingEnabled = next(values) != 0
+        self.isVertexLightingEnabled = next(values) != 0
+        self.isHemiSphereLightingEnabled = next(values) != 0
+        self.isHemiSphereOcclusionEnabled = next(values) != 0
+        self.faceCulling = CullMode(next(values))
+        self.isPolygonOffsetEnabled = next(values) != 0
+        self.polygonOffset = float(next(values) / 65534)
 
         if(Version > 10):
-            self.Unk0 = readUInt32(f)
-            self.TextureMappersUsed = readShort(f)
-            self.TextureCoordsUsed = readShort(f)
-        else:
-            self.TextureMappersUsed = readUInt32(f)
-            self.TextureCoordsUsed = readUInt32(f)
-
-        self.TextureMappers = [TexMapper().read(f) for _ in range(3)]
-        self.TextureCoords = [TexCoords().read(f) for _ in range(3)]
-
-        self.emissionColor = readArray(f, 4, DataTypes.UByte)
-        self.ambientColor = readArray(f, 4, DataTypes.UByte)
-        self.diffuseColor = readArray(f, 4, DataTypes.UByte)
-        self.specular0Color = readArray(f, 4, DataTypes.UByte)
-        self.specular1Color = readArray(f, 4, DataTypes.UByte)
-        self.constantColors = [readArray(f, 4, DataTypes.UByte) for _ in range(6)]
-        self.bufferColor = readArray(f, 4)
-
-        self.bumpTexture = BumpTexture(readUShort(f))
-        self.bumpMode = BumpMode(readUShort(f))
-        self.isBumpRenormalize = readUInt32(f) != 0
-
-        self.layerConfig = LayerConfig(readUInt32(f))
-        self.FresnelSelector = FresnelConfig(readUShort(f))
-        self.isClampHighlight = readUByte(f) != 0
-        self.isDistribution0Enabled = readUByte(f) != 0
-        self.isDistribution1Enabled = readUByte(f) != 0
-        self.isGeometricFactor0Enabled = readUByte(f) != 0
-        self.isGeometricFactor1Enabled = readUByte(f) != 0
-        self.IsReflectionEnabled = readUByte(f) != 0
-
-        self.reflectanceRSampler = Sampler().read(f)
-        self.reflectanceGSampler = Sampler().read(f)
-        self.reflectanceBSampler = Sampler().read(f)
-        self.distibution0Sampler = Sampler().read(f)
-        self.distibution1Sampler = Sampler().read(f)
-        self.fresnelSampler      = Sampler().read(f)
-
-        self.texEnvStageCount = readUInt32(f)
-        self.texEnvStagesIndices = [readShort(f) for _ in range(6)]
-
-        self.alphaTestEnabled = readUByte(f) != 0
-        self.alphaTestReferenceValue = readUByte(f) / 255
-        self.alphaTestFunction = TestFunc(readUShort(f))
-        self.depthTestEnabled = readUByte(f) != 0
-        self.depthWriteEnabled = readUByte(f) != 0
-        self.depthTestFunction = TestFunc(readUShort(f))
-        self.blendMode = BlendMode(readUByte(f))
+            self.Unk0 = next(values)
+        self.TextureMappersUsed = next(values)
+        self.TextureCoordsUsed = next(values)
+
+        self.TextureMappers = [TexMapper().readValues(values) for _ in range(3)]
+        self.TextureCoords = [TexCoords().readValues(values) for _ in range(3)]
+
+        self.emissionColor = takeList(values, 4)
+        self.ambientColor = takeList(values, 4)
+        self.diffuseColor = takeList(values, 4)
+        self.specular0Color = takeList(values, 4)
+        self.specular1Color = takeList(values, 4)
+        self.constantColors = [takeList(values, 4) for _ in range(6)]
+        self.bufferColor = takeList(values, 4)
+
+        self.bumpTexture = BumpTexture(next(values))
+        self.bumpMode = BumpMode(next(values))
+        self.isBumpRenormalize = next(values) != 0
+
+        self.layerConfig = LayerConfig(next(values))
+        self.FresnelSelector = FresnelConfig(next(values))
+        self.isClampHighlight = next(values) != 0
+        self.isDistribution0Enabled = next(values) != 0
+        self.isDistribution1Enabled = next(values) != 0
+        self.isGeometricFactor0Enabled = next(values) != 0
+        self.isGeometricFactor1Enabled = next(values) != 0
+        self.IsReflectionEnabled = next(values) != 0
+
+        self.reflectanceRSampler = Sampler().readValues(values)
+        self.reflectanceGSampler = Sampler().readValues(values)
+        self.reflectanceBSampler = Sampler().readValues(values)
+        self.distibution0Sampler = Sampler().readValues(values)
+        self.distibution1Sampler = Sampler().readValues(values)
+        self.fresnelSampler      = Sampler().readValues(values)
+
+        self.texEnvStageCount = next(values)
+        self.texEnvStagesIndices = takeList(values, 6)
+
+        self.alphaTestEnabled = next(values) != 0
+        self.alphaTestReferenceValue = next(values) / 255
+        self.alphaTestFunction = TestFunc(next(values))
+        self.depthTestEnabled = next(values) != 0
+        self.depthWriteEnabled = next(values) != 0
+        self.depthTestFunction = TestFunc(next(values))
+        self.blendMode = BlendMode(next(values))
         align(f)
 
-        self.alphaSrcFunc = BlendFactor(readUShort(f))
-        self.alphaDstFunc = BlendFactor(readUShort(f))
-        self.alphaEquation = BlendEquation(readUInt32(f))
-        self.colorSrcFunc = BlendFactor(readUShort(f))
-        self.colorDstFunc = BlendFactor(readUShort(f))
-        self.colorEquation = BlendEquation(readUInt32(f))
-        self.blendColor = readArray(f, 4)
+        values = readRecord(f, Material.getBlendLayout(Version))
+        self.alphaSrcFunc = BlendFactor(next(values))
+        self.alphaDstFunc = BlendFactor(next(values))
+        self.alphaEquation = BlendEquation(next(values))
+        self.colorSrcFunc = BlendFactor(next(values))
+        self.colorDstFunc = BlendFactor(next(values))
+        self.colorEquation = BlendEquation(next(values))
+        self.blendColor = takeList(values, 4)
 
         if(Version > 6):
-            self.stencilEnabled = readUByte(f) != 0
-            self.stencilReferenceValue = readUByte(f)
-            self.bufferMask = readUByte(f)
-            self.buffer = readUByte(f)
-            self.StencilFunc = TestFunc(readUShort(f))
-            self.failOP = StencilTestOp(readUShort(f))
-            self.zFailOP = StencilTestOp(readUShort(f))
-            self.zPassOP = StencilTestOp(readUShort(f))
-            self.Unk1 = readUInt32(f)# CRC32 of something?
+            self.stencilEnabled = next(values) != 0
+            self.stencilReferenceValue = next(values)
+            self.bufferMask = next(values)
+            self.buffer = next(values)
+            self.StencilFunc = TestFunc(next(values))
+            self.failOP = StencilTestOp(next(values))
+            self.zFailOP = StencilTestOp(next(values))
+            self.zPassOP = StencilTestOp(next(values))
+            self.Unk1 = next(values)# CRC32 of something?
         return self
 
 class Bone(object):
@@ -558,19 +656,27 @@ class Bone(object):
         self.parent = None
         self.children = []
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def getLayout(version):
+        return struct.Struct("<Hh9f" + ("I" if version > 6 else ""))
+
     def read(self,f):
+        return self.readValues(readRecord(f, Bone.getLayout(Version)))
+
+    def readValues(self, values):
         # Because only 12 bits are used, 4095 is the max bone count. (In versions > OoT3D anyway)
-        self.id = readUShort(f)
+        self.id = next(values)
         # Other 4 bits are probably more flags, but they're not used in any of the three games
         # Though I probably missed a few compressed files. It's most likely these flags below:
         # IsSegmentScaleCompensate, IsCompressible, IsNeededRendering, HasSkinningMatrix
         self.hasSkinningMatrix = ((self.id >> 4) & 1) != 0
         self.id = (self.id & 0xFFF)# Get boneID
-        self.parentId = readShort(f)
-        self.scale = readArray(f,3)
-        self.rotation = readArray(f,3)
-        self.translation = applyGlobalScale(readArray(f,3))
-        self.unk0 = readUInt32(f) if (Version > 6) else 0 # I assume a crc32 of the bone name
+        self.parentId = next(values)
+        self.scale = takeList(values, 3)
+        self.rotation = takeList(values, 3)
+        self.translation = applyGlobalScale(takeList(values, 3))
+        self.unk0 = next(values) if (Version > 6) else 0 # I assume a crc32 of the bone name
         return self
 
 class Skl(object):
@@ -587,7 +693,7 @@ class Skl(object):
         self.boneCount = readUInt32(f)
         self.unkFlags  = readUInt32(f)# Only value found is "2", possibly "IsTranslateAnimationEnabled" flag (I can't find a change in-game)
 
-        self.bones = [Bone().read(f) for _ in range(self.boneCount)]
+        self.bones = readRecords(f, Bone, self.boneCount)
         for bone in self.bones:
             if bone.parentId != -1:
                 parent = bone.parent = self.bones[bone.parentId]
@@ -640,10 +746,7 @@ class Mat(object):
         self.chunkSize = readUInt32(f)
         self.matCount = readUInt32(f)
         self.materials = [Material().read(f) for _ in range(self.matCount)]
-        combiners = []
-
-        for m in self.materials:
-            for _ in range(m.texEnvStageCount): combiners.append(Combiner().read(f))
+        combiners = readRecords(f, Combiner, sum(m.texEnvStageCount for m in self.materials))
 
         for m in self.materials:
             m.texEnvStages = []# Make sure combiners are empty
@@ -663,7 +766,7 @@ class Tex(object):
         self.magic = readString(f, 4)
         self.chunkSize = readUInt32(f)
         self.texCount = readUInt32(f)
-        self.textures = [Texture().read(f) for _ in range(self.texCount)]
+        self.textures = readRecords(f, Texture, self.texCount)
         return self
 
 class Mshs(object):
@@ -766,5 +869,35 @@ class Vatr(object):
         self.bWeights = AttributeSlice().read(f)
         return self
 
+# Scene models are stored inside .zsi files, returns where the cmb starts (0 for plain .cmb files)
+def getCmbStartOffset(f):
+    startOff = 0
+    f.seek(0)
+    if readString(f, 4) == "ZSI\x01":
+        f.seek(16)
+        while True:
+
+            cmd0 = readUInt32(f)
+            cmd1 = readUInt32(f)
+
+            cmdType = cmd0 & 0xFF
+
+            if(cmdType == 0x14): break
+            if(cmdType == 0x0A):
+                f.seek(cmd1 + 20)
+                entryOfs = readUInt32(f)
+                f.seek(entryOfs + 24)
+                cmbOfs = readUInt32(f)
+                f.seek(cmbOfs + 16)
+
+                startOff = f.tell()
+                break
+
+    return startOff
+
+def isCmb(f, startOff):
+    f.seek(startOff)
+    return readString(f, 3) == "cmb"
+
 def readCmb(fileio, startOff):
     return Cmb().read(fileio, startOff)
@@ -0,0 +1,185 @@
+import numpy as np
+
+from .cmb import getCmbStartOffset, isCmb, readCmb
+from .cmbEnums import SkinningMode
+from .ctrTexture import DecodeBuffers
+from .skeleton_transforms import getNormalMatrices, getSkeletonWorldTransforms, transformNormals, transformPositions
+from .vertex_decoder import decodeShapeVertices, getVertexBones
+
+# Everything import_cmb builds blender objects from, decoded into plain arrays
+# without touching blender. Parsing, vertex decoding, skinning and texture
+# decoding all happen here, so they can be profiled, cached or run in other
+# processes, and import_cmb only has to copy the arrays into blender data.
+
+class SceneBone(object):
+    def __init__(self):
+        self.id = 0
+        self.parentId = -1
+        self.translation = [0.0, 0.0, 0.0]
+        self.worldTransform = np.identity(4)# (4, 4) float64, laid out like utils.fromTsr
+
+class SceneTexture(object):
+    def __init__(self):
+        self.name = ""
+        self.width = 0
+        self.height = 0
+        self.imageFormat = None
+        self.isETC1 = False
+        self.mipmapCount = 1
+        self.pixels = None# Flat uint8 RGBA of the full size level, None if it wasn't decoded
+
+class SceneMaterial(object):
+    def __init__(self):
+        self.textureIndex = -1# Texture of the first texture mapper
+        self.material = None# The cmb.Material, for everything that isn't used yet. None when loaded from a SceneCache
+
+class SceneMesh(object):
+    def __init__(self):
+        self.index = 0# Draw order
+        self.id = 0# Used for visibility animations
+        self.shapeIndex = 0
+        self.materialIndex = 0
+        self.skinningMode = SkinningMode.Single
+        self.positions = None# (count, 3), with GLOBAL_SCALE and single-bound vertices moved to their bone
+        self.normals = None# (count, 3) or None
+        self.colors = None# (count, 4) float32 or None
+        self.uvLayers = []# (count, 2) arrays, with uv1 and uv2 already flipped
+        self.vertexBones = None# (count, influences) int32 bone ids
+        self.vertexWeights = None# (count, influences) float32
+        self.triangles = None# (triangleCount, 3) int32
+
+class CmbScene(object):
+    def __init__(self):
+        self.name = ""
+        self.cmb = None# Only the name and skeleton are filled in when loaded from a SceneCache
+        self.bones = []
+        self.worldTransforms = None# (boneCount, 4, 4) float64, indexed by bone id
+        self.textures = []
+        self.materials = []
+        self.meshes = []
+
+def readScene(f, textureCache = None, decodeTextures = True, sceneCache = None, decodePool = None):
+    '''Reads the cmb at the current start of f and decodes it into a CmbScene
+
+    If a SceneCache is given and the same file was decoded before, the cmb
+    isn't parsed at all, the whole scene is loaded from the cache.
+    '''
+    startOff = getCmbStartOffset(f)
+    assert isCmb(f, startOff), "Expected magic text to be cmb!"
+    if sceneCache is not None:
+        key = sceneCache.getSceneKey(f, decodeTextures)
+        scene = sceneCache.getScene(key)
+        if scene is not None:
+            return scene
+
+    cmb = readCmb(f, startOff)
+    scene = buildScene(f, cmb, startOff, textureCache, decodeTextures, decodePool)
+    if sceneCache is not None:
+        sceneCache.putScene(key, scene)
+    return scene
+
+def buildScene(f, cmb, startOff, textureCache = None, decodeTextures = True, decodePool = None):
+    scene = CmbScene()
+    scene.name = cmb.name
+    scene.cmb = cmb
+
+    scene.worldTransforms = getSkeletonWorldTransforms(cmb.skeleton)
+    scene.bones = buildBones(cmb, scene.worldTransforms)
+    scene.textures = buildTextures(f, cmb, startOff, textureCache, decodeTextures, decodePool)
+    scene.materials = buildMaterials(cmb)
+
+    normalMatrices = getNormalMatrices(scene.worldTransforms)
+    scene.meshes = [buildMesh(f, cmb, startOff, i, mesh, scene.worldTransforms, normalMatrices) for i, mesh in enumerate(cmb.meshes)]
+    return scene
+
+def buildBones(cmb, worldTransforms):
+    bones = []
+    for bone in cmb.skeleton:
+        b = SceneBone()
+        b.id = bone.id
+        b.parentId = bone.parentId
+        b.translation = bone.translation
+        b.worldTransform = worldTransforms[bone.id]
+        bones.append(b)
+    return bones
+
+def buildTextures(f, cmb, startOff, textureCache = None, decode = True, decodePool = None):
+    '''Returns a SceneTexture for each texture, decoded all at once (in decodePool's workers if given) unless decode is False'''
+    textures = []
+    for t in cmb.textures:
+        texture = SceneTexture()
+        texture.name = t.name
+        texture.width = t.width
+        texture.height = t.height
+        texture.imageFormat = t.imageFormat
+        texture.isETC1 = t.isETC1
+        texture.mipmapCount = t.mimapCount
+        textures.append(texture)
+
+    if decode and cmb.texDataOfs != 0:
+        jobs = []
+        for t in cmb.textures:
+            f.seek(cmb.texDataOfs + t.dataOffset + startOff)
+            jobs.append((f.read(t.dataLength), t.width, t.height, t.imageFormat, t.isETC1))
+        for texture, pixels in zip(textures, DecodeBuffers(jobs, decodePool, textureCache)):
+            texture.pixels = pixels
+
+    return textures
+
+def buildMaterials(cmb):
+    materials = []
+    for m in cmb.materials:
+        material = SceneMaterial()
+        material.textureIndex = m.TextureMappers[0].textureID
+        material.material = m
+        materials.append(material)
+    return materials
+
+def describeMesh(cmb, index, mesh):
+    '''Returns a SceneMesh with everything but its arrays'''
+    sceneMesh = SceneMesh()
+    sceneMesh.index = index
+    sceneMesh.id = mesh.ID
+    sceneMesh.shapeIndex = mesh.shapeIndex
+    sceneMesh.materialIndex = mesh.materialIndex
+    sceneMesh.skinningMode = cmb.shapes[mesh.shapeIndex].primitiveSets[0].skinningMode
+    return sceneMesh
+
+def buildMesh(f, cmb, startOff, index, mesh, worldTransforms, normalMatrices):
+    '''Decodes a mesh's shape, with single-bound vertices moved from their bone's space to the model's'''
+    sceneMesh = describeMesh(cmb, index, mesh)
+    shape = cmb.shapes[mesh.shapeIndex]
+    indices = np.concatenate([np.asarray(pset.primitive.indices, np.int32) for pset in shape.primitiveSets])
+    vertexCount = int(indices.max())+1
+
+    vertices = decodeShapeVertices(f, cmb, shape, vertexCount, startOff)
+
+    # Get bone indices. We need to get these first because-
+    # each primitive has it's own bone table
+    vertexBones, vertexWeights = getVertexBones(shape, vertices)
+
+    positions = vertices.positions
+    normals = vertices.normals
+
+    # Single-bound vertices are stored relative to their bone, all of them are moved at once
+    if(sceneMesh.skinningMode != SkinningMode.Smooth):
+        bones = vertexBones[:, 0]
+        positions = transformPositions(positions, worldTransforms[bones])
+        if normals is not None:
+            normals = transformNormals(normals, normalMatrices[bones])
+
+    uvLayers = []
+    if vertices.uv0 is not None:
+        uvLayers.append(vertices.uv0)
+    for uvs in (vertices.uv1, vertices.uv2):
+        if uvs is not None:
+            uvLayers.append(np.column_stack((uvs[:, 0], 1 - uvs[:, 1])))# Flip Y
+
+    sceneMesh.positions = positions
+    sceneMesh.normals = normals
+    sceneMesh.colors = vertices.colors
+    sceneMesh.uvLayers = uvLayers
+    sceneMesh.vertexBones = vertexBones
+    sceneMesh.vertexWeights = vertexWeights
+    sceneMesh.triangles = indices[:len(indices) - len(indices) % 3].reshape(-1, 3)
+    return sceneMesh
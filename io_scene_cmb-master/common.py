@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 '''Common values and functions used for the CMB/CSAB addons'''
 
-from collections import OrderedDict
-from itertools import cycle
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache
 
-import bpy.path
-from bpy_extras.io_utils import axis_conversion
+try:
+    import bpy.path
+    from bpy_extras.io_utils import axis_conversion
+except ImportError:# Outside of blender, e.g. batch_extract.py
+    axis_conversion = None
 
 from .construct import Adapter, IntegerError
 #from construct import Adapter, IntegerError
@@ -21,7 +24,7 @@ axis_correction_matrix = axis_conversion(
         from_up = 'X',
         to_forward = "-X",
         to_up = "Z"
-).to_4x4()
+).to_4x4() if axis_conversion else None
 
 class ValueHolder:
     '''an empty object to hold values (such as options or Blender data)'''
@@ -112,29 +115,35 @@ def get_bone_ids_in_order(bones_parents_ids):
         In short, the return value's order doesn't matter as long as a parent bone never appears after any of its child bones.
 
     '''
-    #There's probably a more proper way to do this, but this works well enough.
-
-    bone_ids_in_order = []
-    since_added = 0 #used to keep the Blender from hanging if the bone hierarchy is messed up
-
-    #This for loop cycles until all bones are added to the list.
-    for bone_id, parent_id in cycle(bones_parents_ids):
-
-        #Add the root bone right away, or add a bone if its parent has already been already added
-        if (parent_id < 0 or parent_id in bone_ids_in_order) and bone_id not in bone_ids_in_order:
-            bone_ids_in_order.append(bone_id)
-            since_added = 0
+    #The order only depends on the hierarchy, so it's shared by every animation imported onto the same armature.
+    return list(_get_bone_ids_in_order(tuple(tuple(pair) for pair in bones_parents_ids)))
+
+@lru_cache(maxsize=64)
+def _get_bone_ids_in_order(bones_parents_ids):
+    '''get_bone_ids_in_order for a tuple of 2-tuples, walking the hierarchy down from the root bones once'''
+    children = defaultdict(list)
+    roots = []
+    for bone_id, parent_id in bones_parents_ids:
+        if parent_id < 0:
+            roots.append(bone_id)
         else:
-            since_added += 1
+            children[parent_id].append(bone_id)
 
-        #Stop when bone_ids_in_order contains all bone ids
-        if len(bone_ids_in_order) == len(bones_parents_ids):
-            break
-
-        #Abort this script if it looks like it will loop forever without adding any new bones.
-        if since_added > len(bones_parents_ids):
-            raise ValueError("ERROR: Problem with the bone hierarchy. "
-                "Stopping prematurely so this script won't loop forever. "
-                "Bone hierarchy was: {0}".format(bones_parents_ids))
-
-    return bone_ids_in_order
+    bone_ids_in_order = []
+    added = set()
+    queue = deque(roots)
+    while queue:
+        bone_id = queue.popleft()
+        if bone_id in added:
+            continue
+        added.add(bone_id)
+        bone_ids_in_order.append(bone_id)
+        queue.extend(children[bone_id])
+
+    #Bones in a loop, or whose parent doesn't exist, are never reached from a root.
+    if len(bone_ids_in_order) != len(bones_parents_ids):
+        raise ValueError("ERROR: Problem with the bone hierarchy. "
+            "Stopping prematurely so this script won't loop forever. "
+            "Bone hierarchy was: {0}".format(list(bones_parents_ids)))
+
+    return tuple(bone_ids_in_order)
@@ -456,6 +456,7 @@ class Construct(object):
 
         modulename = hexlify(hashlib.sha1(source.encode()).digest()).decode()
         module = imp.new_module(modulename)
+        module.__package__ = __package__# The source imports this package relatively
         c = compile(source, '', 'exec')
         exec(c, module.__dict__)
 
@@ -3977,7 +3978,11 @@ class Aligned(Subconstruct):
             raise SizeofError("cannot calculate size, key not found in context")
 
     def _emitparse(self, code):
-        return "(%s, read_bytes(io, -(%s) %% (%s) ))[0]" % (self.subcon._compileparse(code), self.subcon.sizeof(), self.modulus, )
+        try:
+            return "(%s, read_bytes(io, -(%s) %% (%s) ))[0]" % (self.subcon._compileparse(code), self.subcon.sizeof(), self.modulus, )
+        except SizeofError:
+            # Variable size (e.g. an array counted by another field), pad by how much was actually read
+            return "(lambda position1: (%s, read_bytes(io, -(io.tell() - position1) %% (%s) ))[0])(io.tell())" % (self.subcon._compileparse(code), self.modulus, )
 
 
 def AlignedStruct(modulus, *subcons, **subconskw):
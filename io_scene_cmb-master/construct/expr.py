@@ -126,6 +126,11 @@ class ExprMixin(object):
             setattr(self, name, value)
 
 
+def _operandstr(operand):
+    # Expressions are emitted as code, constants (e.g. strings) must be quoted
+    return str(operand) if isinstance(operand, ExprMixin) else repr(operand)
+
+
 class UniExpr(ExprMixin):
 
     def __init__(self, op, operand):
@@ -136,7 +141,7 @@ class UniExpr(ExprMixin):
         return "%s %r" % (opnames[self.op], self.operand)
 
     def __str__(self):
-        return "%s %s" % (opnames[self.op], self.operand)
+        return "%s %s" % (opnames[self.op], _operandstr(self.operand))
 
     def __call__(self, obj, *args):
         operand = self.operand(obj) if callable(self.operand) else self.operand
@@ -154,7 +159,7 @@ class BinExpr(ExprMixin):
         return "(%r %s %r)" % (self.lhs, opnames[self.op], self.rhs)
 
     def __str__(self):
-        return "(%s %s %s)" % (self.lhs, opnames[self.op], self.rhs)
+        return "(%s %s %s)" % (_operandstr(self.lhs), opnames[self.op], _operandstr(self.rhs))
 
     def __call__(self, obj, *args):
         lhs = self.lhs(obj) if callable(self.lhs) else self.lhs
@@ -5,11 +5,12 @@ The same format is used in Majora's Mask 3D, but this hasn't been tested with th
 '''
 #To those trying to read the source: start at the bottom (at csab_file) and work your way up.
 
+import hashlib, marshal, os, sys, time, types
+
 try:
     from .construct import * #For running this script as a module imported by a Blender addon
 except ModuleNotFoundError:
     from construct import * #For running this script directly
-    import sys
 
 frame_type1 = Struct(
     "num" / Int32ul, #frame number
@@ -148,21 +149,130 @@ csab_file = Struct(
     "animations" / csab_animation[this.num_animations]
 )
 
+#Where the compiled parser's bytecode is cached, next to this module's own bytecode
+COMPILED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+#The construct modules that generate the compiled code, it changes whenever they do
+CONSTRUCT_SOURCES = ("core.py", "expr.py")
+
+_compiled_csab_file = None
+
+def get_user_cache_dir():
+    '''returns the directory in blender's user config to cache the compiled parser in when the addon's own isn't writable, or None outside of blender'''
+    try:
+        import bpy
+    except ImportError:
+        return None
+    return bpy.utils.user_resource('CONFIG', "oot3d_csab_parser", create=True)
+
+def get_compiled_cache_key():
+    '''returns the hash of everything the compiled parser's code depends on'''
+    construct_dir = os.path.dirname(os.path.abspath(sys.modules[Construct.__module__].__file__))
+    key = hashlib.sha1()
+    for path in (__file__,) + tuple(os.path.join(construct_dir, name) for name in CONSTRUCT_SOURCES):
+        with open(path, 'rb') as f:
+            key.update(hashlib.sha1(f.read()).digest())
+    key.update(version_string.encode())
+    key.update(sys.version.encode())
+    return key.hexdigest()
+
+def get_compiled_csab_file(cache_dirs=None):
+    '''returns csab_file compiled into Python code by construct, which parses the same but much faster
+
+    The code is generated once, then its bytecode is cached on disk. The cache is keyed by this file (which defines the schema), the construct modules that generate the code, the construct version and the Python version, so it's regenerated whenever any of them change. It's cached next to this module's bytecode, or in blender's user config if the addon is installed somewhere read-only.
+    '''
+    global _compiled_csab_file
+    if _compiled_csab_file is not None:
+        return _compiled_csab_file
+
+    if cache_dirs is None:
+        cache_dirs = [COMPILED_CACHE_DIR]
+        user_cache_dir = get_user_cache_dir()
+        if user_cache_dir:
+            cache_dirs.append(user_cache_dir)
+
+    filename = "csab_file.{0}.marshal".format(get_compiled_cache_key())
+    code = None
+    for cache_dir in cache_dirs:
+        try:
+            with open(os.path.join(cache_dir, filename), 'rb') as f:
+                code = marshal.load(f)
+            break
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    if code is None:
+        compiled = csab_file.compile()
+        assert not compiled.module.linkedinstances, "csab_file didn't compile fully, its code can't be cached"
+        code = compile(compiled.source, '', 'exec')
+        for cache_dir in cache_dirs:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                cache_path = os.path.join(cache_dir, filename)
+                temp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+                with open(temp_path, 'wb') as f:
+                    marshal.dump(code, f)
+                os.replace(temp_path, cache_path)
+                break
+            except OSError as e: #e.g. a read-only addons directory, try the next one
+                print("Could not cache the compiled csab parser in {0}: {1}".format(cache_dir, e))
+
+    module = types.ModuleType("csab_file_compiled")
+    module.__package__ = Construct.__module__.rpartition('.')[0] #The code imports construct relatively
+    exec(code, module.__dict__)
+    module.linkedinstances = {}
+    module.linkedparsers = {}
+
+    _compiled_csab_file = module.compiled
+    _compiled_csab_file.defersubcon = csab_file
+    return _compiled_csab_file
+
 def parse(filename):
     '''parses the csab file and returns the parsed contents'''
     with open(filename, 'rb') as f:
         data = f.read()
-    return csab_file.parse(data)
+    return get_compiled_csab_file().parse(data)
 
 def parse_and_print(filename): #test function
     '''parses the csab file and prints its contents'''
-    with open(filename, 'rb') as f:
-        data = f.read()
-    csab_parsed = csab_file.parse(data)
-    print(csab_parsed)
+    print(parse(filename))
+
+def benchmark(filenames, repeat=3):
+    '''parses every file with both the interpreted and the compiled csab_file, checks they agree, and returns a report of their throughput'''
+    datas = []
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            datas.append(f.read())
+    total_bytes = sum(len(data) for data in datas)
+
+    start = time.perf_counter()
+    compiled = get_compiled_csab_file()
+    compile_time = time.perf_counter() - start
+
+    for filename, data in zip(filenames, datas):
+        assert csab_file.parse(data) == compiled.parse(data), "Compiled parser disagrees on {0}".format(filename)
+
+    lines = ["Parsed {0} files ({1} bytes), best of {2} runs:".format(len(datas), total_bytes, repeat)]
+    times = []
+    for name, parser in (("interpreted", csab_file), ("compiled", compiled)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for data in datas:
+                parser.parse(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        lines.append("  {0:<12} {1:8.3f}s {2:10.1f} files/s {3:8.2f} MB/s".format(
+            name, best, len(datas) / max(best, 1e-9), total_bytes / max(best, 1e-9) / 1e6))
+    lines.append("  compiled is {0:.1f}x faster (getting the compiled parser took {1:.3f}s)".format(times[0] / max(times[1], 1e-9), compile_time))
+    return '\n'.join(lines)
 
 if __name__ == '__main__':
     args = sys.argv[1:]
+    if args and args[0] == '--benchmark':
+        print(benchmark(args[1:]))
+        sys.exit()
     if args:
         PATH = args[0]
     else:
@@ -1,6 +1,8 @@
 # Shamelessly based on https://github.com/magcius/noclip.website/blob/e7da91f0d8fcef6ea58659e991fd6408b940194e/src/oot3d/csab.ts
 
 import math
+import numpy as np
+from bisect import bisect_right
 from .io_utils import (readDataType, readString, readArray, readFloat, readSn16, readUn16,
                     readInt16, readUInt16, readUInt32, readInt32, readUShort,
                     readShort, readByte, readUByte)
@@ -26,17 +28,59 @@ class AnimationTrackLinear:
     def __init__(self):
         self.type = ANIMATION_TRACK_TYPE_LINEAR
         self.frames = []
+        self.sampler = None
 
 class AnimationTrackHermite:
     def __init__(self):
         self.type = ANIMATION_TRACK_TYPE_HERMITE
         self.timeEnd = -1
         self.frames = []
+        self.sampler = None
 
 class AnimationTrackInteger:
     def __init__(self):
         self.type = ANIMATION_TRACK_TYPE_INTEGER
         self.frames = []
+        self.sampler = None
+
+
+class AnimationTrackSampler:
+    '''Finds the keyframes around a frame of a track
+
+    Keyframe times are kept in a sorted list and searched with bisect. The
+    result is also remembered, so sampling frames in increasing order (like
+    when baking a whole animation) only walks forward from the last keyframe
+    found, which is O(frames + keyframes) for the whole sweep.
+    '''
+    def __init__(self, frames):
+        self.times = [key.time for key in frames]
+        self.isSorted = all(t0 <= t1 for t0, t1 in zip(self.times, self.times[1:]))
+        self.lastFrame = None
+        self.cursor = 0
+
+    # Returns the index of the first keyframe after frame, or -1 if there isn't one
+    def findNextKeyframe(self, frame):
+        times = self.times
+
+        if not self.isSorted:
+            # Never seen in practice, but keep the first-match semantics of a linear scan
+            return next((i for i, time in enumerate(times) if frame < time), -1)
+
+        if self.lastFrame is not None and frame >= self.lastFrame:
+            i = self.cursor
+            while i < len(times) and times[i] <= frame:
+                i += 1
+        else:
+            i = bisect_right(times, frame)
+
+        self.lastFrame = frame
+        self.cursor = i
+        return i if i < len(times) else -1
+
+def getTrackSampler(track):
+    if track.sampler is None:
+        track.sampler = AnimationTrackSampler(track.frames)
+    return track.sampler
 
 
 LOOP_MODE_ONCE = 0
@@ -264,6 +308,20 @@ def getAnimFrame(anim, frame):
         assert False, "Unexpected loop mode type!"
 
 
+def getAnimFrames(anim, frames):
+    '''Same as getAnimFrame, for an array of frames'''
+    frames = np.asarray(frames, np.float64)
+    lastFrame = anim.duration
+    if anim.loopMode == LOOP_MODE_ONCE:
+        return np.minimum(frames, lastFrame)
+    elif anim.loopMode == LOOP_MODE_REPEAT:
+        # How many times lastFrame would be subtracted
+        loops = np.maximum(np.ceil((frames - lastFrame) / lastFrame), 0)
+        return frames - loops * lastFrame
+    else:
+        assert False, "Unexpected loop mode type!"
+
+
 
 def sampleAnimationTrack(track, frame):
     if track.type == ANIMATION_TRACK_TYPE_LINEAR:
@@ -277,12 +335,7 @@ def sampleAnimationTrackLinear(track, frame):
     frames = track.frames
 
     # Find the first frame.
-    # TODO: Slow, only calculate this once.
-    idx1 = None
-    try:
-        idx1 = next(i for i, key in enumerate(frames) if frame < key.time)
-    except:
-        idx1 = -1
+    idx1 = getTrackSampler(track).findNextKeyframe(frame)
 
     if idx1 == 0:
         return frames[0].value
@@ -304,12 +357,7 @@ def sampleAnimationTrackHermite(track, frame):
     frames = track.frames
 
     # Find the first frame.
-    # TODO: Slow, only calculate this once.
-    idx1 = None
-    try:
-        idx1 = next(i for i, key in enumerate(frames) if frame < key.time)
-    except:
-        idx1 = -1
+    idx1 = getTrackSampler(track).findNextKeyframe(frame)
 
     if idx1 <= 0:
         k0 = frames[len(frames) - 1]
@@ -344,6 +392,13 @@ def getPointHermite(p0, p1, s0, s1, t):
 def getPointCubic(cf0, cf1, cf2, cf3, t):
     return (((cf0 * t + cf1) * t + cf2) * t + cf3)
 
+# Derivative of getPointHermite with respect to t
+def getSlopeHermite(p0, p1, s0, s1, t):
+    cf0 = (p0 *  2) + (p1 * -2) + (s0 *  1) +  (s1 *  1)
+    cf1 = (p0 * -3) + (p1 *  3) + (s0 * -2) +  (s1 * -1)
+    cf2 = (p0 *  0) + (p1 *  0) + (s0 *  1) +  (s1 *  0)
+    return ((cf0 * 3 * t + cf1 * 2) * t + cf2)
+
 
 
 def sampleAnimationTrackRotation(track, frame):
@@ -358,12 +413,7 @@ def sampleAnimationTrackLinearRotation(track, frame):
     frames = track.frames
 
     # Find the first frame.
-    # TODO: Slow, only calculate this once.
-    idx1 = None
-    try:
-        idx1 = next(i for i, key in enumerate(frames) if frame < key.time)
-    except:
-        idx1 = -1
+    idx1 = getTrackSampler(track).findNextKeyframe(frame)
 
     if idx1 == 0:
         return frames[0].value
@@ -388,12 +438,7 @@ def sampleAnimationTrackHermiteRotation(track, frame):
     frames = track.frames
 
     # Find the first frame.
-    # TODO: Slow, only calculate this once.
-    idx1 = None
-    try:
-        idx1 = next(i for i, key in enumerate(frames) if frame < key.time)
-    except:
-        idx1 = -1
+    idx1 = getTrackSampler(track).findNextKeyframe(frame)
 
     if idx1 <= 0:
         k0 = frames[len(frames) - 1]
@@ -415,6 +460,142 @@ def sampleAnimationTrackHermiteRotation(track, frame):
     return hermiteInterpolate(r0, k0.tangentOut, r1, k1.tangentIn, t, length)
 
 
+# The functions below sample a track at every frame of an array at once, the
+# same as calling the functions above for each frame. They all work on arrays.
+
+def sampleAnimationTrackFrames(track, frames):
+    return __sampleAnimationTrackFrames(track, frames, False)
+
+def sampleAnimationTrackRotationFrames(track, frames):
+    return __sampleAnimationTrackFrames(track, frames, True)
+
+def __sampleAnimationTrackFrames(track, frames, isRotation):
+    frames = np.asarray(frames, np.float64)
+    if track.type != ANIMATION_TRACK_TYPE_LINEAR and track.type != ANIMATION_TRACK_TYPE_HERMITE:
+        assert False, "Unsupported animation track type to sample!"
+
+    if not getTrackSampler(track).isSorted:
+        sample = sampleAnimationTrackRotation if isRotation else sampleAnimationTrack
+        return np.array([sample(track, frame) for frame in frames], np.float64)
+
+    times = np.array([key.time for key in track.frames], np.float64)
+    values = np.array([key.value for key in track.frames], np.float64)
+    last = len(times) - 1
+    if last < 0:
+        raise IndexError("Track has no keyframes")
+
+    # Index of the first keyframe after each frame, len(times) if there isn't one
+    idx1 = np.searchsorted(times, frames, side='right')
+
+    if track.type == ANIMATION_TRACK_TYPE_LINEAR:
+        idx0 = np.clip(idx1 - 1, 0, last)
+        idx1Clipped = np.minimum(idx1, last)
+
+        r0 = values[idx0]
+        r1 = values[idx1Clipped]
+        # Frames before the first or after the last keyframe are masked out below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (frames - times[idx0]) / (times[idx1Clipped] - times[idx0])
+
+            if isRotation:
+                # Fixes gimbal lock
+                r1 = r0 + differenceInRadians(r1, r0)
+                samples = lerpAngle(r0, r1, t, 2 * math.pi)
+            else:
+                samples = lerp_keyframe_linear(r0, r1, t)
+
+        samples = np.where(idx1 == 0, values[0], samples)
+        return np.where(idx1 > last, values[last], samples)
+
+    # Hermite tracks wrap around from the last keyframe to the first
+    wraps = (idx1 == 0) | (idx1 > last)
+    idx0 = np.where(wraps, last, idx1 - 1)
+    idx1 = np.where(wraps, 0, idx1)
+
+    length = times[idx1] - times[idx0] % track.timeEnd
+    if np.any(length == 0):
+        raise ZeroDivisionError("float division by zero")
+    t = (frames - times[idx0]) / length
+
+    r0 = values[idx0]
+    r1 = values[idx1]
+    if isRotation:
+        # Fixes gimbal lock
+        r1 = r0 + differenceInRadians(r1, r0)
+
+    tangentsIn = np.array([key.tangentIn for key in track.frames], np.float64)
+    tangentsOut = np.array([key.tangentOut for key in track.frames], np.float64)
+    return hermiteInterpolate(r0, tangentsOut[idx0], r1, tangentsIn[idx1], t, length)
+
+def sampleAnimationTrackSlopeFrames(track, frames, side = 'right'):
+    return __sampleAnimationTrackSlopeFrames(track, frames, False, side)
+
+def sampleAnimationTrackRotationSlopeFrames(track, frames, side = 'right'):
+    return __sampleAnimationTrackSlopeFrames(track, frames, True, side)
+
+# The slope of the curve the functions above sample, per frame, at every frame
+# of an array. On a keyframe, side='right' gives the slope leaving it and
+# side='left' the slope coming into it.
+def __sampleAnimationTrackSlopeFrames(track, frames, isRotation, side):
+    frames = np.asarray(frames, np.float64)
+    if track.type != ANIMATION_TRACK_TYPE_LINEAR and track.type != ANIMATION_TRACK_TYPE_HERMITE:
+        assert False, "Unsupported animation track type to sample!"
+
+    if not getTrackSampler(track).isSorted:
+        epsilon = 1e-3
+        sample = sampleAnimationTrackRotation if isRotation else sampleAnimationTrack
+        offset = epsilon if side == 'right' else -epsilon
+        return np.array([(sample(track, frame + offset) - sample(track, frame)) / offset for frame in frames], np.float64)
+
+    times = np.array([key.time for key in track.frames], np.float64)
+    values = np.array([key.value for key in track.frames], np.float64)
+    last = len(times) - 1
+    if last < 0:
+        raise IndexError("Track has no keyframes")
+
+    idx1 = np.searchsorted(times, frames, side=side)
+
+    if track.type == ANIMATION_TRACK_TYPE_LINEAR:
+        idx0 = np.clip(idx1 - 1, 0, last)
+        idx1Clipped = np.minimum(idx1, last)
+
+        r0 = values[idx0]
+        r1 = values[idx1Clipped]
+        if isRotation:
+            # Same distance lerpAngle covers
+            r1 = r0 + differenceInRadians(r1, r0)
+            da = (r1 - r0) % (2 * math.pi)
+            distance = (2 * da) % (2 * math.pi) - da
+        else:
+            distance = r1 - r0
+
+        # Tracks are flat before the first and after the last keyframe
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = distance / (times[idx1Clipped] - times[idx0])
+        return np.where((idx1 == 0) | (idx1 > last), 0.0, slopes)
+
+    wraps = (idx1 == 0) | (idx1 > last)
+    idx0 = np.where(wraps, last, idx1 - 1)
+    idx1 = np.where(wraps, 0, idx1)
+
+    length = times[idx1] - times[idx0] % track.timeEnd
+    r0 = values[idx0]
+    r1 = values[idx1]
+    if isRotation:
+        # Fixes gimbal lock
+        r1 = r0 + differenceInRadians(r1, r0)
+
+    tangentsIn = np.array([key.tangentIn for key in track.frames], np.float64)
+    tangentsOut = np.array([key.tangentOut for key in track.frames], np.float64)
+
+    # The wrapped segment coming into the first keyframe can have no length, its slope is never used
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (frames - times[idx0]) / length
+        slopes = getSlopeHermite(r0, r1, tangentsOut[idx0] * length, tangentsIn[idx1] * length, t) / length
+    return np.where(length != 0, slopes, 0.0)
+
+
+
 def differenceInRadians(lhs, rhs):
   pi = math.pi
   pi2 = 2 * math.pi
@@ -0,0 +1,348 @@
+import numpy as np
+
+from .array_utils import (fromEulerAnglesArray, fromEulerAnglesSlopesArray, invertQuaternions, makeQuaternionsContinuous,
+                          multiplyQuaternions, normalizeQuaternions, quaternionsToMatrices)
+from .common import GLOBAL_SCALE
+from .csab2 import (LOOP_MODE_ONCE, getAnimFrames, getPointHermite, sampleAnimationTrackFrames, sampleAnimationTrackRotationFrames,
+                    sampleAnimationTrackRotationSlopeFrames, sampleAnimationTrackSlopeFrames)
+from .skeleton_transforms import fromTsrArray, getWorldTransforms
+
+class BakedAnimation(object):
+    def __init__(self):
+        self.name = None# Name of the action it's imported as, set by the importer
+        self.duration = 0# Last frame of the animation
+        self.frames = None# (frameCount,) frame indices that were sampled
+        self.translations = None# (frameCount, boneCount, 3) pose bone locations
+        self.rotations = None# (frameCount, boneCount, 4) pose bone quaternions (w, x, y, z), with continuous signs
+
+class RestPose(object):
+    def __init__(self, skeleton):
+        rotations = fromEulerAnglesArray(np.reshape([bone.rotation for bone in skeleton], (-1, 3)))
+        self.rotations = rotations# (boneCount, 4) rest pose quaternions (w, x, y, z)
+        self.inverseRotations = invertQuaternions(rotations)# (boneCount, 4) quaternions that revert the rest pose
+        self.matrices = quaternionsToMatrices(rotations)# (boneCount, 3, 3) rest pose rotations
+
+class SparseChannel(object):
+    def __init__(self):
+        self.frames = None# (keyCount,) frames that need a keyframe
+        self.values = None# (keyCount,) values at those frames
+        self.slopesIn = None# (keyCount,) slope of the curve coming into each keyframe, per frame
+        self.slopesOut = None# (keyCount,) slope of the curve leaving each keyframe, per frame
+
+class SparseAnimation(object):
+    def __init__(self):
+        self.name = None# Name of the action it's imported as, set by the importer
+        self.duration = 0# Last frame of the animation
+        self.frames = None# (frameCount,) frame indices the channels were fit to
+        self.translations = {}# bone id -> 3 SparseChannels for the pose bone location
+        self.rotations = {}# bone id -> 4 SparseChannels for the pose bone quaternion (w, x, y, z)
+
+def sampleChannels(tracks, defaults, animFrames, scale = 1.0, isRotation = False):
+    '''Samples up to three tracks at every frame, as a (frameCount, 3) array
+
+    Channels without a track keep their default value the whole time.
+    '''
+    sample = sampleAnimationTrackRotationFrames if isRotation else sampleAnimationTrackFrames
+    values = np.empty((len(animFrames), 3))
+    values[:] = defaults
+    for axis, track in enumerate(tracks):
+        if track is not None:
+            values[:, axis] = sample(track, animFrames) * scale
+    return values
+
+def sampleChannelSlopes(tracks, animFrames, side, scale = 1.0, isRotation = False):
+    '''Returns the slopes of up to three tracks at every frame, per frame, as a (frameCount, 3) array
+
+    side is 'right' for the slopes leaving each frame or 'left' for the slopes
+    coming into it. Channels without a track don't change.
+    '''
+    sample = sampleAnimationTrackRotationSlopeFrames if isRotation else sampleAnimationTrackSlopeFrames
+    slopes = np.zeros((len(animFrames), 3))
+    for axis, track in enumerate(tracks):
+        if track is not None:
+            slopes[:, axis] = sample(track, animFrames, side) * scale
+    return slopes
+
+def bakeAnimation(csab, skeleton, frames = None, restPose = None):
+    '''Samples every bone of an animation for every frame at once
+
+    The results match what CsabAnimationHelper.getBoneTranslation and
+    getBoneQuaternion return for each bone and frame, but every track is only
+    looked at once and sampled for all frames together. Rotations are already
+    sign-flipped so consecutive frames never take the long way around. By
+    default, frames 0 through csab.duration are sampled. The skeleton's
+    RestPose can be passed in when baking many animations for it.
+    '''
+    if frames is None:
+        frames = np.arange(csab.duration + 1)
+    frames = np.asarray(frames)
+    animFrames = getAnimFrames(csab, frames)
+    frameCount = len(frames)
+    boneCount = len(skeleton)
+
+    if restPose is None:
+        restPose = RestPose(skeleton)
+    inverseRestRotations = restPose.inverseRotations
+    restMatrices = restPose.matrices
+
+    translations = np.zeros((frameCount, boneCount, 3))
+    rotations = np.zeros((frameCount, boneCount, 4))
+    rotations[..., 0] = 1.0# Bones without animation stay in their rest pose
+
+    for bone in skeleton:
+        animIndex = csab.boneToAnimationTable[bone.id]
+        if animIndex < 0:
+            continue
+        node = csab.animationNodes[animIndex]
+
+        # Channels without a track keep the rest pose's values
+        translation = sampleChannels((node.translationX, node.translationY, node.translationZ), bone.translation, animFrames, GLOBAL_SCALE)
+
+        # Counteracts the original translation, both are rotated by the rest pose
+        translations[:, bone.id] = translation.dot(restMatrices[bone.id]) - np.dot(bone.translation, restMatrices[bone.id])
+
+        euler = sampleChannels((node.rotationX, node.rotationY, node.rotationZ), bone.rotation, animFrames, isRotation = True)
+
+        # Reverts the rest pose, see CsabAnimationHelper.getBoneQuaternion
+        q = normalizeQuaternions(fromEulerAnglesArray(euler))
+        rotations[:, bone.id] = multiplyQuaternions(inverseRestRotations[bone.id], q)
+
+    baked = BakedAnimation()
+    baked.duration = csab.duration
+    baked.frames = frames
+    baked.translations = translations
+    baked.rotations = makeQuaternionsContinuous(rotations)
+    return baked
+
+def bakeLocalTransforms(csab, skeleton, frames = None, restPose = None):
+    '''Returns the (frameCount, boneCount, 4, 4) local transform of every bone on every frame
+
+    Each matrix matches CsabAnimationHelper.calcBoneMatrix for that bone and
+    frame. By default, frames 0 through csab.duration are sampled.
+    '''
+    if frames is None:
+        frames = np.arange(csab.duration + 1)
+    animFrames = getAnimFrames(csab, frames)
+    frameCount = len(animFrames)
+    boneCount = len(skeleton)
+
+    if restPose is None:
+        restPose = RestPose(skeleton)
+    restMatrices = restPose.matrices
+
+    translations = np.zeros((frameCount, boneCount, 3))
+    scales = np.empty((frameCount, boneCount, 3))
+    rotations = np.zeros((frameCount, boneCount, 3))
+    for bone in skeleton:
+        animIndex = csab.boneToAnimationTable[bone.id]
+        node = csab.animationNodes[animIndex] if animIndex >= 0 else None
+        if node is None:
+            scales[:, bone.id] = bone.scale
+            continue
+
+        translation = sampleChannels((node.translationX, node.translationY, node.translationZ), bone.translation, animFrames, GLOBAL_SCALE)
+        translations[:, bone.id] = translation.dot(restMatrices[bone.id]) - np.dot(bone.translation, restMatrices[bone.id])
+        scales[:, bone.id] = sampleChannels((node.scaleX, node.scaleY, node.scaleZ), bone.scale, animFrames)
+
+        # Rotations are relative to the rest pose, channels without a track don't rotate
+        rotations[:, bone.id] = sampleChannels((node.rotationX, node.rotationY, node.rotationZ), bone.rotation, animFrames, isRotation = True) - bone.rotation
+
+    return fromTsrArray(translations, scales, rotations)
+
+def bakeWorldTransforms(csab, skeleton, frames = None, restPose = None):
+    '''Returns the (frameCount, boneCount, 4, 4) world transform of every bone on every frame
+
+    Same as getWorldTransformCsab for each bone and frame, but every local
+    transform is only built once and all frames are combined with their
+    parents together.
+    '''
+    return getWorldTransforms(skeleton, bakeLocalTransforms(csab, skeleton, frames, restPose))
+
+def getAnimFrameSpeeds(csab, frames):
+    '''Returns how fast the animation's own frame advances coming into and leaving each frame, as (speedsIn, speedsOut)
+
+    Animations that play once stop on their last frame, repeating ones always advance.
+    '''
+    frames = np.asarray(frames, np.float64)
+    if csab.loopMode == LOOP_MODE_ONCE:
+        return (frames <= csab.duration).astype(np.float64), (frames < csab.duration).astype(np.float64)
+    return np.ones(len(frames)), np.ones(len(frames))
+
+def bakeAnimationSlopes(csab, skeleton, baked, restPose = None):
+    '''Returns the slopes coming into and leaving each frame of a baked animation, per frame
+
+    Keyframes where the curve has a kink (like between two linear segments, or
+    a hermite keyframe with different in and out tangents) get both sides.
+    Locations are the translation tracks rotated by the rest pose, so their
+    slopes are the tracks' own slopes rotated the same way. Quaternion slopes
+    are worked out from the rotation tracks' slopes with the chain rule.
+    '''
+    frames = np.asarray(baked.frames, np.float64)
+    animFrames = getAnimFrames(csab, frames)
+    frameCount = len(frames)
+    boneCount = len(skeleton)
+    if restPose is None:
+        restPose = RestPose(skeleton)
+
+    speedsIn, speedsOut = getAnimFrameSpeeds(csab, frames)
+    sides = (('left', speedsIn), ('right', speedsOut))# Coming into and leaving each frame
+    translations = np.zeros((2, frameCount, boneCount, 3))
+    euler = np.zeros((frameCount, boneCount, 3))
+    eulerSlopes = np.zeros((2, frameCount, boneCount, 3))
+    for bone in skeleton:
+        animIndex = csab.boneToAnimationTable[bone.id]
+        if animIndex < 0:
+            continue
+        node = csab.animationNodes[animIndex]
+        translationTracks = (node.translationX, node.translationY, node.translationZ)
+        rotationTracks = (node.rotationX, node.rotationY, node.rotationZ)
+
+        euler[:, bone.id] = sampleChannels(rotationTracks, bone.rotation, animFrames, isRotation = True)
+        for i, (side, speeds) in enumerate(sides):
+            speeds = speeds[:, np.newaxis]
+            translation = sampleChannelSlopes(translationTracks, animFrames, side, GLOBAL_SCALE) * speeds
+            translations[i, :, bone.id] = translation.dot(restPose.matrices[bone.id])
+            eulerSlopes[i, :, bone.id] = sampleChannelSlopes(rotationTracks, animFrames, side, isRotation = True) * speeds
+
+    # Bones without animation keep zero euler slopes, so their quaternion slopes are zero too
+    rotations = multiplyQuaternions(restPose.inverseRotations, fromEulerAnglesSlopesArray(euler, eulerSlopes))
+
+    # The bake flips quaternions to keep them continuous, their slopes flip with them
+    q = multiplyQuaternions(restPose.inverseRotations, fromEulerAnglesArray(euler))
+    rotations[:, np.sum(q * baked.rotations, -1) < 0] *= -1
+
+    slopesIn = BakedAnimation()
+    slopesOut = BakedAnimation()
+    for i, slopes in enumerate((slopesIn, slopesOut)):
+        slopes.frames = baked.frames
+        slopes.translations = translations[i]
+        slopes.rotations = rotations[i]
+    return slopesIn, slopesOut
+
+def getTrackKeyframeIndices(tracks, frames, animFrames):
+    '''Returns the indices of the frames that land on a keyframe of any of the tracks
+
+    The first and last frames are always included, as are the frames on both
+    sides of a jump back to the start of a repeating animation.
+    '''
+    times = np.unique([key.time for track in tracks if track is not None for key in track.frames])
+    if len(times) > 0:
+        found = times[np.minimum(np.searchsorted(times, animFrames), len(times) - 1)]
+        isKeyframe = found == animFrames
+    else:
+        isKeyframe = np.zeros(len(frames), np.bool_)
+
+    isKeyframe[0] = isKeyframe[-1] = True
+    jumps = np.flatnonzero(np.diff(animFrames) != np.diff(frames))
+    isKeyframe[jumps] = True
+    isKeyframe[jumps + 1] = True
+    return np.flatnonzero(isKeyframe)
+
+def simplifyChannels(frames, values, slopesIn, slopesOut, isKey, tolerances):
+    '''Picks the keyframes of many channels at once, starting from the frames where isKey is set
+
+    values, slopesIn, slopesOut and isKey are (frameCount, channelCount)
+    arrays, and tolerances has one tolerance for each channel. While the curve
+    through a channel's keyframes is further than its tolerance from its baked
+    values on some frame, the worst frame of each segment that's off is made a
+    keyframe too. In the worst case, every frame ends up a keyframe. Returns a
+    SparseChannel for each channel.
+    '''
+    # Works on (channelCount, frameCount) arrays, so each channel's segments are runs of its row
+    frames = np.asarray(frames, np.float64)
+    values = np.ascontiguousarray(np.transpose(values))
+    slopesIn = np.ascontiguousarray(np.transpose(slopesIn))
+    slopesOut = np.ascontiguousarray(np.transpose(slopesOut))
+    isKey = np.array(np.transpose(isKey), np.bool_)
+    isKey[:, 0] = isKey[:, -1] = True
+    channelCount, frameCount = values.shape
+    tolerances = np.broadcast_to(np.asarray(tolerances, np.float64), (channelCount,))
+    indices = np.arange(frameCount)
+
+    active = np.arange(channelCount)# Channels that were still off somewhere on the last pass
+    while len(active) > 0:
+        # The keyframes on either side of each frame, keyframes are their own segment
+        keys = isKey[active]
+        i0 = np.maximum.accumulate(np.where(keys, indices, 0), 1)
+        i1 = np.minimum.accumulate(np.where(keys, indices, frameCount - 1)[:, ::-1], 1)[:, ::-1]
+        length = frames[i1] - frames[i0]
+        length[length == 0] = 1.0
+        t = (frames - frames[i0]) / length
+        rows = active[:, np.newaxis]
+        curve = getPointHermite(values[rows, i0], values[rows, i1],
+                                slopesOut[rows, i0] * length, slopesIn[rows, i1] * length, t)
+        error = np.abs(curve - values[active])
+        error[error <= tolerances[rows]] = 0.0
+        if not error.any():
+            break
+
+        # Makes the first of the worst frames of each segment that's off a keyframe
+        error = error.ravel()
+        segments = (np.arange(len(active))[:, np.newaxis] * frameCount + i0).ravel()
+        starts = np.flatnonzero(np.r_[True, segments[1:] != segments[:-1]])
+        worst = np.maximum.reduceat(error, starts)
+        isWorst = (error == np.repeat(worst, np.diff(np.r_[starts, len(error)]))) & (error > 0)
+        candidates = np.flatnonzero(isWorst)
+        candidates = candidates[np.r_[True, segments[candidates[1:]] != segments[candidates[:-1]]]]
+        rowIndices, frameIndices = np.divmod(candidates, frameCount)
+        isKey[active[rowIndices], frameIndices] = True
+        active = active[np.unique(rowIndices)]
+
+    channels = []
+    for c in range(channelCount):
+        keys = np.flatnonzero(isKey[c])
+        channel = SparseChannel()
+        channel.frames = frames[keys]
+        channel.values = values[c, keys]
+        channel.slopesIn = slopesIn[c, keys]
+        channel.slopesOut = slopesOut[c, keys]
+        channels.append(channel)
+    return channels
+
+def bakeSparseAnimation(csab, skeleton, translationTolerance = 1e-4, rotationTolerance = 1e-4, restPose = None):
+    '''Bakes an animation down to only the keyframes it needs, with hermite tangents
+
+    Every channel starts with keyframes where the bone's original tracks have
+    one. Since the quaternion conversion doesn't keep curves hermite, more
+    keyframes are added until the curve is within tolerance of the full bake on
+    every frame. Locations are in blender units, so they get their own
+    translationTolerance, while rotationTolerance applies to each quaternion
+    component.
+    '''
+    if restPose is None:
+        restPose = RestPose(skeleton)
+    baked = bakeAnimation(csab, skeleton, restPose = restPose)
+    slopesIn, slopesOut = bakeAnimationSlopes(csab, skeleton, baked, restPose)
+    frames = np.asarray(baked.frames, np.float64)
+    animFrames = getAnimFrames(csab, frames)
+    frameCount = len(frames)
+    boneCount = len(skeleton)
+
+    # Every bone's 3 location and 4 quaternion channels are simplified together
+    isKey = np.zeros((frameCount, boneCount, 7), np.bool_)
+    tolerances = np.empty((boneCount, 7))
+    tolerances[:, :3] = translationTolerance
+    tolerances[:, 3:] = rotationTolerance
+    for bone in skeleton:
+        animIndex = csab.boneToAnimationTable[bone.id]
+        node = csab.animationNodes[animIndex] if animIndex >= 0 else None
+
+        if node is not None:
+            isKey[getTrackKeyframeIndices((node.translationX, node.translationY, node.translationZ), frames, animFrames), bone.id, :3] = True
+            isKey[getTrackKeyframeIndices((node.rotationX, node.rotationY, node.rotationZ), frames, animFrames), bone.id, 3:] = True
+        else:
+            isKey[getTrackKeyframeIndices((), frames, animFrames), bone.id] = True
+
+    def getChannels(animation):
+        return np.concatenate((animation.translations, animation.rotations), -1).reshape(frameCount, -1)
+
+    channels = simplifyChannels(frames, getChannels(baked), getChannels(slopesIn), getChannels(slopesOut),
+                                isKey.reshape(frameCount, -1), tolerances.ravel())
+
+    sparse = SparseAnimation()
+    sparse.duration = csab.duration
+    sparse.frames = baked.frames
+    for bone in skeleton:
+        sparse.translations[bone.id] = channels[7 * bone.id:7 * bone.id + 3]
+        sparse.rotations[bone.id] = channels[7 * bone.id + 3:7 * bone.id + 7]
+    return sparse
@@ -1,4 +1,8 @@
-import struct, array
+import math, multiprocessing, os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from .cmbEnums import GLTextureFormat
 #Ported from SPICA (https://github.com/gdkchan/SPICA)
 
@@ -37,289 +41,389 @@ def getFmtBPP(format):
     elif(format & 0xFFFF == GLTextureFormat.ETC1):   return 4
     else: return 8
 
-def __Swap64(Value):
-    Value = ((Value & 0xffffffff00000000) >> 32) | ((Value & 0x00000000ffffffff) << 32)
-    Value = ((Value & 0xffff0000ffff0000) >> 16) | ((Value & 0x0000ffff0000ffff) << 16)
-    Value = ((Value & 0xff00ff00ff00ff00) >>  8) | ((Value & 0x00ff00ff00ff00ff) <<  8)
-    return Value
-
-def __CastSByte(value):
-    if(value < -127): return value + 255
-    elif(value > 127): return value - 255
-    return value
-
-def __GetUShort(Buffer, Address):
-    return int((Buffer[Address + 0] << 0 | Buffer[Address + 1] << 8))
-
-def __ReadULong(b):
-    return struct.unpack("<Q", bytearray(b))[0]
-
-def __SetColor(Buffer, Address, A, B, G, R):
-    Buffer[Address + 0] = B
-    Buffer[Address + 1] = G
-    Buffer[Address + 2] = R
-    Buffer[Address + 3] = A
-
-def __DecodeRGBA5551(Buffer, Address, Value):
-    R = ((Value >>  1) & 0x1f) << 3
-    G = ((Value >>  6) & 0x1f) << 3
-    B = ((Value >> 11) & 0x1f) << 3
-
-    __SetColor(Buffer, Address, (Value & 1) * 0xff,
-                B | (B >> 5),
-                G | (G >> 5),
-                R | (R >> 5))
-
-def __DecodeRGB565(Buffer, Address, Value):
-    R = ((Value >>  0) & 0x1f) << 3
-    G = ((Value >>  5) & 0x3f) << 2
-    B = ((Value >> 11) & 0x1f) << 3
-
-    __SetColor(Buffer, Address, 0xff,
-                B | (B >> 5),
-                G | (G >> 6),
-                R | (R >> 5))
-
-def __DecodeRGBA4(Buffer, Address, Value):
-    R = (Value >>  4) & 0xf
-    G = (Value >>  8) & 0xf
-    B = (Value >> 12) & 0xf
-
-    __SetColor(Buffer, Address, (Value & 0xf) | (Value << 4),
-                B | (B << 4),
-                G | (G << 4),
-                R | (R << 4))
+@lru_cache(maxsize=32)
+def __GetETC1Map(width, height):
+    '''Returns where each pixel of each 4x4 ETC1 block goes in the output, and whether it's in bounds
 
-def __ETC1Decompress(Input, Width, Height, Alpha):
-    Offset = 0
-    Output = [0 for x in range(Width * Height * 4)]
-
-    for TY in range(0, Height, 8):
-        for TX in range(0, Width, 8):
-            for T in range(4):
-                AlphaBlock = 0xffffffffffffffff
-                col = []
-                alp = []
-
-                if (Alpha):
-                    for _ in range(8):
-                        alp.append(Input[Offset])
-                        Offset += 1
-                    AlphaBlock = __ReadULong(alp)
-
-                for _ in range(8):
-                    col.append(Input[Offset])
-                    Offset += 1
-
-                ColorBlock = __Swap64(__ReadULong(col))
-                Tile = __ETC1Tile(ColorBlock)
-                TileOffset = 0
+    Blocks are stored four per 8x8 tile, and the output is flipped vertically.
+    '''
+    tilesX = (width + 7) // 8
+    tilesY = (height + 7) // 8
+    Block = np.arange(tilesX * tilesY * 4)
+    TY, TX = np.divmod(Block // 4, tilesX)
+    T = Block % 4
 
-                for PY in range(YT[T], 4 + YT[T], 1):
-                    for PX in range(XT[T], 4 + XT[T], 1):
-                        OOffs = ((Height - 1 - (TY + PY)) * Width + TX + PX) * 4
+    # Pixels within a block are row-major
+    X = np.tile(np.arange(4), 4)
+    Y = np.repeat(np.arange(4), 4)
 
-                        Output[OOffs + 0] = Tile[TileOffset + 0] / 255
-                        Output[OOffs + 1] = Tile[TileOffset + 1] / 255
-                        Output[OOffs + 2] = Tile[TileOffset + 2] / 255
+    PX = (TX * 8 + np.array(XT)[T])[:, None] + X[None, :]
+    PY = (TY * 8 + np.array(YT)[T])[:, None] + Y[None, :]
+    valid = ((PX < width) & (PY < height)).ravel()
+    dest = ((height - 1 - PY) * width + PX).ravel()
+    return dest[valid], valid
 
-                        AlphaShift = ((PX & 3) * 4 + (PY & 3)) << 2
+def __SignExtend3(Value):
+    return np.where(Value >= 4, Value - 8, Value)
 
-                        A = (AlphaBlock >> AlphaShift) & 0xf
-
-                        Output[OOffs + 3] = int((A << 4) | A) / 255
-
-                        TileOffset += 4
-
-    return Output
+def __ETC1Decompress(Input, Width, Height, Alpha):
+    '''Decodes all the 4x4 blocks of an ETC1(A4) texture at once into a (Width * Height, 4) uint8 array'''
+    dest, valid = __GetETC1Map(Width, Height)
+    BlockCount = valid.size // 16
+    BlockSize = 16 if Alpha else 8
+    Blocks = Input[:BlockCount * BlockSize].reshape(BlockCount, BlockSize)
+
+    # Pixel coordinates within a block, in output order
+    X = np.tile(np.arange(4), 4)
+    Y = np.repeat(np.arange(4), 4)
+
+    # ETC1A4 blocks are prefixed by 16 4-bit alpha values, column-major
+    if (Alpha):
+        AlphaWords = np.ascontiguousarray(Blocks[:, :8]).view("<u4").astype(np.int64)
+        AlphaShift = (X * 4 + Y) << 2
+        A = np.where(AlphaShift < 32,
+                     AlphaWords[:, 0:1] >> (AlphaShift & 31),
+                     AlphaWords[:, 1:2] >> (AlphaShift & 31)) & 0xf
+        A = (A << 4) | A
+    else:
+        A = np.full((BlockCount, 16), 0xff, np.int64)
 
-def __ETC1Tile(Block):
-    BlockLow  = Block >> 32
-    BlockHigh = Block >>  0
+    # The color block is read as a big-endian 64-bit value
+    ColorWords = np.ascontiguousarray(Blocks[:, -8:]).view(">u4").astype(np.int64)
+    BlockLow  = ColorWords[:, 0]
+    BlockHigh = ColorWords[:, 1]
 
     Flip = (BlockHigh & 0x1000000) != 0
     Diff = (BlockHigh & 0x2000000) != 0
 
-    R1, G1, B1 = 0, 0, 0
-    R2, G2, B2 = 0, 0, 0
+    # Differential mode: 5-bit base color plus a signed 3-bit delta
+    B1d = (BlockHigh & 0x0000f8) >> 0
+    G1d = (BlockHigh & 0x00f800) >> 8
+    R1d = (BlockHigh & 0xf80000) >> 16
 
-    if (Diff):
-        B1 = (BlockHigh & 0x0000f8) >> 0
-        G1 = (BlockHigh & 0x00f800) >> 8
-        R1 = (BlockHigh & 0xf80000) >> 16
+    B2d = (B1d >> 3) + __SignExtend3((BlockHigh & 0x000007) >>  0)
+    G2d = (G1d >> 3) + __SignExtend3((BlockHigh & 0x000700) >>  8)
+    R2d = (R1d >> 3) + __SignExtend3((BlockHigh & 0x070000) >> 16)
 
-        #CAST AS SBYTE IS THE ISSUE
+    B1d |= B1d >> 5
+    G1d |= G1d >> 5
+    R1d |= R1d >> 5
 
-        B2 = int(__CastSByte(B1 >> 3) + (__CastSByte((BlockHigh & 0x000007) <<  5) >> 5))
-        G2 = int(__CastSByte(G1 >> 3) + (__CastSByte((BlockHigh & 0x000700) >>  3) >> 5))
-        R2 = int(__CastSByte(R1 >> 3) + (__CastSByte((BlockHigh & 0x070000) >> 11) >> 5))
+    B2d = (B2d << 3) | (B2d >> 2)
+    G2d = (G2d << 3) | (G2d >> 2)
+    R2d = (R2d << 3) | (R2d >> 2)
 
-        B1 |= B1 >> 5
-        G1 |= G1 >> 5
-        R1 |= R1 >> 5
+    # Individual mode: two 4-bit base colors
+    B1i = (BlockHigh & 0x0000f0) >> 0
+    G1i = (BlockHigh & 0x00f000) >> 8
+    R1i = (BlockHigh & 0xf00000) >> 16
 
-        B2 = (B2 << 3) | (B2 >> 2)
-        G2 = (G2 << 3) | (G2 >> 2)
-        R2 = (R2 << 3) | (R2 >> 2)
-    else:
-        B1 = (BlockHigh & 0x0000f0) >> 0
-        G1 = (BlockHigh & 0x00f000) >> 8
-        R1 = (BlockHigh & 0xf00000) >> 16
+    B2i = (BlockHigh & 0x00000f) << 4
+    G2i = (BlockHigh & 0x000f00) >> 4
+    R2i = (BlockHigh & 0x0f0000) >> 12
 
-        B2 = (BlockHigh & 0x00000f) << 4
-        G2 = (BlockHigh & 0x000f00) >> 4
-        R2 = (BlockHigh & 0x0f0000) >> 12
+    B1i |= B1i >> 4
+    G1i |= G1i >> 4
+    R1i |= R1i >> 4
 
-        B1 |= B1 >> 4
-        G1 |= G1 >> 4
-        R1 |= R1 >> 4
+    B2i |= B2i >> 4
+    G2i |= G2i >> 4
+    R2i |= R2i >> 4
 
-        B2 |= B2 >> 4
-        G2 |= G2 >> 4
-        R2 |= R2 >> 4
+    # (BlockCount, 2 subblocks, 3 channels), channels in output order
+    Base = np.stack((
+        np.stack((np.where(Diff, B1d, B1i), np.where(Diff, G1d, G1i), np.where(Diff, R1d, R1i)), axis=-1),
+        np.stack((np.where(Diff, B2d, B2i), np.where(Diff, G2d, G2i), np.where(Diff, R2d, R2i)), axis=-1),
+    ), axis=1)
+    Table = np.stack(((BlockHigh >> 29) & 7, (BlockHigh >> 26) & 7), axis=1)
 
-    Table1 = (BlockHigh >> 29) & 7
-    Table2 = (BlockHigh >> 26) & 7
+    # Subblocks are side by side, or on top of each other when flipped
+    Subblock = np.where(Flip[:, None], (Y >= 2)[None, :], (X >= 2)[None, :]).astype(np.int64)
 
+    # Each pixel picks one of four modifiers with two bits, which are
+    # column-major in the low word of the block
+    Index = X * 4 + Y
+    LsbShift = np.where(Index < 8, Index + 24, Index + 8)
+    MsbShift = np.where(Index < 8, Index + 8, Index - 8)
+    Lsb = (BlockLow[:, None] >> LsbShift) & 1
+    Msb = ((BlockLow[:, None] << 1) >> MsbShift) & 2
 
-    Output = [0 for x in range(4 * 4 * 4)]
+    Rows = np.arange(BlockCount)[:, None]
+    Modifier = np.array(ETC1LUT)[Table[Rows, Subblock], Lsb + Msb]
+    Color = np.clip(Base[Rows, Subblock] + Modifier[:, :, None], 0, 255)
 
-    if (Flip == False):
-        for Y in range(4):
-            for X in range(2):
+    Pixels = np.concatenate((Color, A[:, :, None]), axis=-1).reshape(-1, 4)
 
-                Color1 = __ETC1Pixel(R1, G1, B1, X + 0, Y, BlockLow, Table1)
-                Color2 = __ETC1Pixel(R2, G2, B2, X + 2, Y, BlockLow, Table2)
+    Output = np.zeros((Width * Height, 4), np.uint8)
+    Output[dest] = Pixels[valid]
+    return Output
 
-                Offset1 = (Y * 4 + X) * 4
+@lru_cache(maxsize=32)
+def __GetUntileMap(width, height):
+    '''Returns where each pixel of a tiled texture goes in the output, and whether it's in bounds
+
+    Pixels are stored in 8x8 tiles, swizzled in Z-order within each tile. The
+    output is flipped vertically, since blender expects the bottom row first.
+    '''
+    swizzle = np.array(SwizzleLUT)
+    X = swizzle & 7
+    Y = swizzle >> 3
+
+    tilesX = (width + 7) // 8
+    tilesY = (height + 7) // 8
+    TY, TX = np.divmod(np.arange(tilesX * tilesY), tilesX)
+
+    PX = (TX * 8)[:, None] + X[None, :]
+    PY = (TY * 8)[:, None] + Y[None, :]
+    valid = ((PX < width) & (PY < height)).ravel()
+    dest = ((height - 1 - PY) * width + PX).ravel()
+    return dest[valid], valid
+
+def __ToByteArray(Input):
+    if isinstance(Input, np.ndarray):
+        return Input.astype(np.uint8, copy=False).ravel()
+    if isinstance(Input, (bytes, bytearray, memoryview)):
+        return np.frombuffer(Input, np.uint8)
+    return np.array(Input, np.uint8)
+
+def __DecodePixels(Input, count, format):
+    '''Decodes count pixels, in storage order, into a (count, 4) uint8 RGBA array'''
+    Increment = getFmtBPP(format) / 8
+    Data = Input[:int(math.ceil(count * Increment))]
+    Output = np.zeros((count, 4), np.uint8)
+
+    if(format == GLTextureFormat.RGBA8):
+        Output[:] = Data.reshape(count, 4)[:, ::-1]
+    elif(format == GLTextureFormat.RGB8):
+        Output[:, :3] = Data.reshape(count, 3)[:, ::-1]
+        Output[:, 3] = 0xff
+    elif(format in (GLTextureFormat.RGBA5551, GLTextureFormat.RGB565, GLTextureFormat.RGBA4444)):
+        Value = Data.view("<u2").astype(np.uint32)
+
+        if(format == GLTextureFormat.RGBA5551):
+            R = ((Value >>  1) & 0x1f) << 3
+            G = ((Value >>  6) & 0x1f) << 3
+            B = ((Value >> 11) & 0x1f) << 3
+            Output[:, 0] = B | (B >> 5)
+            Output[:, 1] = G | (G >> 5)
+            Output[:, 2] = R | (R >> 5)
+            Output[:, 3] = (Value & 1) * 0xff
+        elif(format == GLTextureFormat.RGB565):
+            R = ((Value >>  0) & 0x1f) << 3
+            G = ((Value >>  5) & 0x3f) << 2
+            B = ((Value >> 11) & 0x1f) << 3
+            Output[:, 0] = B | (B >> 5)
+            Output[:, 1] = G | (G >> 6)
+            Output[:, 2] = R | (R >> 5)
+            Output[:, 3] = 0xff
+        else:
+            R = (Value >>  4) & 0xf
+            G = (Value >>  8) & 0xf
+            B = (Value >> 12) & 0xf
+            A = Value & 0xf
+            Output[:, 0] = B | (B << 4)
+            Output[:, 1] = G | (G << 4)
+            Output[:, 2] = R | (R << 4)
+            Output[:, 3] = A | (A << 4)
+    elif(format == GLTextureFormat.LA8):
+        Data = Data.reshape(count, 2)
+        Output[:, :3] = Data[:, 1:2]
+        Output[:, 3] = Data[:, 0]
+    elif(format in (GLTextureFormat.L8, GLTextureFormat.Gas, GLTextureFormat.Shadow)):
+        Output[:, :3] = Data[:, None]
+        Output[:, 3] = 0xff
+    elif(format == GLTextureFormat.A8):
+        Output[:, :3] = 0xff
+        Output[:, 3] = Data
+    elif(format == GLTextureFormat.LA4):
+        Output[:, :3] = ((Data >> 4) | (Data & 0xf0))[:, None]
+        Output[:, 3] = (Data << 4) | (Data & 0x0f)
+    elif(format in (GLTextureFormat.L4, GLTextureFormat.A4)):
+        # Two pixels per byte, low nibble first
+        Nibbles = np.empty(Data.size * 2, np.uint8)
+        Nibbles[0::2] = Data & 0xf
+        Nibbles[1::2] = Data >> 4
+        Nibbles = Nibbles[:count]
+        if(format == GLTextureFormat.L4):
+            Output[:, :3] = ((Nibbles << 4) | Nibbles)[:, None]
+            Output[:, 3] = 0xff
+        else:
+            Output[:, :3] = 0xff
+            Output[:, 3] = (Nibbles << 4) | Nibbles
 
-                Output[Offset1 + 0] = Color1[2]
-                Output[Offset1 + 1] = Color1[1]
-                Output[Offset1 + 2] = Color1[0]
+    return Output
 
-                Offset2 = (Y * 4 + X + 2) * 4
+def __DecodeBufferRGBA(Input, width, height, format, isETC1):
+    #Note: I don't think HiLo8 exist for .cmb
 
-                Output[Offset2 + 0] = Color2[2]
-                Output[Offset2 + 1] = Color2[1]
-                Output[Offset2 + 2] = Color2[0]
-    else:
-        for Y in range(2):
-            for X in range(4):
-                Color1 = __ETC1Pixel(R1, G1, B1, X, Y + 0, BlockLow, Table1)
-                Color2 = __ETC1Pixel(R2, G2, B2, X, Y + 2, BlockLow, Table2)
+    # Is ETC1(a4)
+    if(isETC1):
+        return __ETC1Decompress(__ToByteArray(Input), width, height, ((format & 0xFFFF) == 26459)).ravel()
 
-                Offset1 = (Y * 4 + X) * 4
+    dest, valid = __GetUntileMap(width, height)
+    Pixels = __DecodePixels(__ToByteArray(Input), valid.size, format)
 
-                Output[Offset1 + 0] = Color1[2]
-                Output[Offset1 + 1] = Color1[1]
-                Output[Offset1 + 2] = Color1[0]
+    Output = np.zeros((width * height, 4), np.uint8)
+    Output[dest] = Pixels[valid]
+    return Output.ravel()
 
-                Offset2 = ((Y + 2) * 4 + X) * 4
+def DecodeBufferRGBA(Input, width, height, format, isETC1, cache = None):
+    '''Decodes a texture into a flat uint8 RGBA array, bottom row first
 
-                Output[Offset2 + 0] = Color2[2]
-                Output[Offset2 + 1] = Color2[1]
-                Output[Offset2 + 2] = Color2[0]
+    If a TextureCache is given, it's checked before decoding and updated after.
+    '''
+    if cache is None:
+        return __DecodeBufferRGBA(Input, width, height, format, isETC1)
 
+    key = cache.getKey(Input, width, height, format, isETC1)
+    Output = cache.get(key, width, height)
+    if Output is None:
+        Output = __DecodeBufferRGBA(Input, width, height, format, isETC1)
+        cache.put(key, Output)
     return Output
 
-def __ETC1Pixel(R, G, B, X, Y, Block, Table):
-    Index = X * 4 + Y
-    MSB = Block << 1
-
-    if Index < 8:
-        Pixel = ETC1LUT[Table][((Block >> (Index + 24)) & 1) + ((MSB >> (Index + 8)) & 2)]
-    else:
-        Pixel = ETC1LUT[Table][((Block >> (Index +  8)) & 1) + ((MSB >> (Index - 8)) & 2)]
-
-    R = __Saturate(int((R + Pixel)))
-    G = __Saturate(int((G + Pixel)))
-    B = __Saturate(int((B + Pixel)))
-
-    return ((R, G, B))
-
-def __Saturate(Value):
-    if (Value > 255): return 255
-    if (Value < 0): return 0
-    return Value
-
-def DecodeBuffer(Input, width, height, format, isETC1):
-        #Note: I don't think HiLo8 exist for .cmb
-
-        Increment = int(getFmtBPP(format) / 8)
-        if (Increment == 0): Increment = 1
-        Output = [0 for x in range(width * height * 4)]
-        IOffs = 0
-
-        # Is ETC1(a4)
-        if(isETC1):
-            return __ETC1Decompress(Input, width, height, ((format & 0xFFFF) == 26459))
-
-        for TY in range(0, height, 8):
-            for TX in range(0, width, 8):
-                for Px in range(64):
-                    X =  SwizzleLUT[Px] & 7
-                    Y = (SwizzleLUT[Px] - X) >> 3
-
-                    OOffs = int((TX + X + ((height - 1 - (TY + Y)) * width)) * 4)
-
-                    if(format == GLTextureFormat.RGBA8):#RGBA8
-                        Output[OOffs + 0] = Input[IOffs + 3]
-                        Output[OOffs + 1] = Input[IOffs + 2]
-                        Output[OOffs + 2] = Input[IOffs + 1]
-                        Output[OOffs + 3] = Input[IOffs + 0]
-                    elif(format == GLTextureFormat.RGB8):#RGB8
-                        Output[OOffs + 0] = Input[IOffs + 2]
-                        Output[OOffs + 1] = Input[IOffs + 1]
-                        Output[OOffs + 2] = Input[IOffs + 0]
-                        Output[OOffs + 3] = 0xff
-                    elif(format == GLTextureFormat.RGBA5551): __DecodeRGBA5551(Output, OOffs, __GetUShort(Input, IOffs))
-                    elif(format == GLTextureFormat.RGB565):   __DecodeRGB565(Output, OOffs, __GetUShort(Input, IOffs))
-                    elif(format == GLTextureFormat.RGBA4444): __DecodeRGBA4(Output, OOffs, __GetUShort(Input, IOffs))
-                    elif(format == GLTextureFormat.LA8):#LA8
-                        Output[OOffs + 0] = Input[IOffs + 1]
-                        Output[OOffs + 1] = Input[IOffs + 1]
-                        Output[OOffs + 2] = Input[IOffs + 1]
-                        Output[OOffs + 3] = Input[IOffs + 0]
-                    elif(format == GLTextureFormat.L8):#L8
-                        Output[OOffs + 0] = Input[IOffs]
-                        Output[OOffs + 1] = Input[IOffs]
-                        Output[OOffs + 2] = Input[IOffs]
-                        Output[OOffs + 3] = 0xff
-                    elif(format == GLTextureFormat.A8):#A8
-                        Output[OOffs + 0] = 0xff
-                        Output[OOffs + 1] = 0xff
-                        Output[OOffs + 2] = 0xff
-                        Output[OOffs + 3] = Input[IOffs]
-                    elif(format == GLTextureFormat.LA4):#LA4
-                        Output[OOffs + 0] = ((Input[IOffs] >> 4) | (Input[IOffs] & 0xf0))
-                        Output[OOffs + 1] = ((Input[IOffs] >> 4) | (Input[IOffs] & 0xf0))
-                        Output[OOffs + 2] = ((Input[IOffs] >> 4) | (Input[IOffs] & 0xf0))
-                        Output[OOffs + 3] = ((Input[IOffs] << 4) | (Input[IOffs] & 0x0f))
-                    elif(format == GLTextureFormat.L4):#L4
-                        L = (Input[IOffs >> 1] >> ((IOffs & 1) << 2)) & 0xf
-
-                        Output[OOffs + 0] = ((L << 4) | L)
-                        Output[OOffs + 1] = ((L << 4) | L)
-                        Output[OOffs + 2] = ((L << 4) | L)
-                        Output[OOffs + 3] = 0xff
-                    elif(format == GLTextureFormat.A4):#L4
-                        A = (Input[IOffs >> 1] >> ((IOffs & 1) << 2)) & 0xf
-
-                        Output[OOffs + 0] = 0xff
-                        Output[OOffs + 1] = 0xff
-                        Output[OOffs + 2] = 0xff
-                        Output[OOffs + 3] = ((A << 4) | A)
-                    elif(format == GLTextureFormat.Gas or format == GLTextureFormat.Shadow):
-                        Output[OOffs + 0] = Input[IOffs]
-                        Output[OOffs + 1] = Input[IOffs]
-                        Output[OOffs + 2] = Input[IOffs]
-                        Output[OOffs + 3] = 0xff
-
-                    #Convert to float for blender
-                    Output[OOffs + 0] /= 255
-                    Output[OOffs + 1] /= 255
-                    Output[OOffs + 2] /= 255
-                    Output[OOffs + 3] /= 255
-
-                    IOffs += Increment
-        return Output
+# Every uint8 channel value as the float blender uses, so converting is a single lookup
+FloatLUT = np.arange(256, dtype=np.float32) / 255
+
+def RGBAToFloat(Pixels):
+    '''Converts uint8 RGBA pixels to a contiguous float32 array of the values blender uses'''
+    return FloatLUT[np.asarray(Pixels, np.uint8)]
+
+def DecodeBuffer(Input, width, height, format, isETC1, cache = None):
+    '''Decodes a texture into a flat float32 RGBA array, bottom row first like blender expects'''
+    #Convert to float for blender
+    return RGBAToFloat(DecodeBufferRGBA(Input, width, height, format, isETC1, cache))
+
+class MipLevel(object):
+    def __init__(self, index, offset, size, width, height):
+        self.index = index# 0 is the full size level
+        self.offset = offset# Where the level starts in the texture's data
+        self.size = size# Bytes used by the level
+        self.width = width
+        self.height = height
+
+def getMipLevels(width, height, mipmapCount, format, dataLength = None):
+    '''Returns the MipLevels stored one after another in a texture's data, largest first
+
+    Each level is half the size of the one before it. Levels are made of whole
+    8x8 tiles, so smaller ones can't be stored and the chain stops there. It
+    also stops at dataLength, if given, in case mimapCount is off.
+    '''
+    bpp = getFmtBPP(format)
+    levels = []
+    offset = 0
+    for level in range(max(mipmapCount, 1)):
+        levelWidth = max(width >> level, 1)
+        levelHeight = max(height >> level, 1)
+        if level > 0 and (levelWidth < 8 or levelHeight < 8):
+            break
+
+        size = ((levelWidth + 7) // 8 * 8) * ((levelHeight + 7) // 8 * 8) * bpp // 8
+        if level > 0 and dataLength is not None and offset + size > dataLength:
+            break
+
+        levels.append(MipLevel(level, offset, size, levelWidth, levelHeight))
+        offset += size
+    return levels
+
+def selectMipLevel(levels, targetSize):
+    '''Returns the index of the level whose largest side is closest to targetSize, preferring the larger of two equally close levels'''
+    targetSize = max(targetSize, 1)
+    distances = [abs(math.log2(max(level.width, level.height) / targetSize)) for level in levels]
+    return min(range(len(levels)), key=lambda i: (distances[i], i))
+
+def DecodeMipLevelsRGBA(Input, width, height, mipmapCount, format, isETC1, cache = None, targetSize = None):
+    '''Decodes the mip levels of a texture, as (MipLevel, flat uint8 RGBA array) pairs
+
+    Every level is decoded, unless a targetSize is given, in which case only
+    the level closest to it is. Small levels are much cheaper to decode than
+    the full size one, e.g. for previews.
+    '''
+    levels = getMipLevels(width, height, mipmapCount, format, len(Input))
+    if targetSize is not None:
+        levels = [levels[selectMipLevel(levels, targetSize)]]
+
+    return [(level, DecodeBufferRGBA(Input[level.offset:level.offset + level.size], level.width, level.height, format, isETC1, cache))
+            for level in levels]
+
+def __DecodeJob(job):
+    return __DecodeBufferRGBA(*job)
+
+class DecodePool(object):
+    '''Worker processes for DecodeBuffers, shared by every model of an import
+
+    The processes are only started the first time there's more than one
+    texture to decode, and are kept until close() instead of starting new ones
+    for each model. Workers must be forked: inside blender, spawning a fresh
+    interpreter would start another copy of blender instead. Forking blender,
+    which has other threads and a GL context, can leave a worker stuck on a
+    lock one of them held, so the importers only use a DecodePool when asked.
+    '''
+    def __init__(self, maxWorkers = None):
+        self.maxWorkers = maxWorkers or os.cpu_count() or 1
+        self.__executor = None
+        self.__failed = False
+
+    def getExecutor(self):
+        '''Returns the ProcessPoolExecutor, starting it if needed, or None if worker processes aren't available'''
+        if self.__executor is None and not self.__failed:
+            if self.maxWorkers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+                self.__failed = True
+                return None
+            try:
+                self.__executor = ProcessPoolExecutor(self.maxWorkers, mp_context=multiprocessing.get_context("fork"))
+            except TypeError:# mp_context is new in Python 3.7, older versions always fork on POSIX
+                self.__executor = ProcessPoolExecutor(self.maxWorkers)
+        return self.__executor
+
+    def fail(self, error):
+        '''Stops using worker processes after they failed'''
+        print("Could not decode textures in parallel, decoding them one at a time: {}".format(error))
+        self.close()
+        self.__failed = True
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def DecodeBuffers(jobs, pool = None, cache = None):
+    '''Decodes several textures at once, in a DecodePool's worker processes if one is given
+
+    jobs is a list of (Input, width, height, format, isETC1) tuples, and the
+    decoded flat uint8 RGBA arrays are returned in the same order. Textures are
+    decoded on this process if there's no pool, or its workers aren't
+    available. If a TextureCache is given, only the textures missing from it
+    are decoded.
+    '''
+    Outputs = [None] * len(jobs)
+    keys = [None] * len(jobs)
+    if cache is not None:
+        for i, job in enumerate(jobs):
+            keys[i] = cache.getKey(*job)
+            Outputs[i] = cache.get(keys[i], job[1], job[2])
+
+    missing = [i for i, Output in enumerate(Outputs) if Output is None]
+    for i, Output in zip(missing, __DecodeJobs([jobs[i] for i in missing], pool)):
+        Outputs[i] = Output
+        if cache is not None:
+            cache.put(keys[i], Output)
+
+    return Outputs
+
+def __DecodeJobs(jobs, pool):
+    if pool is not None and len(jobs) > 1:
+        try:
+            executor = pool.getExecutor()
+            if executor is not None:
+                return list(executor.map(__DecodeJob, jobs))
+        except (OSError, BrokenProcessPool) as e:
+            pool.fail(e)
+
+    return [__DecodeJob(job) for job in jobs]
@@ -1,10 +1,12 @@
-import sys, os, array, bpy, bmesh, operator, math, mathutils
-
-from .cmb import readCmb
-from .ctrTexture import DecodeBuffer
-from .cmbEnums import SkinningMode, DataTypes
-from .utils import (getWorldTransformCmb, transformPosition, transformNormal)
-from .io_utils import (readArray, readDataType, readUInt32, readString, getFlag, getDataTypeSize)
+import sys, os, time, array, bpy, bmesh, operator, math, mathutils
+import numpy as np
+
+from .array_buffer_slice import mapFile
+from .cmb_scene import readScene
+from .ctrTexture import DecodePool, RGBAToFloat
+from .scene_cache import SceneCache
+from .texture_cache import TextureCache
+from .utils import transformPosition
 from .common import CLIP_START, CLIP_END, GLOBAL_SCALE
 
 #TODO: Clean up
@@ -23,44 +25,50 @@ def load_cmb( operator, context ):
 
     bpy.context.scene.render.engine = 'CYCLES'# Idc if you don't like cycles
 
-    for f in enumerate(operator.files):
-        fpath = operator.directory + f[1].name
-        LoadModel(fpath)
-        return {"FINISHED"}
-
-def LoadModel(filepath):
-    with open(filepath, "rb") as f:
-        return LoadModelFromStream(f)
-
-def LoadModelFromStream(f):
-    startOff = 0
-    if readString(f, 4) == "ZSI\x01":
-        f.seek(16)
-        while True:
-
-            cmd0 = readUInt32(f)
-            cmd1 = readUInt32(f)
-
-            cmdType = cmd0 & 0xFF
-            print(cmdType)
-
-            if(cmdType == 0x14): break
-            if(cmdType == 0x0A):
-                f.seek(cmd1 + 20)
-                entryOfs = readUInt32(f)
-                f.seek(entryOfs + 24)
-                cmbOfs = readUInt32(f)
-                f.seek(cmbOfs + 16)
-
-                startOff = f.tell()
-                break
-
-    f.seek(startOff)
-    assert readString(f, 3) == "cmb", "Expected magic text to be cmb!"
-    f.seek(startOff)
+    decodePool = getDecodePool(operator)
+    try:
+        for f in enumerate(operator.files):
+            fpath = operator.directory + f[1].name
+            LoadModel(fpath, operator.mesh_builder, getTextureCache(operator), getSceneCache(operator), getBuildTimeReport(operator), decodePool)
+            return {"FINISHED"}
+    finally:
+        if decodePool is not None:
+            decodePool.close()
+
+def getTextureCache(operator):
+    '''Returns the decoded texture cache, kept next to blender's user config, if it's enabled'''
+    if not operator.use_texture_cache:
+        return None
+    return TextureCache(bpy.utils.user_resource('CONFIG', "oot3d_texture_cache", create=True))
+
+def getSceneCache(operator):
+    '''Returns the decoded model and animation cache, kept next to blender's user config, if it's enabled'''
+    if not operator.use_scene_cache:
+        return None
+    return SceneCache(bpy.utils.user_resource('CONFIG', "oot3d_scene_cache", create=True))
+
+def getDecodePool(operator):
+    '''Returns worker processes to decode textures in, if the operator asked for them'''
+    if not operator.decode_in_workers:
+        return None
+    return DecodePool()
+
+def getBuildTimeReport(operator):
+    '''Returns the operator's report function if it should report how long building meshes took'''
+    return operator.report if operator.report_build_time else None
+
+def LoadModel(filepath, meshBuilder = 'BULK', textureCache = None, sceneCache = None, report = None, decodePool = None):
+    with mapFile(filepath) as bytes:
+        return LoadModelFromStream(bytes.toStream(), meshBuilder, textureCache, sceneCache, report, decodePool)
+
+# meshBuilder is either 'BULK' (foreach_set from arrays) or 'BMESH' (one element at a time)
+# report is an Operator.report-like function to report the time building meshes took to, if any
+# decodePool is a ctrTexture.DecodePool to decode textures in, they're decoded on this process without one
+def LoadModelFromStream(f, meshBuilder = 'BULK', textureCache = None, sceneCache = None, report = None, decodePool = None):
+    scene = readScene(f, textureCache, sceneCache=sceneCache, decodePool=decodePool)# Everything but the blender objects
+    f.close()
 
-    cmb = readCmb(f, startOff)
-    vb = cmb.vatr#VertexBufferInfo
+    cmb = scene.cmb
     boneTransforms = {}
 
     # ################################################################
@@ -74,9 +82,8 @@ def LoadModelFromStream(f):
     bpy.context.scene.objects.active = skl_obj# Select the skeleton for editing
     bpy.ops.object.mode_set(mode='EDIT')# Set to edit mode
 
-    for bone in cmb.skeleton:
-        # Save the matrices so we don't have to recalculate them for single-binded meshes later
-        boneTransforms[bone.id] = getWorldTransformCmb(cmb.skeleton, bone.id)
+    for bone in scene.bones:
+        boneTransforms[bone.id] = mathutils.Matrix(bone.worldTransform.tolist())
 
         eb = skeleton.edit_bones.new('bone_{}'.format(bone.id))
 
@@ -99,13 +106,10 @@ def LoadModelFromStream(f):
         if bone.parentId != -1:
             eb.parent = skeleton.edit_bones[bone.parentId]
 
-            parent = cmb.skeleton[bone.parentId]
             # TODO: Cap parent bone length in a robust way.
 
         #eb.tail[1] += 0.001# Blender will delete all zero-length bones
 
-        translation = eb.head.copy()
-
     bpy.ops.object.mode_set(mode='OBJECT')
     bpy.ops.object.select_all(action='DESELECT')
 
@@ -114,14 +118,12 @@ def LoadModelFromStream(f):
     # ################################################################
     textureNames = []# Used as a lookup
 
-    for t in cmb.textures:
-        f.seek(cmb.texDataOfs + t.dataOffset + startOff)
-
+    for t in scene.textures:
         image = bpy.data.images.new('{}.png'.format(t.name), t.width, t.height, alpha=True)
         textureNames.append(image.name)
         # Note: Pixels are in floating-point values
-        if(cmb.texDataOfs != 0):
-            image.pixels = DecodeBuffer(readArray(f, t.dataLength, DataTypes.UByte), t.width, t.height, t.imageFormat, t.isETC1)
+        if t.pixels is not None:
+            setImagePixels(image, RGBAToFloat(t.pixels))
         image.update()# Updates the display image
         image.pack(True)# Pack the image into the .blend file. True = pack as .png
 
@@ -131,7 +133,7 @@ def LoadModelFromStream(f):
     materialNames = []# Used as a lookup
 
     #TODO: Mimic materials best as possible
-    for m in cmb.materials:
+    for m in scene.materials:
         mat = bpy.data.materials.new('{}_mat'.format(cmb.name))# Create new material
         mat.use_nodes = True# Use nodes
         materialNames.append(mat.name)
@@ -144,36 +146,18 @@ def LoadModelFromStream(f):
         sdr = nodes.new("ShaderNodeBsdfPrincipled")# Create new shader node to use
         texture = nodes.new("ShaderNodeTexImage")# Create new texture node
         if len(textureNames) > 0:
-            texture.image = bpy.data.images.get(textureNames[m.TextureMappers[0].textureID])# Set the texture's image
+            texture.image = bpy.data.images.get(textureNames[m.textureIndex])# Set the texture's image
         links.new(sdr.inputs[0], texture.outputs[0])# Link Image "Color" to shaders "Base Color"
         links.new(sdr.outputs[0], out.inputs[0])# Link shader output "BSDF" to material output "Surface"
 
     # ################################################################
     # Build Meshes
     # ################################################################
-    MIndex = 0
-
-    for mesh in cmb.meshes:
-        shape = cmb.shapes[mesh.shapeIndex]
-        indices = [faces for pset in shape.primitiveSets for faces in pset.primitive.indices]
-        vertexCount = max(indices)+1
-        vertices = []
-        bindices = {}
-
-        # Python doesn't have increment operator (afaik) so this must be ugly...
-        inc = 0 #increment
-        hasNrm = getFlag(shape.vertFlags, 1, inc)
-        if cmb.version > 6: inc+=1 #Skip "HasTangents" for now
-        hasClr = getFlag(shape.vertFlags, 2, inc)
-        hasUv0 = getFlag(shape.vertFlags, 3, inc)
-        hasUv1 = getFlag(shape.vertFlags, 4, inc)
-        hasUv2 = getFlag(shape.vertFlags, 5, inc)
-        hasBi  = getFlag(shape.vertFlags, 6, inc)
-        hasBw  = getFlag(shape.vertFlags, 7, inc)
+    meshStart = time.time()
 
+    for mesh in scene.meshes:
         # Create new mesh
-        nmesh = bpy.data.meshes.new('Order:{}_VisID:{}'.format(MIndex,mesh.ID))# ID is used for visibility animations
-        MIndex +=1
+        nmesh = bpy.data.meshes.new('Order:{}_VisID:{}'.format(mesh.index,mesh.id))# ID is used for visibility animations
         nmesh.use_auto_smooth = True# Needed for custom split normals
         nmesh.materials.append(bpy.data.materials.get(materialNames[mesh.materialIndex]))# Add material to mesh
 
@@ -186,115 +170,17 @@ def LoadModelFromStream(f):
         for bone in bpy.data.armatures[skeleton.name].bones.values():
             obj.vertex_groups.new(name=bone.name)
 
-        # Get bone indices. We need to get these first because-
-        # each primitive has it's own bone table
-        for s in shape.primitiveSets:
-            for i in s.primitive.indices:
-                if(hasBi and s.skinningMode != SkinningMode.Single):
-                    f.seek(cmb.vatrOfs + vb.bIndices.startOfs + shape.bIndices.start + i * shape.boneDimensions + startOff)
-                    for bi in range(shape.boneDimensions):
-                        bindices[i * shape.boneDimensions + bi] = s.boneTable[int(readDataType(f, shape.bIndices.dataType) * shape.bIndices.scale)]
-                else: bindices[i] = shape.primitiveSets[0].boneTable[0]# For single-bind meshes
-
-        # Create new bmesh
-        bm = bmesh.new()
-        bm.from_mesh(nmesh)
-        weight_layer = bm.verts.layers.deform.new()# Add new deform layer
-
-        # TODO: Support constants
-        # Get vertices
-        for i in range(vertexCount):
-            v = Vertex()# Ugly because I don't care :)
-
-            # Position
-            f.seek(cmb.vatrOfs + vb.position.startOfs + shape.position.start + 3 * getDataTypeSize(shape.position.dataType) * i + startOff)
-            bmv = bm.verts.new([e * shape.position.scale * GLOBAL_SCALE for e in readArray(f, 3, shape.position.dataType)])
-
-            if(shape.primitiveSets[0].skinningMode != SkinningMode.Smooth):
-                bmv.co = transformPosition(bmv.co, boneTransforms[bindices[i]])
-
-            # Normal
-            if hasNrm:
-                f.seek(cmb.vatrOfs + vb.normal.startOfs + shape.normal.start + 3 * getDataTypeSize(shape.normal.dataType) * i + startOff)
-                v.nrm = [e * shape.normal.scale for e in readArray(f, 3, shape.normal.dataType)]
-
-                if(shape.primitiveSets[0].skinningMode != SkinningMode.Smooth):
-                    v.nrm = transformNormal(v.nrm, boneTransforms[bindices[i]])
-
-            # Color
-            if hasClr:
-                f.seek(cmb.vatrOfs + vb.color.startOfs + shape.color.start + 4 * getDataTypeSize(shape.color.dataType) * i + startOff)
-                v.clr = [e * shape.color.scale for e in readArray(f, 4, shape.color.dataType)]
-
-            # UV0
-            if hasUv0:
-                f.seek(cmb.vatrOfs + vb.uv0.startOfs + shape.uv0.start + 2 * getDataTypeSize(shape.uv0.dataType) * i + startOff)
-                v.uv0 = [e * shape.uv0.scale for e in readArray(f, 2, shape.uv0.dataType)]
-
-            # UV1
-            if hasUv1:
-                f.seek(cmb.vatrOfs + vb.uv1.startOfs + shape.uv1.start + 2 * getDataTypeSize(shape.uv1.dataType) * i + startOff)
-                v.uv1 = [e * shape.uv1.scale for e in readArray(f, 2, shape.uv1.dataType)]
-
-            # UV2
-            if hasUv2:
-                f.seek(cmb.vatrOfs + vb.uv2.startOfs + shape.uv2.start + 2 * getDataTypeSize(shape.uv2.dataType) * i + startOff)
-                v.uv2 = [e * shape.uv2.scale for e in readArray(f, 2, shape.uv2.dataType)]
-
-            # Bone Weights
-            if hasBw:
-                # For smooth meshes
-                f.seek(cmb.vatrOfs + vb.bWeights.startOfs + shape.bWeights.start + i * shape.boneDimensions + startOff)
-                for j in range(shape.boneDimensions):
-                    weight = round(readDataType(f, shape.bWeights.dataType) * shape.bWeights.scale, 2)
-                    if(weight > 0): bmv[weight_layer][bindices[i * shape.boneDimensions + j]] = weight
-            else:
-                # For single-bind meshes
-                bmv[weight_layer][bindices[i]] = 1.0
-
-            vertices.append(v)
-
-        bm.verts.ensure_lookup_table()# Must always be called after adding/removing vertices or accessing them by index
-        bm.verts.index_update()# Assign an index value to each vertex
-
-        for i in range(0, len(indices), 3):
-            try:
-                face = bm.faces.new(bm.verts[j] for j in indices[i:i + 3])
-                face.material_index = mesh.materialIndex
-                face.smooth = True
-            except:# face already exists
-                continue
-
-        uv_layer0 = bm.loops.layers.uv.new() if (hasUv0) else None
-        uv_layer1 = bm.loops.layers.uv.new() if (hasUv1) else None
-        uv_layer2 = bm.loops.layers.uv.new() if (hasUv2) else None
-        col_layer = bm.loops.layers.color.new() if (hasClr) else None
-
-        for face in bm.faces:
-            for loop in face.loops:
-                if hasUv0:
-                    uv0 = vertices[loop.vert.index].uv0
-                    loop[uv_layer0].uv = (uv0[0], uv0[1]) # Flip Y
-                if hasUv1:
-                    uv1 = vertices[loop.vert.index].uv1
-                    loop[uv_layer1].uv = (uv1[0], 1 - uv1[1]) # Flip Y
-                if hasUv2:
-                    uv2 = vertices[loop.vert.index].uv2
-                    loop[uv_layer2].uv = (uv2[0], 1 - uv2[1]) # Flip Y
-                if hasClr:
-                    loop[col_layer] = vertices[loop.vert.index].clr
-
-        # Assign bmesh to newly created mesh
-        nmesh.update()
-        bm.to_mesh(nmesh)
-        bm.free()# Remove all the mesh data immediately and disable further access
+        if meshBuilder == 'BMESH':
+            buildMeshBmesh(nmesh, mesh.positions.tolist(), mesh.triangles, mesh.vertexBones, mesh.vertexWeights, mesh.uvLayers, mesh.colors, mesh.materialIndex)
+        else:
+            buildMeshBulk(nmesh, obj, np.array(mesh.positions, np.float32), mesh.triangles, mesh.vertexBones, mesh.vertexWeights, mesh.uvLayers, mesh.colors, mesh.materialIndex)
 
         # Blender has no idea what normals are
         #TODO: Add an option
         # TODO: Custom split normals always look broken, are the values wrong?
         UseCustomNormals = True
-        if(UseCustomNormals and hasNrm):
-            nmesh.normals_split_custom_set_from_vertices([vertices[i].nrm for i in range(len(vertices))])
+        if(UseCustomNormals and mesh.normals is not None):
+            nmesh.normals_split_custom_set_from_vertices(mesh.normals.tolist())
         else:
             clnors = array.array('f', [0.0] * (len(nmesh.loops) * 3))
             nmesh.loops.foreach_get("normal", clnors)
@@ -303,7 +189,8 @@ def LoadModelFromStream(f):
         # Link object in scene
         bpy.context.scene.objects.link(obj)
 
-    f.close()
+    if report is not None:
+        report({'INFO'}, "Built {} meshes with the {} mesh builder in {:.3f}s".format(len(scene.meshes), meshBuilder, time.time() - meshStart))
 
     #TODO: Add an option
     Rotate = True
@@ -317,11 +204,109 @@ def LoadModelFromStream(f):
 
     return cmb
 
-class Vertex(object):
-    def __init__(self):
-        self.pos = []
-        self.nrm = []
-        self.clr = []
-        self.uv0 = []
-        self.uv1 = []
-        self.uv2 = []
+def setImagePixels(image, pixels):
+    '''Uploads a flat float32 RGBA array to an image'''
+    if hasattr(image.pixels, "foreach_set"):# Blender 2.83+, takes the buffer as is
+        image.pixels.foreach_set(pixels)
+    else:
+        image.pixels[:] = pixels
+
+def buildMeshBmesh(nmesh, positions, triangles, vertexBones, vertexWeights, uvLayers, colors, materialIndex):
+    # Create new bmesh
+    bm = bmesh.new()
+    bm.from_mesh(nmesh)
+    weight_layer = bm.verts.layers.deform.new()# Add new deform layer
+
+    vertexBones = vertexBones.tolist()
+    vertexWeights = vertexWeights.tolist()
+    for i, position in enumerate(positions):
+        bmv = bm.verts.new(position)
+        for bone, weight in zip(vertexBones[i], vertexWeights[i]):
+            if(weight > 0): bmv[weight_layer][bone] = weight
+
+    bm.verts.ensure_lookup_table()# Must always be called after adding/removing vertices or accessing them by index
+    bm.verts.index_update()# Assign an index value to each vertex
+
+    for triangle in triangles.tolist():
+        try:
+            face = bm.faces.new(bm.verts[j] for j in triangle)
+            face.material_index = materialIndex
+            face.smooth = True
+        except:# face already exists
+            continue
+
+    uv_layers = [(bm.loops.layers.uv.new(), uvs.tolist()) for uvs in uvLayers]
+    col_layer = bm.loops.layers.color.new() if (colors is not None) else None
+    colors = colors.tolist() if (colors is not None) else None
+
+    for face in bm.faces:
+        for loop in face.loops:
+            for uv_layer, uvs in uv_layers:
+                loop[uv_layer].uv = uvs[loop.vert.index]
+            if col_layer is not None:
+                loop[col_layer] = colors[loop.vert.index]
+
+    # Assign bmesh to newly created mesh
+    nmesh.update()
+    bm.to_mesh(nmesh)
+    bm.free()# Remove all the mesh data immediately and disable further access
+
+def buildMeshBulk(nmesh, obj, positions, triangles, vertexBones, vertexWeights, uvLayers, colors, materialIndex):
+    triangles = getUniqueTriangles(triangles)
+    loopCount = triangles.size
+    polygonCount = len(triangles)
+    loopVertices = triangles.ravel()
+
+    nmesh.vertices.add(len(positions))
+    nmesh.vertices.foreach_set("co", positions.ravel())
+    nmesh.loops.add(loopCount)
+    nmesh.loops.foreach_set("vertex_index", loopVertices)
+    nmesh.polygons.add(polygonCount)
+    nmesh.polygons.foreach_set("loop_start", np.arange(0, loopCount, 3, dtype=np.int32))
+    nmesh.polygons.foreach_set("loop_total", np.full(polygonCount, 3, np.int32))
+    nmesh.polygons.foreach_set("material_index", np.full(polygonCount, materialIndex, np.int32))
+    nmesh.polygons.foreach_set("use_smooth", np.ones(polygonCount, np.bool_))
+
+    for uvs in uvLayers:
+        uvTexture = nmesh.uv_textures.new()
+        nmesh.uv_layers[uvTexture.name].data.foreach_set("uv", uvs[loopVertices].astype(np.float32).ravel())
+
+    if colors is not None:
+        colorLayer = nmesh.vertex_colors.new()
+        # Loop colors have no alpha channel in Blender 2.79
+        components = len(colorLayer.data[0].color) if loopCount > 0 else 3
+        colorLayer.data.foreach_set("color", colors[loopVertices, :components].ravel())
+
+    nmesh.update(calc_edges=True)
+
+    assignVertexWeights(obj, vertexBones, vertexWeights)
+
+def getUniqueTriangles(triangles):
+    '''Drops degenerate and repeated triangles, which bmesh refuses to create'''
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    triangles = triangles[(a != b) & (b != c) & (a != c)]
+
+    # Faces with the same vertices in any order are the same face
+    vertexCount = int(triangles.max()) + 1 if len(triangles) > 0 else 1
+    ordered = np.sort(triangles, axis=1).astype(np.int64)
+    keys = (ordered[:, 0] * vertexCount + ordered[:, 1]) * vertexCount + ordered[:, 2]
+    _, firstIndices = np.unique(keys, return_index=True)
+    return triangles[np.sort(firstIndices)]
+
+def assignVertexWeights(obj, vertexBones, vertexWeights):
+    '''Adds vertices to their bones' vertex groups, with one add() per bone and weight'''
+    # Influences are applied in order so later ones win, same as the deform layer
+    for j in range(vertexBones.shape[1]):
+        vertexIndices = np.flatnonzero(vertexWeights[:, j] > 0)
+        if len(vertexIndices) == 0:
+            continue
+
+        bones = vertexBones[vertexIndices, j]
+        weights = vertexWeights[vertexIndices, j]
+        order = np.lexsort((weights, bones))
+        bones, weights, vertexIndices = bones[order], weights[order], vertexIndices[order]
+
+        starts = np.flatnonzero(np.r_[True, (bones[1:] != bones[:-1]) | (weights[1:] != weights[:-1])])
+        ends = np.r_[starts[1:], len(bones)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            obj.vertex_groups[int(bones[start])].add(vertexIndices[start:end].tolist(), float(weights[start]), 'REPLACE')
@@ -11,9 +11,11 @@ if "bpy" in locals():
         importlib.reload(common)
 
 import bpy
+import numpy as np
 from mathutils import Matrix, Vector, Euler, Quaternion
 
 from . import csab
+from .csab_bake import RestPose, bakeAnimation, bakeSparseAnimation
 from .common import (
         axis_correction_matrix, #TODO use this someday
         ValueHolder, #TODO maybe not
@@ -31,22 +33,129 @@ class NoActiveArmatureError(ValueError):
 class BoneMismatchError(IndexError):
     pass
 
+def write_fcurve_keyframes(fcurve, frames, values, slopes_in=None, slopes_out=None):
+    '''Adds a keyframe to an F-curve for each frame/value pair, all at once
+
+    Unlike keyframe_points.insert(), which re-sorts the curve and recalculates
+    its handles for every single key, the points are allocated together and
+    their coordinates are filled in from one flat array. The curve is only
+    updated once at the end. Existing keyframes are kept as they are.
+
+    If slopes (in value per frame) are given, the keyframes get free handles a
+    third of the way to their neighbours, so each segment is exactly the
+    hermite curve with those tangents. Otherwise Blender picks the handles.
+    '''
+    frames = np.asarray(frames, np.float32).ravel()
+    values = np.asarray(values, np.float32).ravel()
+    if len(frames) != len(values):
+        raise ValueError("Expected as many frames as values, got {} and {}".format(len(frames), len(values)))
+
+    keyframe_points = fcurve.keyframe_points
+    existing_count = len(keyframe_points)
+    keyframe_points.add(len(frames))
+    _set_new_keyframe_points(keyframe_points, "co", existing_count, frames, values)
+
+    if slopes_in is not None and slopes_out is not None and len(frames) > 0:
+        slopes_in = np.asarray(slopes_in, np.float32).ravel()
+        slopes_out = np.asarray(slopes_out, np.float32).ravel()
+
+        gaps = np.diff(frames) if len(frames) > 1 else np.ones(1, np.float32)
+        before = np.concatenate((gaps[:1], gaps))[:len(frames)] / 3
+        after = np.concatenate((gaps, gaps[-1:]))[:len(frames)] / 3
+
+        for point in keyframe_points[existing_count:]:
+            point.handle_left_type = 'FREE'
+            point.handle_right_type = 'FREE'
+        _set_new_keyframe_points(keyframe_points, "handle_left", existing_count, frames - before, values - slopes_in * before)
+        _set_new_keyframe_points(keyframe_points, "handle_right", existing_count, frames + after, values + slopes_out * after)
+
+    fcurve.update()
+
+def _set_new_keyframe_points(keyframe_points, attribute, existing_count, x, y):
+    '''Sets a 2D attribute of the keyframes after existing_count with foreach_set'''
+    coords = np.empty(2 * len(keyframe_points), np.float32)
+    if existing_count > 0:
+        keyframe_points.foreach_get(attribute, coords)
+    coords[2 * existing_count::2] = x
+    coords[2 * existing_count + 1::2] = y
+    keyframe_points.foreach_set(attribute, coords)
+
+def get_active_armature_object():
+    '''Returns the active armature, or the first selected one, or raises an error if there isn't one'''
+    armature_object = bpy.context.active_object
+    if armature_object is None or armature_object.type != 'ARMATURE':
+        for obj in bpy.context.selected_objects:
+            if obj.type == 'ARMATURE':
+                armature_object = obj
+                break
+        else:
+            raise NoActiveArmatureError("You must first select the armature to be animated.")
+    return armature_object
+
+class ArmatureBinding:
+    '''Everything about an armature that animations need, worked out once and shared by every animation imported onto it
+
+    armature_object: the Blender armature object to animate
+    skeleton: the CMB bones the armature was built from
+    '''
+
+    def __init__(self, armature_object, skeleton):
+        self.armature_object = armature_object
+        self.skeleton = skeleton
+        self.rest_pose = RestPose(skeleton)
+
+        #Get bone ids and parents, also map bone ids to Blender PoseBones. TODO someday use custom property for bone_ids
+        bones_parents_ids = []
+        self.boneid_posebone_map = dict()
+        for posebone in armature_object.pose.bones:
+            bone_id = int(posebone.name.replace("bone_", ""))
+            self.boneid_posebone_map[bone_id] = posebone
+
+            parent_bone = posebone.parent
+            parent_bone_id = -1 if parent_bone is None else int(parent_bone.name.replace("bone_", ""))
+            bones_parents_ids.append((bone_id, parent_bone_id))
+
+        self.bone_ids_in_order = get_bone_ids_in_order(bones_parents_ids)
+
+        # TODO: This is broken, this needs to be "location" instead.
+        self.location_data_paths = dict()
+        self.rotation_data_paths = dict()
+        for bone_id, posebone in self.boneid_posebone_map.items():
+            self.location_data_paths[bone_id] = 'pose.bones["{0}"].location'.format(posebone.name)
+            self.rotation_data_paths[bone_id] = 'pose.bones["{0}"].rotation_quaternion'.format(posebone.name)
+
+        # Backs up pose.
+        self.backup_transforms = []
+        for bone_id in self.bone_ids_in_order:
+            self.backup_transforms.append(self.boneid_posebone_map[bone_id].matrix.copy())
+
 class CsabImporter:
     '''Imports a parsed csab file into Blender
 
-    csab_parsed: a parsed csab animation object (i.e. the object returned from csab.parse())
+    csab_parsed: a parsed csab animation object (i.e. the object returned from csab.parse()), or None if animation is given
+    keyframes: 'ALL' to key every frame, or 'SPARSE' to only key the frames needed to stay within translation_tolerance (in blender units) and rotation_tolerance (per quaternion component)
+    binding: the ArmatureBinding of the armature to animate, shared between animations. If None, one is made for the active armature.
+    scene_cache: a SceneCache to save the baked animation to under cache_key (see SceneCache.getAnimationKey)
+    animation: the already baked animation, e.g. from SceneCache.getAnimation, in which case csab_parsed isn't needed
     '''
 
-    def __init__(self, csab_parsed, csabAnimationHelper, cmb, anim_name="anim"):
+    def __init__(self, csab_parsed, csabAnimationHelper, cmb, anim_name="anim", keyframes='ALL', translation_tolerance=1e-4, rotation_tolerance=1e-4, binding=None, scene_cache=None, cache_key=None, animation=None):
         self.csab_parsed = csab_parsed
         self.csabAnimationHelper = csabAnimationHelper
         self.cmb = cmb
+        self.binding = binding
 
         # self.blender = ValueHolder()
         # self.blender.anim_name = anim_name
         # self.blender.armature_object = None #TODO
 
         self.anim_name = anim_name
+        self.keyframes = keyframes
+        self.translation_tolerance = translation_tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.scene_cache = scene_cache
+        self.cache_key = cache_key
+        self.animation = animation
         self.bone_mismatch = False #TODO quick hacky way to show bone mismatch error after done importing
 
     def import_anims(self, clear_armature = True):
@@ -54,17 +163,11 @@ class CsabImporter:
         csab_parsed = self.csab_parsed
         scene = bpy.context.scene
 
-        #Get the active/selected armature or raise an error if there isn't one
-        armature_object = bpy.context.active_object
-        if armature_object is None or armature_object.type != 'ARMATURE':
-            for obj in bpy.context.selected_objects:
-                if obj.type == 'ARMATURE':
-                    armature_object = obj
-                    break
-            else:
-                raise NoActiveArmatureError("You must first select the armature to be animated.")
+        binding = self.binding
+        if binding is None:
+            binding = self.binding = ArmatureBinding(get_active_armature_object(), self.cmb.skeleton)
 
-        armobj = armature_object
+        armobj = binding.armature_object
         arm_bones = len(armobj.pose.bones)
 
         #Prepare armature for animation, prepare animation & action
@@ -73,26 +176,19 @@ class CsabImporter:
             armobj.animation_data_clear()
             armobj.animation_data_create()
 
-        #Get bone ids and parents, also map bone ids to Blender PoseBones. TODO someday use custom property for bone_ids
-        bones_parents_ids = []
-        boneid_posebone_map = dict()
-        for posebone in armobj.pose.bones:
-            bone_id = int(posebone.name.replace("bone_", ""))
-            boneid_posebone_map[bone_id] = posebone
-
-            parent_bone = posebone.parent
-            parent_bone_id = -1 if parent_bone is None else int(parent_bone.name.replace("bone_", ""))
-            bones_parents_ids.append((bone_id, parent_bone_id))
-
-        # Backs up pose.
-        backupTransforms = []
-        for bone_id in get_bone_ids_in_order(bones_parents_ids):
-            blender_posebone = boneid_posebone_map[bone_id]
-            backupTransforms.append(blender_posebone.matrix.copy())
+        # Samples every bone for every frame up front, unless it was already baked by an earlier import
+        animation = self.animation
+        if animation is None:
+            if self.keyframes == 'SPARSE':
+                animation = bakeSparseAnimation(csab_parsed, binding.skeleton, self.translation_tolerance, self.rotation_tolerance, binding.rest_pose)
+            else:
+                animation = bakeAnimation(csab_parsed, binding.skeleton, restPose=binding.rest_pose)
+            animation.name = self.anim_name
+            if self.scene_cache is not None:
+                self.scene_cache.putAnimation(self.cache_key, animation)
 
         # Processes animations
-        csab_anim = self.csab_parsed
-        anim_full_name = self.anim_name
+        anim_full_name = animation.name
 
         #Check that the number of bones in the animation matches the number of bones in the armature
         #anim_bones = csab_anim.num_bones
@@ -105,53 +201,40 @@ class CsabImporter:
         action = armobj.animation_data.action
 
         # Gathers up animations from each bone
-        animationLength = csab_anim.duration + 1
-        for bone_id in get_bone_ids_in_order(bones_parents_ids):
-            blender_posebone = boneid_posebone_map[bone_id]
-            cmb_bone = self.cmb.skeleton[bone_id]
+        for bone_id in binding.bone_ids_in_order:
+            blender_posebone = binding.boneid_posebone_map[bone_id]
 
             blender_posebone.rotation_mode = 'QUATERNION'
 
             pos_fcurves = []
             rot_fcurves = []
             for i in range(3):
-                # TODO: This is broken, this needs to be "location" instead.
-                pos_data_path = 'pose.bones["{0}"].location'.format(blender_posebone.name)
-                pos_fcurves.append(action.fcurves.new(data_path=pos_data_path, index=i))
+                pos_fcurves.append(action.fcurves.new(data_path=binding.location_data_paths[bone_id], index=i))
             for i in range(4):
-                rot_data_path = 'pose.bones["{0}"].rotation_quaternion'.format(blender_posebone.name)
-                rot_fcurves.append(action.fcurves.new(data_path=rot_data_path, index=i))
+                rot_fcurves.append(action.fcurves.new(data_path=binding.rotation_data_paths[bone_id], index=i))
 
-            previousQuaternion = None
-            for i in range(animationLength):
-                translation = self.csabAnimationHelper.getBoneTranslation(csab_anim, cmb_bone, i)
-                quaternion = self.csabAnimationHelper.getBoneQuaternion(csab_anim, cmb_bone, i)
-
-                # Keeps quaternion signs the same to prevent gimbal lock.
-                if previousQuaternion is not None and previousQuaternion.dot(quaternion) < 0:
-                    quaternion *= -1
-
-                # TODO: Only write frames where they're needed (if possible?)
-                # TODO: Include tangents in animation (if possible?)
+            # Note: Quaternion signs were already kept the same by the bake to prevent gimbal lock.
+            if self.keyframes == 'SPARSE':
+                for fcurve, channel in zip(pos_fcurves + rot_fcurves, animation.translations[bone_id] + animation.rotations[bone_id]):
+                    write_fcurve_keyframes(fcurve, channel.frames, channel.values, channel.slopesIn, channel.slopesOut)
+            else:
                 for a in range(3):
-                    pos_fcurves[a].keyframe_points.insert(i, translation[a])
+                    write_fcurve_keyframes(pos_fcurves[a], animation.frames, animation.translations[:, bone_id, a])
                 for a in range(4):
-                    rot_fcurves[a].keyframe_points.insert(i, quaternion[a])
-
-                previousQuaternion = quaternion
+                    write_fcurve_keyframes(rot_fcurves[a], animation.frames, animation.rotations[:, bone_id, a])
 
         #TODO does not account for multiple animations
         scene.frame_start = 0
-        scene.frame_end = csab_anim.duration
+        scene.frame_end = animation.duration
         scene.frame_set(0)
         scene.update()
 
         # Done w/ animations here!
 
         # Reapplies original poses
-#        for bone_id in get_bone_ids_in_order(bones_parents_ids):
-#            blender_posebone = boneid_posebone_map[bone_id]
-#            blender_posebone.matrix = backupTransforms[bone_id]
+#        for bone_id in binding.bone_ids_in_order:
+#            blender_posebone = binding.boneid_posebone_map[bone_id]
+#            blender_posebone.matrix = binding.backup_transforms[bone_id]
 
 #        scene.update()
 
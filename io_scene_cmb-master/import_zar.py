@@ -1,12 +1,12 @@
 import sys, io, os, os.path, array, bpy, bmesh, operator, math, mathutils
 
-from .array_buffer_slice import ArrayBufferSlice
+from .array_buffer_slice import mapFile
 from .common import CLIP_START, CLIP_END, GLOBAL_SCALE
 from .csab import csab_file
 from .csab_animation_helper import CsabAnimationHelper
 from .csab2 import CsabParser
-from .import_cmb import LoadModelFromStream
-from .import_csab import CsabImporter
+from .import_cmb import LoadModelFromStream, getBuildTimeReport, getDecodePool, getSceneCache, getTextureCache
+from .import_csab import ArmatureBinding, CsabImporter, get_active_armature_object
 from .zar import Zar
 
 #TODO: Clean up
@@ -25,50 +25,80 @@ def load_zar( operator, context ):
 
     bpy.context.scene.render.engine = 'CYCLES'# Idc if you don't like cycles
 
-    for f in enumerate(operator.files):
-        filePath = operator.directory + f[1].name
+    decodePool = getDecodePool(operator)# Shared by every model in the import
+    mappedFiles = []# Unmapped once the import is done, so the files aren't left locked
+    try:
+        for f in enumerate(operator.files):
+            filePath = operator.directory + f[1].name
 
-        zar = Zar(filePath)
+            zar = Zar(filePath)
+            mappedFiles.append(zar)
 
-        # Parse model
-        cmbList = zar.getFiles("cmb")
+            # Parse model
+            cmbList = zar.getFiles("cmb")
 
-        cmbBytesList = []
-        if cmbList and len(cmbList) > 0:
-            cmbBytesList.append(cmbList[0].bytes)
-        else:
-            # TODO: Is this robust enough?
-            # If no models exist, this might be a scene? Scene models are in a
-            # separate file, try to look for that.
-            realFilePath = filePath.replace(".zar", "_0_info.zsi")
-            if os.path.isfile(realFilePath):
-                with open(realFilePath, "rb") as f:
-                    cmbBytesList.append(ArrayBufferSlice(f.read()))
+            cmbBytesList = []
+            if cmbList and len(cmbList) > 0:
+                cmbBytesList.append(cmbList[0].bytes)
+            else:
+                # TODO: Is this robust enough?
+                # If no models exist, this might be a scene? Scene models are in a
+                # separate file, try to look for that.
+                realFilePath = filePath.replace(".zar", "_0_info.zsi")
+                if os.path.isfile(realFilePath):
+                    zsi = mapFile(realFilePath)
+                    mappedFiles.append(zsi)
+                    cmbBytesList.append(zsi)
 
-        # Loads models
-        cmbs = []
-        for cmbBytes in cmbBytesList:
-            cmbs.append(LoadModelFromStream(cmbBytes.toStream()))
+            # Loads models
+            cmbs = []
+            textureCache = getTextureCache(operator)
+            sceneCache = getSceneCache(operator)
+            for cmbBytes in cmbBytesList:
+                cmbs.append(LoadModelFromStream(cmbBytes.toStream(), operator.mesh_builder, textureCache, sceneCache, getBuildTimeReport(operator), decodePool))
 
-        cmb = cmbs[0]
-        assert cmb is not None, "No CMB was read from the file!"
+            cmb = cmbs[0]
+            assert cmb is not None, "No CMB was read from the file!"
 
-        # Parse animations
-        csabAnimationHelper = CsabAnimationHelper(cmb)
-        csabList = zar.getFiles("csab")
-        if csabList:
-            for i, csabBytes in enumerate(csabList):
-                csab = CsabParser(cmb).parse(csabBytes.filename, csabBytes.bytes)
+            # Parse animations
+            csabAnimationHelper = CsabAnimationHelper(cmb)
+            csabList = zar.getFiles("csab")
+            if csabList:
+                # Every animation in the archive is for the same armature
+                armatureBinding = ArmatureBinding(get_active_armature_object(), cmb.skeleton)
+                for i, csabBytes in enumerate(csabList):
+                    # Only parsed if it wasn't already baked by an earlier import
+                    cacheKey = None
+                    animation = None
+                    if sceneCache is not None:
+                        cacheKey = sceneCache.getAnimationKey(csabBytes.bytes.getBuffer(), csabBytes.filename, cmb.skeleton, operator.animation_keyframes,
+                                                              operator.animation_location_tolerance, operator.animation_rotation_tolerance)
+                        animation = sceneCache.getAnimation(cacheKey)
+                    csab = None
+                    if animation is None:
+                        csab = CsabParser(cmb).parse(csabBytes.filename, csabBytes.bytes)
 
-                CsabImporter(
-                    csab,
-                    csabAnimationHelper,
-                    cmb,
-                    csabBytes.filename,
-                ).import_anims(
-                    i == 0 # Clear armatures
-                )
+                    CsabImporter(
+                        csab,
+                        csabAnimationHelper,
+                        cmb,
+                        csabBytes.filename,
+                        operator.animation_keyframes,
+                        operator.animation_location_tolerance,
+                        operator.animation_rotation_tolerance,
+                        armatureBinding,
+                        sceneCache,
+                        cacheKey,
+                        animation,
+                    ).import_anims(
+                        i == 0 # Clear armatures
+                    )
 
-        # TODO: Support .anb format animations for Link.
+            # TODO: Support .anb format animations for Link.
 
-        return {"FINISHED"}
+            return {"FINISHED"}
+    finally:
+        for mappedFile in mappedFiles:
+            mappedFile.close()
+        if decodePool is not None:
+            decodePool.close()
@@ -0,0 +1,25 @@
+import struct, zlib
+import numpy as np
+
+def __writeChunk(f, chunkType, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunkType)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunkType + data) & 0xFFFFFFFF))
+
+def writePng(path, width, height, pixels, compressLevel = 6):
+    '''Writes flat uint8 RGBA pixels as a PNG
+
+    Pixels are bottom row first, the same as the texture decoder returns them.
+    '''
+    rows = np.asarray(pixels, np.uint8).reshape(height, width * 4)[::-1]
+
+    # Every scanline starts with its filter type, 0 for none
+    scanlines = np.zeros((height, width * 4 + 1), np.uint8)
+    scanlines[:, 1:] = rows
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        __writeChunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))# 8-bit RGBA
+        __writeChunk(f, b"IDAT", zlib.compress(scanlines.tobytes(), compressLevel))
+        __writeChunk(f, b"IEND", b"")
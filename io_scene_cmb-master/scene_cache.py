@@ -0,0 +1,285 @@
+import hashlib, io, os, struct, zipfile
+import numpy as np
+
+from .cmb import Bone, Cmb
+from .cmbEnums import GLTextureFormat
+from .cmb_scene import CmbScene, SceneMaterial, SceneMesh, SceneTexture, buildBones
+from .csab_bake import BakedAnimation, SparseAnimation, SparseChannel
+from .texture_cache import evictEntries, writeEntry
+
+# Every module that decides what ends up in an entry, entries written by any
+# other version of them are never loaded
+SOURCE_MODULES = ("array_utils", "cmb", "cmbEnums", "cmb_scene", "common", "csab2", "csab_bake",
+                  "ctrTexture", "io_utils", "scene_cache", "skeleton_transforms", "vertex_decoder")
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_sourceKey = None
+
+def getSourceKey():
+    '''Returns the hash of the source of every module in SOURCE_MODULES'''
+    global _sourceKey
+    if _sourceKey is None:
+        key = hashlib.sha1()
+        for name in SOURCE_MODULES:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name + ".py"), "rb") as f:
+                key.update(hashlib.sha1(f.read()).digest())
+        _sourceKey = key.digest()
+    return _sourceKey
+
+class SceneCache(object):
+    '''A size-bounded cache of decoded scenes and baked animations on disk
+
+    Entries are keyed by a hash of the source file's bytes and of the modules
+    that decode them (see SOURCE_MODULES), so changing either one falls back to
+    a full decode. Each entry is an uncompressed .npz of plain arrays (nothing
+    is pickled), and the least recently used entries are deleted once the
+    cache grows past maxBytes. Scenes also keep the parts of the cmb the
+    importers use, so the cmb doesn't have to be parsed when they're loaded.
+    '''
+    def __init__(self, directory, maxBytes = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.__totalBytes = None# Counted lazily on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def getSceneKey(f, decodeTextures = True):
+        '''Returns the key of the scene in the stream f, which is read from its start'''
+        key = hashlib.sha1(struct.pack("<4s?", b"cmb ", bool(decodeTextures)))
+        key.update(getSourceKey())
+        if hasattr(f, "getbuffer"):# io.BytesIO and ArrayBufferStream, hashed without copying their bytes
+            with f.getbuffer() as view:
+                key.update(view)
+        else:
+            f.seek(0)
+            key.update(f.read())
+        return key.hexdigest()
+
+    @staticmethod
+    def getAnimationKey(data, name, skeleton, keyframes, translationTolerance, rotationTolerance):
+        '''Returns the key of an animation's raw csab bytes, baked for skeleton with the given keyframes options
+
+        The name it's imported as is part of the key, since it's stored in the
+        entry, so the csab doesn't have to be parsed at all to import a hit.
+        '''
+        key = hashlib.sha1(struct.pack("<4sdd", b"csab", translationTolerance, rotationTolerance))
+        key.update(getSourceKey())
+        key.update(keyframes.encode("ASCII"))
+        key.update(name.encode("UTF-8") + b"\0")
+        key.update(np.array([[bone.id, bone.parentId] + list(bone.translation) + list(bone.rotation) + list(bone.scale)
+                             for bone in skeleton], np.float64).tobytes())
+        key.update(data)
+        return key.hexdigest()
+
+    def __getPath(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def __read(self, key):
+        '''Returns the arrays of an entry by name, or None if it isn't cached'''
+        path = self.__getPath(key)
+        try:
+            with np.load(path) as entry:
+                arrays = { name: entry[name] for name in entry.files }
+            os.utime(path, None)# Mark as recently used
+        except (IOError, OSError, ValueError, zipfile.BadZipFile):# Missing, or cut short by a crash mid-write
+            return None
+        return arrays
+
+    def __write(self, key, arrays):
+        stream = io.BytesIO()
+        np.savez(stream, **arrays)
+
+        self.__totalBytes = writeEntry(self.__getPath(key), stream.getbuffer(), ".npz", self.__totalBytes, self.maxBytes)
+
+    def evict(self):
+        '''Deletes the least recently used entries until the cache fits in maxBytes'''
+        self.__totalBytes = evictEntries(self.directory, ".npz", self.maxBytes)
+
+    def getScene(self, key):
+        '''Returns the cached CmbScene, or None if it isn't cached'''
+        arrays = self.__read(key)
+        if arrays is None:
+            return None
+
+        try:
+            return loadScene(arrays)
+        except KeyError:
+            return None
+
+    def putScene(self, key, scene):
+        self.__write(key, dumpScene(scene))
+
+    def getAnimation(self, key):
+        '''Returns the cached SparseAnimation or BakedAnimation, or None if it isn't cached'''
+        arrays = self.__read(key)
+        if arrays is None:
+            return None
+
+        try:
+            return loadAnimation(arrays)
+        except KeyError:
+            return None
+
+    def putAnimation(self, key, animation):
+        self.__write(key, dumpAnimation(animation))
+
+# Scenes are stored as the arrays cmb_scene decodes, along with the parts of
+# the cmb's headers that the importers use, one array per field
+def dumpScene(scene):
+    skeleton = scene.cmb.skeleton
+    arrays = {
+        "name": np.array(scene.name),
+        "boneIds": np.array([bone.id for bone in skeleton], np.int32),
+        "boneParentIds": np.array([bone.parentId for bone in skeleton], np.int32),
+        "boneScales": np.array([bone.scale for bone in skeleton], np.float64).reshape(-1, 3),
+        "boneRotations": np.array([bone.rotation for bone in skeleton], np.float64).reshape(-1, 3),
+        "boneTranslations": np.array([bone.translation for bone in skeleton], np.float64).reshape(-1, 3),
+        "worldTransforms": scene.worldTransforms,
+        "textureNames": np.array([texture.name for texture in scene.textures], np.str_),
+        "textureSizes": np.array([(texture.width, texture.height) for texture in scene.textures], np.int64).reshape(-1, 2),
+        "textureFormats": np.array([int(texture.imageFormat) for texture in scene.textures], np.int64),
+        "textureIsETC1": np.array([texture.isETC1 for texture in scene.textures], np.bool_),
+        "textureMipmapCounts": np.array([texture.mipmapCount for texture in scene.textures], np.int64),
+        "materialTextureIndices": np.array([material.textureIndex for material in scene.materials], np.int64),
+        "meshes": np.array([(mesh.index, mesh.id, mesh.shapeIndex, mesh.materialIndex, int(mesh.skinningMode))
+                            for mesh in scene.meshes], np.int64).reshape(-1, 5),
+    }
+    for i, texture in enumerate(scene.textures):
+        if texture.pixels is not None:
+            arrays["texture{}".format(i)] = texture.pixels
+
+    for i, mesh in enumerate(scene.meshes):
+        prefix = "mesh{}_".format(i)
+        arrays[prefix + "positions"] = mesh.positions
+        arrays[prefix + "vertexBones"] = mesh.vertexBones
+        arrays[prefix + "vertexWeights"] = mesh.vertexWeights
+        arrays[prefix + "triangles"] = mesh.triangles
+        if mesh.normals is not None:
+            arrays[prefix + "normals"] = mesh.normals
+        if mesh.colors is not None:
+            arrays[prefix + "colors"] = mesh.colors
+        for j, uvs in enumerate(mesh.uvLayers):
+            arrays["{}uv{}".format(prefix, j)] = uvs
+    return arrays
+
+def loadScene(arrays):
+    # A cmb with only what's read from it after decoding, its name and skeleton
+    cmb = Cmb()
+    cmb.name = str(arrays["name"])
+    cmb.skeleton = []
+    for boneId, parentId, scale, rotation, translation in zip(arrays["boneIds"].tolist(), arrays["boneParentIds"].tolist(),
+                                                              arrays["boneScales"].tolist(), arrays["boneRotations"].tolist(),
+                                                              arrays["boneTranslations"].tolist()):
+        bone = Bone()
+        bone.id = boneId
+        bone.parentId = parentId
+        bone.scale = scale
+        bone.rotation = rotation
+        bone.translation = translation
+        cmb.skeleton.append(bone)
+    cmb.materials = []
+    cmb.textures = []
+    cmb.meshes = []
+    cmb.shapes = []
+
+    scene = CmbScene()
+    scene.name = cmb.name
+    scene.cmb = cmb
+    scene.worldTransforms = arrays["worldTransforms"]
+    scene.bones = buildBones(cmb, scene.worldTransforms)
+
+    for i, (name, (width, height), imageFormat, isETC1, mipmapCount) in enumerate(zip(
+            arrays["textureNames"].tolist(), arrays["textureSizes"].tolist(), arrays["textureFormats"].tolist(),
+            arrays["textureIsETC1"].tolist(), arrays["textureMipmapCounts"].tolist())):
+        texture = SceneTexture()
+        texture.name = name
+        texture.width = width
+        texture.height = height
+        texture.imageFormat = GLTextureFormat(imageFormat)
+        texture.isETC1 = isETC1
+        texture.mipmapCount = mipmapCount
+        texture.pixels = arrays.get("texture{}".format(i))
+        scene.textures.append(texture)
+
+    for textureIndex in arrays["materialTextureIndices"].tolist():
+        material = SceneMaterial()
+        material.textureIndex = textureIndex
+        scene.materials.append(material)
+
+    for i, (index, meshId, shapeIndex, materialIndex, skinningMode) in enumerate(arrays["meshes"].tolist()):
+        sceneMesh = SceneMesh()
+        sceneMesh.index = index
+        sceneMesh.id = meshId
+        sceneMesh.shapeIndex = shapeIndex
+        sceneMesh.materialIndex = materialIndex
+        sceneMesh.skinningMode = skinningMode
+        prefix = "mesh{}_".format(i)
+        sceneMesh.positions = arrays[prefix + "positions"]
+        sceneMesh.vertexBones = arrays[prefix + "vertexBones"]
+        sceneMesh.vertexWeights = arrays[prefix + "vertexWeights"]
+        sceneMesh.triangles = arrays[prefix + "triangles"]
+        sceneMesh.normals = arrays.get(prefix + "normals")
+        sceneMesh.colors = arrays.get(prefix + "colors")
+        j = 0
+        while "{}uv{}".format(prefix, j) in arrays:
+            sceneMesh.uvLayers.append(arrays["{}uv{}".format(prefix, j)])
+            j += 1
+        scene.meshes.append(sceneMesh)
+    return scene
+
+# Sparse animations have a few keyframes in each of their many channels, so
+# every channel's keyframes are stored together in one array per field, in the
+# order of boneIds with 3 translation and 4 rotation channels each
+def dumpAnimation(animation):
+    if isinstance(animation, BakedAnimation):
+        return {
+            "name": np.array(animation.name),
+            "duration": np.array(animation.duration, np.int64),
+            "frames": animation.frames,
+            "translations": animation.translations,
+            "rotations": animation.rotations,
+        }
+
+    boneIds = list(animation.translations)
+    channels = [channel for boneId in boneIds for channel in animation.translations[boneId] + animation.rotations[boneId]]
+    return {
+        "name": np.array(animation.name),
+        "duration": np.array(animation.duration, np.int64),
+        "frames": animation.frames,
+        "boneIds": np.array(boneIds, np.int32),
+        "keyCounts": np.array([len(channel.frames) for channel in channels], np.int64),
+        "keyFrames": np.concatenate([channel.frames for channel in channels] or [[]]),
+        "keyValues": np.concatenate([channel.values for channel in channels] or [[]]),
+        "keySlopesIn": np.concatenate([channel.slopesIn for channel in channels] or [[]]),
+        "keySlopesOut": np.concatenate([channel.slopesOut for channel in channels] or [[]]),
+    }
+
+def loadAnimation(arrays):
+    if "boneIds" not in arrays:
+        baked = BakedAnimation()
+        baked.name = str(arrays["name"])
+        baked.duration = int(arrays["duration"])
+        baked.frames = arrays["frames"]
+        baked.translations = arrays["translations"]
+        baked.rotations = arrays["rotations"]
+        return baked
+
+    sparse = SparseAnimation()
+    sparse.name = str(arrays["name"])
+    sparse.duration = int(arrays["duration"])
+    sparse.frames = arrays["frames"]
+    ends = np.cumsum(arrays["keyCounts"]).tolist()
+    starts = [0] + ends[:-1]
+    for i, boneId in enumerate(arrays["boneIds"].tolist()):
+        channels = []
+        for start, end in zip(starts[7 * i:7 * i + 7], ends[7 * i:7 * i + 7]):
+            channel = SparseChannel()
+            channel.frames = arrays["keyFrames"][start:end]
+            channel.values = arrays["keyValues"][start:end]
+            channel.slopesIn = arrays["keySlopesIn"][start:end]
+            channel.slopesOut = arrays["keySlopesOut"][start:end]
+            channels.append(channel)
+        sparse.translations[boneId] = channels[:3]
+        sparse.rotations[boneId] = channels[3:]
+    return sparse
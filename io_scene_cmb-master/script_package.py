@@ -0,0 +1,17 @@
+'''Lets the command line scripts (batch_extract.py, benchmark.py) import the addon's modules without blender
+
+Run as scripts, they aren't in a package, so their relative imports need the
+addon's directory registered as one first. Its blender __init__ is never run.
+'''
+
+import os, sys, types
+
+PACKAGE_NAME = "io_scene_cmb"
+
+def registerPackage():
+    '''Registers the addon's directory as a package, unless it's already imported, and returns its name'''
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+        sys.modules[PACKAGE_NAME] = package
+    return PACKAGE_NAME
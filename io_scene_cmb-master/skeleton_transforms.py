@@ -0,0 +1,69 @@
+import numpy as np
+
+from .array_utils import fromEulerAnglesArray, quaternionsToMatrices
+from .common import get_bone_ids_in_order
+
+# NumPy versions of utils.getWorldTransformCmb/getWorldTransformCsab. Matrices
+# are (..., 4, 4) arrays laid out like the mathutils ones fromTsr builds, with
+# the translation in the last row, so a bone's world transform is its local
+# transform times its parent's world transform.
+
+def fromTsrArray(translations, scales, rotations):
+    '''Same as utils.fromTsr for (..., 3) arrays of translations, scales and euler angles'''
+    translations = np.asarray(translations, np.float64)
+    scales = np.asarray(scales, np.float64)
+    rotations = np.asarray(rotations, np.float64)
+    shape = np.broadcast(translations[..., 0], scales[..., 0], rotations[..., 0]).shape
+
+    R = quaternionsToMatrices(fromEulerAnglesArray(rotations))
+
+    M = np.zeros(shape + (4, 4))
+    M[..., :3, :3] = scales[..., :, np.newaxis] * np.swapaxes(R, -1, -2)
+    M[..., 3, :3] = translations
+    M[..., 3, 3] = 1.0
+    return M
+
+def getBoneOrder(bones):
+    '''Returns the bone ids with every parent before its children'''
+    return get_bone_ids_in_order([(bone.id, bone.parentId) for bone in bones])
+
+def getWorldTransforms(bones, localTransforms):
+    '''Combines (..., boneCount, 4, 4) local transforms with their parents' in one pass
+
+    Bones are visited parents first, so each parent's world transform is
+    already known and every bone takes a single matrix multiply. Any leading
+    axes (like one per frame of an animation) are all done at once.
+    '''
+    localTransforms = np.asarray(localTransforms, np.float64)
+    worldTransforms = np.empty_like(localTransforms)
+    for boneId in getBoneOrder(bones):
+        parentId = bones[boneId].parentId
+        if parentId < 0:
+            worldTransforms[..., boneId, :, :] = localTransforms[..., boneId, :, :]
+        else:
+            worldTransforms[..., boneId, :, :] = np.matmul(localTransforms[..., boneId, :, :], worldTransforms[..., parentId, :, :])
+    return worldTransforms
+
+def getSkeletonWorldTransforms(bones):
+    '''Returns the (boneCount, 4, 4) rest pose world transforms, same as getWorldTransformCmb for each bone'''
+    localTransforms = fromTsrArray(
+        np.reshape([bone.translation for bone in bones], (-1, 3)),
+        np.reshape([bone.scale for bone in bones], (-1, 3)),
+        np.reshape([bone.rotation for bone in bones], (-1, 3)))
+    return getWorldTransforms(bones, localTransforms)
+
+def getNormalMatrices(transforms):
+    '''Returns the (..., 3, 3) matrices that transform normals for (..., 4, 4) transforms
+
+    Normals are multiplied by the inverse of each transform's rotation and
+    scale, which is worked out once per transform instead of once per normal.
+    '''
+    return np.swapaxes(np.linalg.inv(transforms)[..., :3, :3], -1, -2)
+
+def transformPositions(positions, transforms):
+    '''Same as utils.transformPosition for (n, 3) positions, each with its own (n, 4, 4) transform'''
+    return np.einsum('ni,nij->nj', positions, transforms[:, :3, :3]) + transforms[:, 3, :3]
+
+def transformNormals(normals, normalMatrices):
+    '''Transforms (n, 3) normals, each by its own (n, 3, 3) matrix from getNormalMatrices'''
+    return np.einsum('ni,nij->nj', normals, normalMatrices)
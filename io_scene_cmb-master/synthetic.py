@@ -0,0 +1,261 @@
+'''Generates synthetic but format-valid .cmb, .zsi, .csab and .zar files
+
+Only the parts of each format that the importer reads are filled in, with
+random contents from a fixed seed, so the same arguments always give the same
+bytes. These are used by benchmark.py to time the importer without a romfs dump.
+'''
+
+import random, struct
+
+from .cmbEnums import DataTypes, GLTextureFormat, SkinningMode
+from .ctrTexture import getFmtBPP
+
+ETC1Formats = (GLTextureFormat.ETC1, GLTextureFormat.ETC1a4)
+
+# The largest grid whose indices still fit in a primitive's 16 bit index count
+MAX_GRID_SIZE = 105
+
+def pad(data, multiple = 4):
+    while len(data) % multiple:
+        data.append(0)
+
+def makeMaterial():
+    '''A material with one texture mapper and one combiner, as version 6 lays it out'''
+    m = struct.pack("<BBBBBBh", 0, 1, 1, 0, 1, 0, 0) + struct.pack("<II", 1, 1)
+    m += struct.pack("<hhHHHHff4B", 0, 0, 0x2601, 0x2601, 0x2901, 0x2901, 0.0, 0.0, 0, 0, 0, 255)# Texture mappers
+    m += struct.pack("<hhHHHHff4B", -1, 0, 0x2601, 0x2601, 0x2901, 0x2901, 0.0, 0.0, 0, 0, 0, 255) * 2
+    m += struct.pack("<BBBBfffff", 0, 0, 1, 0, 1.0, 1.0, 0.0, 0.0, 0.0) * 3# Texture coords
+    m += bytes([0, 0, 0, 0, 102, 102, 102, 0, 127, 127, 127, 255, 255, 255, 255, 255, 0, 0, 0, 0]) + bytes([0, 0, 0, 255] * 6)
+    m += struct.pack("<4f", 0, 0, 0, 1) + struct.pack("<HHI", 33984, 25288, 0) + struct.pack("<I", 25264) + struct.pack("<H6B", 25280, 0, 0, 0, 0, 0, 0)
+    m += struct.pack("<BbHf", 0, -1, 25248, 1.0) * 6# Samplers
+    m += struct.pack("<I", 1) + struct.pack("<6h", *([0] + [-1] * 5))
+    m += struct.pack("<BBHBBHB", 1, 128, 516, 1, 1, 513, 0) + b"\0\0\0"
+    m += struct.pack("<HHIHHI", 770, 771, 32774, 1, 0, 32774) + struct.pack("<4f", 0, 0, 0, 1)
+    return m
+
+Combiner = struct.pack("<18Hi", 8448, 8448, 1, 1, 34168, 34168, 34167, 34167, 34167, 768, 768, 768, 34167, 34167, 34167, 770, 770, 770, 0)
+
+def makeCmb(name = "synthetic", boneCount = 8, meshCount = 4, gridSize = 8, textureSize = 32, formats = None,
+            skinningMode = SkinningMode.Smooth, seed = 0):
+    '''Returns the bytes of a version 6 (OoT3D) .cmb
+
+    The skeleton is a random tree of boneCount bones. Each mesh has its own
+    shape, a gridSize x gridSize grid of vertices with normals, colors, UVs and
+    two bone influences each. There's one textureSize x textureSize texture for
+    each of formats, every GLTextureFormat by default, filled with random data.
+    '''
+    assert 2 <= gridSize <= MAX_GRID_SIZE, "Grids must be between 2 and {} vertices wide".format(MAX_GRID_SIZE)
+    if formats is None:
+        formats = list(GLTextureFormat)
+    rnd = random.Random(seed)
+    data = bytearray(68)# Header, filled in last
+    offsets = {}
+
+    # Skeleton, every bone's parent comes before it
+    offsets["skl"] = len(data)
+    data += b"skl " + struct.pack("<III", 16 + 40 * boneCount, boneCount, 2)
+    for i in range(boneCount):
+        parent = -1 if i == 0 else rnd.randrange(i)
+        data += struct.pack("<Hh9f", i, parent, 1, 1, 1,
+                            rnd.uniform(-1, 1), rnd.uniform(-1, 1), rnd.uniform(-1, 1),
+                            rnd.uniform(-50, 50), rnd.uniform(-50, 50), rnd.uniform(-50, 50))
+    pad(data)
+
+    offsets["mats"] = len(data)
+    material = makeMaterial()
+    data += b"mats" + struct.pack("<II", 12 + len(material) + len(Combiner), 1) + material + Combiner
+
+    offsets["tex"] = len(data)
+    data += b"tex " + struct.pack("<II", 12 + 36 * len(formats), len(formats))
+    textureData = bytearray()
+    for i, format in enumerate(formats):
+        size = textureSize * textureSize * getFmtBPP(format) // 8
+        isETC1 = format in ETC1Formats
+        data += struct.pack("<IHBBHHII16s", size, 1, isETC1, 0, textureSize, textureSize, format,
+                            len(textureData), "tex{}_{}".format(i, format.name).encode("ASCII")[:16])
+        textureData += bytes(rnd.getrandbits(8) for _ in range(size))
+        pad(textureData)
+
+    # Every shape's attributes go one after another in their own stream
+    streams = [bytearray() for _ in range(8)]# Position, normal, color, uv0, uv1, uv2, bone indices, bone weights
+    indices = bytearray()
+    shapes = []
+    for s in range(meshCount):
+        starts = [len(stream) for stream in streams]
+        for y in range(gridSize):
+            for x in range(gridSize):
+                streams[0] += struct.pack("<3f", x * 10.0 + s * 100, y * 10.0, rnd.uniform(-5, 5))
+                streams[1] += struct.pack("<3b", 0, 0, 127)
+                streams[2] += struct.pack("<4B", rnd.getrandbits(8), rnd.getrandbits(8), rnd.getrandbits(8), 255)
+                streams[3] += struct.pack("<2f", x / (gridSize - 1), y / (gridSize - 1))
+                streams[6] += struct.pack("<2B", rnd.randrange(2), rnd.randrange(2))
+                weight = rnd.randrange(101)
+                streams[7] += struct.pack("<2B", weight, 100 - weight)
+        for stream in streams:
+            pad(stream)
+
+        faces = []
+        for y in range(gridSize - 1):
+            for x in range(gridSize - 1):
+                a = y * gridSize + x
+                faces += [a, a + 1, a + gridSize, a + 1, a + gridSize + 1, a + gridSize]
+        indexOffset = len(indices) // 2
+        assert indexOffset <= 0xFFFF, "Too many meshes, primitives can only start in the first 65536 indices"
+        indices += struct.pack("<{}H".format(len(faces)), *faces)
+        pad(indices)
+        shapes.append((starts, indexOffset, len(faces), [rnd.randrange(boneCount), rnd.randrange(boneCount)]))
+
+    # Skeletal meshes
+    offsets["sklm"] = len(data)
+    data += b"sklm" + struct.pack("<III", 0, 0, 0)
+    data += b"mshs" + struct.pack("<IIHH", 16 + 4 * meshCount, meshCount, meshCount, 1)
+    for s in range(meshCount):
+        data += struct.pack("<HBB", s, 0, s)
+    data += b"shp " + struct.pack("<III", 0, meshCount, 0)
+    data += struct.pack("<{}h".format(meshCount), *([0] * meshCount))
+    pad(data)
+    attributes = ((1.0, DataTypes.Float), (1 / 127, DataTypes.Byte), (1 / 255, DataTypes.UByte), (1.0, DataTypes.Float),
+                  (1.0, DataTypes.Float), (1.0, DataTypes.Float), (1.0, DataTypes.UByte), (0.01, DataTypes.UByte))
+    for starts, indexOffset, indexCount, boneTable in shapes:
+        data += b"sepd" + struct.pack("<IHH", 0, 1, 1 | 2 | 4 | 8 | 64 | 128) + struct.pack("<6f", 0, 0, 0, 0, 0, 0)
+        for i, (scale, dataType) in enumerate(attributes):
+            start = starts[i] if i not in (4, 5) else 0# No uv1 or uv2
+            data += struct.pack("<IfHH4f", start, scale, dataType, 0, 0, 0, 0, 0)
+        data += struct.pack("<HHh", 2, 0, 0)
+        pad(data)
+        data += b"prms" + struct.pack("<IIHHII", 0, 1, skinningMode, len(boneTable), 24, 28) + struct.pack("<{}h".format(len(boneTable)), *boneTable)
+        pad(data)
+        data += b"prm " + struct.pack("<IIIIHH", 0, 1, 0, DataTypes.UShort, indexCount, indexOffset)
+    pad(data)
+
+    # Vertex attributes
+    offsets["vatr"] = len(data)
+    vatr = bytearray(b"vatr" + struct.pack("<II", 0, gridSize * gridSize * meshCount)) + bytes(64)
+    for i, stream in enumerate(streams):
+        struct.pack_into("<II", vatr, 12 + 8 * i, len(stream), len(vatr))
+        vatr += stream
+        pad(vatr)
+    struct.pack_into("<I", vatr, 4, len(vatr))
+    data += vatr
+
+    offsets["indices"] = len(data)
+    data += indices
+    pad(data)
+    offsets["textureData"] = len(data)
+    data += textureData
+
+    struct.pack_into("<4sIII16sI8I", data, 0, b"cmb ", len(data), 6, 0, name.encode("ASCII")[:16], len(indices) // 2,
+                     offsets["skl"], offsets["mats"], offsets["tex"], offsets["sklm"], 0, offsets["vatr"], offsets["indices"], offsets["textureData"])
+    return bytes(data)
+
+def makeZsi(cmb):
+    '''Returns the bytes of a scene .zsi with a single mesh command pointing at cmb'''
+    data = bytearray(b"ZSI\x01" + bytes(12))
+    data += struct.pack("<II", 0x0A, 12) + struct.pack("<II", 0x14, 0)# Mesh command, then end
+    data += struct.pack("<I", 12)# Mesh entries
+    data += struct.pack("<I", 32)# Cmb
+    data += bytes(8)
+    return bytes(data + cmb)
+
+def makeTrack(keyframes, isHermite, isShort):
+    '''keyframes is a list of (time, value, tangentIn, tangentOut)'''
+    data = struct.pack("<IIII", 2 if isHermite else 1, len(keyframes), 0, max(k[0] for k in keyframes))
+    for time, value, tangentIn, tangentOut in keyframes:
+        if isShort:# Rotations only, in units of pi / 32767.5
+            value = int(value / 3.141592653589793 * 32767.5)
+            if isHermite:
+                data += struct.pack("<Hhhh", time, value, int(tangentIn * 32767.5), int(tangentOut * 32767.5))
+            else:
+                data += struct.pack("<Hh", time, value)
+        elif isHermite:
+            data += struct.pack("<Ifff", time, value, tangentIn, tangentOut)
+        else:
+            data += struct.pack("<If", time, value)
+    return data
+
+def makeCsab(boneCount = 8, duration = 60, keyframeCount = 12, animatedBones = None, isHermite = True, isRotationShort = False,
+             loopMode = 0, seed = 0):
+    '''Returns the bytes of a .csab animating animatedBones (all of them by default)
+
+    Every animated bone gets translation and rotation tracks with keyframeCount
+    random keyframes between frames 0 and duration.
+    '''
+    rnd = random.Random(seed)
+    if animatedBones is None:
+        animatedBones = range(boneCount)
+    animatedBones = list(animatedBones)
+
+    nodes = []
+    for bone in animatedBones:
+        tracks = []
+        for channel in range(6):
+            times = sorted(rnd.sample(range(duration + 1), min(keyframeCount, duration + 1)))
+            if channel < 3:
+                keyframes = [(t, rnd.uniform(-50, 50), rnd.uniform(-1, 1), rnd.uniform(-1, 1)) for t in times]
+                tracks.append(makeTrack(keyframes, isHermite, False))
+            else:
+                keyframes = [(t, rnd.uniform(-3, 3), rnd.uniform(-0.5, 0.5), rnd.uniform(-0.5, 0.5)) for t in times]
+                tracks.append(makeTrack(keyframes, isHermite, isRotationShort))
+
+        header = bytearray(b"anod" + struct.pack("<HH", bone, 1 if isRotationShort else 0) + bytes(20))# No scale tracks
+        body = bytearray()
+        for i, track in enumerate(tracks):
+            struct.pack_into("<H", header, 8 + 2 * i, len(header) + len(body))
+            body += track
+            pad(body)
+        nodes.append(bytes(header + body))
+
+    boneToAnimationTable = [-1] * boneCount
+    for i, bone in enumerate(animatedBones):
+        boneToAnimationTable[bone] = i
+
+    data = bytearray(b"csab" + struct.pack("<IIIII", 0, 3, 0, 1, 0x18))
+    data += struct.pack("<8I", 0, 0, 0, 0, duration, loopMode, len(nodes), boneCount)
+    data += struct.pack("<{}h".format(boneCount), *boneToAnimationTable)
+    pad(data)
+    nodeTableOffset = len(data)
+    data += bytes(4 * len(nodes))
+    for i, node in enumerate(nodes):
+        struct.pack_into("<I", data, nodeTableOffset + 4 * i, len(data) - 0x18)
+        data += node
+    struct.pack_into("<I", data, 4, len(data))
+    return bytes(data)
+
+def makeZar(files):
+    '''Returns the bytes of a .zar holding files, a list of (type name, file name, bytes)'''
+    typeNames = []
+    for typeName, _, _ in files:
+        if typeName not in typeNames:
+            typeNames.append(typeName)
+
+    data = bytearray(0x20)# Header, filled in last
+    filetypesOffset = len(data)
+    data += bytes(16 * len(typeNames))
+    fileMetadataOffset = len(data)
+    data += bytes(8 * len(files))
+    dataOffset = len(data)
+    data += bytes(4 * len(files))
+
+    fileListOffsets = {}
+    for typeName in typeNames:
+        fileListOffsets[typeName] = len(data)
+        fileIndices = [i for i, file in enumerate(files) if file[0] == typeName]
+        data += struct.pack("<{}I".format(len(fileIndices)), *fileIndices)
+    typeNameOffsets = {}
+    for typeName in typeNames:
+        typeNameOffsets[typeName] = len(data)
+        data += typeName.encode("ASCII") + b"\0"
+
+    for i, (_, fileName, fileBytes) in enumerate(files):
+        fileNameOffset = len(data)
+        data += fileName.encode("ASCII") + b"\0"
+        pad(data)
+        struct.pack_into("<II", data, fileMetadataOffset + 8 * i, len(fileBytes), fileNameOffset)
+        struct.pack_into("<I", data, dataOffset + 4 * i, len(data))
+        data += fileBytes
+
+    for j, typeName in enumerate(typeNames):
+        fileCount = sum(1 for file in files if file[0] == typeName)
+        struct.pack_into("<III", data, filetypesOffset + 16 * j, fileCount, fileListOffsets[typeName], typeNameOffsets[typeName])
+    struct.pack_into("<4sIHHIII", data, 0, b"ZAR\x01", len(data), len(typeNames), len(files), filetypesOffset, fileMetadataOffset, dataOffset)
+    return bytes(data)
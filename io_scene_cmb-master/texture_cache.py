@@ -0,0 +1,112 @@
+import hashlib, os, struct
+import numpy as np
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+class TextureCache(object):
+    '''A size-bounded cache of decoded textures on disk
+
+    Entries are keyed by a hash of the raw texture bytes plus their format and
+    dimensions, so textures shared between archives are only decoded once. Each
+    entry is a headerless uint8 RGBA file, and the least recently used entries
+    are deleted once the cache grows past maxBytes.
+    '''
+    def __init__(self, directory, maxBytes = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.__totalBytes = None# Counted lazily on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def getKey(Input, width, height, format, isETC1):
+        if not isinstance(Input, (bytes, bytearray, memoryview)):
+            Input = bytes(bytearray(Input))
+
+        key = hashlib.sha1(struct.pack("<HHI?", width, height, int(format), bool(isETC1)))
+        key.update(Input)
+        return key.hexdigest()
+
+    def __getPath(self, key):
+        return os.path.join(self.directory, key + ".rgba")
+
+    def get(self, key, width, height):
+        '''Returns the cached flat uint8 RGBA array, or None if it isn't cached'''
+        path = self.__getPath(key)
+        try:
+            pixels = np.fromfile(path, np.uint8)
+            os.utime(path, None)# Mark as recently used
+        except (IOError, OSError):
+            return None
+
+        # Ignore entries cut short, e.g. by a crash mid-write
+        if pixels.size != width * height * 4:
+            return None
+        return pixels
+
+    def put(self, key, pixels):
+        self.__totalBytes = writeEntry(self.__getPath(key), np.ascontiguousarray(pixels, np.uint8).tobytes(),
+                                       ".rgba", self.__totalBytes, self.maxBytes)
+
+    def evict(self):
+        '''Deletes the least recently used entries until the cache fits in maxBytes'''
+        self.__totalBytes = evictEntries(self.directory, ".rgba", self.maxBytes)
+
+def getFileSize(path):
+    '''Returns the size of a file, or 0 if it doesn't exist'''
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+def getEntries(directory, extension):
+    '''Returns (modification time, path, size) for every file in directory ending with extension'''
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(extension):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:# Evicted by another import
+            continue
+        entries.append((stat.st_mtime, path, stat.st_size))
+    return entries
+
+def writeEntry(path, data, extension, totalBytes, maxBytes):
+    '''Writes an entry's bytes to path, then deletes the least recently used entries if they don't fit in maxBytes
+
+    The bytes are written to a temporary file that replaces the entry, so no
+    one ever reads it half written. totalBytes is the size of every entry
+    before the write, or None if they haven't been counted yet, and their size
+    after the write is returned.
+    '''
+    directory = os.path.dirname(path)
+    tempPath = "{}.{}.tmp".format(path, os.getpid())
+    with open(tempPath, "wb") as f:
+        f.write(data)
+    replacedBytes = getFileSize(path)# Overwriting an entry doesn't grow the cache by its whole size
+    os.replace(tempPath, path)
+
+    if totalBytes is None:
+        totalBytes = sum(size for _, _, size in getEntries(directory, extension))
+    else:
+        totalBytes += memoryview(data).nbytes - replacedBytes
+
+    if totalBytes > maxBytes:
+        totalBytes = evictEntries(directory, extension, maxBytes)
+    return totalBytes
+
+def evictEntries(directory, extension, maxBytes):
+    '''Deletes the least recently used entries until they fit in maxBytes, returning their new total size'''
+    entries = sorted(getEntries(directory, extension))
+    totalBytes = sum(size for _, _, size in entries)
+
+    for _, path, size in entries:
+        if totalBytes <= maxBytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        totalBytes -= size
+    return totalBytes
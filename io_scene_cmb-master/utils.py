@@ -20,18 +20,6 @@ def transformPosition(pos, mat):
 def transformPositionWithQuaternion(pos, q):
     return transformPosition(pos, q.to_matrix().to_4x4())
 
-def transformNormalInverse(norm, invMat):
-    n = [0.0, 0.0, 0.0]
-    n[0] = dot(norm, invMat[0].xyz)
-    n[1] = dot(norm, invMat[1].xyz)
-    n[2] = dot(norm, invMat[2].xyz)
-    return n
-
-def transformNormal(norm, mat):
-    # TODO, SLOW: Should not need to invert matrix for each normal
-    invMat = mat.inverted()
-    return transformNormalInverse(norm, invMat)
-
 
 # Taken from https://gitlab.com/Worldblender/io_scene_numdlb (Thank you!)
 def getWorldTransformCmb(bones, i, withParent = True):
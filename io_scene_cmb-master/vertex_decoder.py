@@ -0,0 +1,117 @@
+import numpy as np
+
+from .cmbEnums import DataTypes, SkinningMode, VertexAttributeMode
+from .common import GLOBAL_SCALE
+from .io_utils import getFlag
+
+# Little-endian numpy equivalents of the PICA data types
+DataTypeDtypes = {
+    DataTypes.Byte:   np.dtype("<i1"),
+    DataTypes.UByte:  np.dtype("<u1"),
+    DataTypes.Short:  np.dtype("<i2"),
+    DataTypes.UShort: np.dtype("<u2"),
+    DataTypes.Int:    np.dtype("<i4"),
+    DataTypes.UInt:   np.dtype("<u4"),
+    DataTypes.Float:  np.dtype("<f4"),
+}
+
+# Note: Default data type is float, same as readDataType
+def getDataTypeDtype(dt):
+    return DataTypeDtypes.get(dt, DataTypeDtypes[DataTypes.Float])
+
+def readAttributeArray(f, offset, count, components, dataType):
+    '''Reads count * components values of dataType starting at offset, as a (count, components) array'''
+    dtype = getDataTypeDtype(dataType)
+    f.seek(offset)
+    data = np.frombuffer(f.read(count * components * dtype.itemsize), dtype, count * components)
+    return data.reshape(count, components)
+
+def readAttribute(f, offset, count, components, attribute):
+    '''Reads a scaled vertex attribute as a (count, components) float64 array'''
+    if attribute.mode == VertexAttributeMode.Constant:
+        return np.tile(np.array(attribute.constants[:components], np.float64), (count, 1))
+    return readAttributeArray(f, offset, count, components, attribute.dataType) * attribute.scale
+
+class ShapeVertices(object):
+    def __init__(self):
+        self.count = 0
+        self.positions = None# (count, 3) float32, with GLOBAL_SCALE applied
+        self.normals = None# (count, 3) float32
+        self.colors = None# (count, 4) float32
+        self.uv0 = None# (count, 2) float32
+        self.uv1 = None# (count, 2) float32
+        self.uv2 = None# (count, 2) float32
+        self.boneIndices = None# (count, boneDimensions) int32, indices into each primitive set's bone table
+        self.boneWeights = None# (count, boneDimensions) float32, rounded to 2 decimals
+
+def decodeShapeVertices(f, cmb, shape, vertexCount, startOff):
+    '''Decodes every vertex attribute of a shape into contiguous arrays
+
+    Attributes a shape doesn't have are left as None.
+    '''
+    vb = cmb.vatr
+    baseOfs = cmb.vatrOfs + startOff
+    vertices = ShapeVertices()
+    vertices.count = vertexCount
+
+    # Python doesn't have increment operator (afaik) so this must be ugly...
+    inc = 0 #increment
+    hasNrm = getFlag(shape.vertFlags, 1, inc)
+    if cmb.version > 6: inc+=1 #Skip "HasTangents" for now
+    hasClr = getFlag(shape.vertFlags, 2, inc)
+    hasUv0 = getFlag(shape.vertFlags, 3, inc)
+    hasUv1 = getFlag(shape.vertFlags, 4, inc)
+    hasUv2 = getFlag(shape.vertFlags, 5, inc)
+    hasBi  = getFlag(shape.vertFlags, 6, inc)
+    hasBw  = getFlag(shape.vertFlags, 7, inc)
+
+    positions = readAttribute(f, baseOfs + vb.position.startOfs + shape.position.start, vertexCount, 3, shape.position)
+    vertices.positions = (positions * GLOBAL_SCALE).astype(np.float32)
+
+    if hasNrm:
+        vertices.normals = readAttribute(f, baseOfs + vb.normal.startOfs + shape.normal.start, vertexCount, 3, shape.normal).astype(np.float32)
+    if hasClr:
+        vertices.colors = readAttribute(f, baseOfs + vb.color.startOfs + shape.color.start, vertexCount, 4, shape.color).astype(np.float32)
+    if hasUv0:
+        vertices.uv0 = readAttribute(f, baseOfs + vb.uv0.startOfs + shape.uv0.start, vertexCount, 2, shape.uv0).astype(np.float32)
+    if hasUv1:
+        vertices.uv1 = readAttribute(f, baseOfs + vb.uv1.startOfs + shape.uv1.start, vertexCount, 2, shape.uv1).astype(np.float32)
+    if hasUv2:
+        vertices.uv2 = readAttribute(f, baseOfs + vb.uv2.startOfs + shape.uv2.start, vertexCount, 2, shape.uv2).astype(np.float32)
+
+    if hasBi:
+        boneIndices = readAttribute(f, baseOfs + vb.bIndices.startOfs + shape.bIndices.start, vertexCount, shape.boneDimensions, shape.bIndices)
+        vertices.boneIndices = boneIndices.astype(np.int32)
+    if hasBw:
+        boneWeights = readAttribute(f, baseOfs + vb.bWeights.startOfs + shape.bWeights.start, vertexCount, shape.boneDimensions, shape.bWeights)
+        vertices.boneWeights = np.round(boneWeights, 2).astype(np.float32)
+
+    return vertices
+
+def getVertexBones(shape, vertices):
+    '''Resolves each vertex's bone influences through its primitive set's bone table
+
+    Returns (bones, weights), two (count, boneDimensions) arrays. Vertices without
+    bone indices are bound to the first bone of the first primitive set, and
+    vertices without bone weights are fully weighted to their first bone.
+    '''
+    hasBi = vertices.boneIndices is not None
+    dimensions = shape.boneDimensions if hasBi else 1
+    defaultBone = shape.primitiveSets[0].boneTable[0]
+
+    bones = np.full((vertices.count, dimensions), defaultBone, np.int32)
+    for pset in shape.primitiveSets:
+        psetVertices = np.unique(np.asarray(pset.primitive.indices, np.int32))
+        if(hasBi and pset.skinningMode != SkinningMode.Single):
+            boneTable = np.asarray(pset.boneTable, np.int32)
+            bones[psetVertices] = boneTable[vertices.boneIndices[psetVertices]]
+        else:
+            bones[psetVertices] = defaultBone# For single-bind meshes
+
+    if vertices.boneWeights is not None and vertices.boneWeights.shape[1] == dimensions:
+        weights = vertices.boneWeights
+    else:
+        weights = np.zeros((vertices.count, dimensions), np.float32)
+        weights[:, 0] = 1.0
+
+    return bones, weights
@@ -1,53 +1,90 @@
-from .array_buffer_slice import ArrayBufferSlice
+import struct
+
+from .array_buffer_slice import mapFile
 
 def readNullTerminatedString(bytes, offset):
-    chars = []
-    for i in range(offset, len(bytes)):
-        c = bytes[i]
-        if c == 0:
-            return bytearray(chars).decode('utf-8')
-        chars.append(c)
+    end = bytes.find(b"\0", offset)
+    if end == -1:
+        return None
+    return bytes.slice(offset, end - offset).decode('utf-8') if end > offset else ""
 
 # Class representing a Zar archive.
+#
+# Only the tables are read up front, into a name -> entry and a type -> entries
+# index. File objects (and their slices) are created when they're looked up.
 class Zar:
     def __init__(self, filePath):
-        with open(filePath, "rb") as f:
-            bytes = ArrayBufferSlice(f.read())
+        self.__bytes = bytes = mapFile(filePath)
 
         self.header = Zar.ZarHeader(bytes)
         self.filetypesSection = Zar.FiletypesSection(bytes, self.header)
 
-        self.files = []
+        # (filename, fileSize, fileOffset) for each file index
+        fileMetadata = Zar.readTable(bytes, self.header.fileMetadataOffset, self.header.fileCount, "<II")
+        fileOffsets = Zar.readTable(bytes, self.header.dataOffset, self.header.fileCount, "<I")
+        self.__entries = [
+            (readNullTerminatedString(bytes, filenameOffset), fileSize, fileOffset)
+            for (fileSize, filenameOffset), (fileOffset,) in zip(fileMetadata, fileOffsets)
+        ]
+
+        # File indices in the order files are listed by their filetypes
+        self.__fileIndices = []
+        self.__fileIndicesByName = {}
+        self.__fileIndicesByType = {}
         for filetype in self.filetypesSection.filetypes:
-            for fileInFiletypeIndex in range(filetype.fileCount):
-                fileIndexOffset = filetype.fileListOffset + 4 * fileInFiletypeIndex
-                fileIndexBytes = bytes[fileIndexOffset:fileIndexOffset+4]
-                (fileIndex,) = fileIndexBytes.unpack("I")
+            filetype.fileIndices = [fileIndex for (fileIndex,) in Zar.readTable(bytes, filetype.fileListOffset, filetype.fileCount, "<I")]
+            self.__fileIndicesByType.setdefault(filetype.typeName, filetype.fileIndices)
+            self.__fileIndices.extend(filetype.fileIndices)
+
+            for fileIndex in filetype.fileIndices:
+                self.__fileIndicesByName.setdefault(self.__entries[fileIndex][0], fileIndex)
+
+        self.__files = {}
 
-                fileMetadataOffset = self.header.fileMetadataOffset + 8 * fileIndex
-                fileMetadataBytes = bytes[fileMetadataOffset:fileMetadataOffset+8]
-                (
-                    fileSize,
-                    filenameOffset,
-                ) = fileMetadataBytes.unpack("II")
+    # Unmaps the archive, its files can't be read anymore afterwards
+    def close(self):
+        self.__bytes.close()
 
-                filename = readNullTerminatedString(bytes, filenameOffset)
+    def __enter__(self):
+        return self
 
-                fileOffsetOffset = self.header.dataOffset + 4 * fileIndex
-                fileOffsetBytes = bytes[fileOffsetOffset:fileOffsetOffset+4]
-                (fileOffset,) = fileOffsetBytes.unpack("I")
+    def __exit__(self, *args):
+        self.close()
 
-                fileBytes = bytes.slice(fileOffset, fileSize)
+    @staticmethod
+    def readTable(bytes, offset, count, format):
+        if count == 0:
+            return []
+        size = count * struct.calcsize(format)
+        return struct.iter_unpack(format, bytes.slice(offset, size).getBuffer())
 
-                file = Zar.File(filename, fileBytes)
+    def getFileByIndex(self, fileIndex):
+        file = self.__files.get(fileIndex)
+        if file is None:
+            filename, fileSize, fileOffset = self.__entries[fileIndex]
+            file = self.__files[fileIndex] = Zar.File(filename, self.__bytes.slice(fileOffset, fileSize))
+        return file
 
-                self.files.append(file)
-                filetype.files.append(file)
+    def getFile(self, filename):
+        fileIndex = self.__fileIndicesByName.get(filename)
+        if fileIndex is None:
+            return None
+        return self.getFileByIndex(fileIndex)
 
     def getFiles(self, typeName):
-        for filetype in self.filetypesSection.filetypes:
-            if typeName == filetype.typeName:
-                return filetype.files
+        fileIndices = self.__fileIndicesByType.get(typeName)
+        if fileIndices is None:
+            return None
+        return [self.getFileByIndex(fileIndex) for fileIndex in fileIndices]
+
+    def getFilenames(self, typeName = None):
+        fileIndices = self.__fileIndices if typeName is None else self.__fileIndicesByType.get(typeName, [])
+        return [self.__entries[fileIndex][0] for fileIndex in fileIndices]
+
+    # Every file in the archive. Prefer getFile/getFiles, which only create what's asked for
+    @property
+    def files(self):
+        return [self.getFileByIndex(fileIndex) for fileIndex in self.__fileIndices]
 
     def __str__(self):
         return '\n\n\n'.join([
@@ -70,7 +107,7 @@ class Zar:
                 self.filetypesOffset,
                 self.fileMetadataOffset,
                 self.dataOffset
-            ) = bytes.slice(4, 20).unpack("IHHIII")
+            ) = bytes.unpack("IHHIII", 4)
 
         def __str__(self):
             return '\n'.join([
@@ -89,27 +126,22 @@ class Zar:
     # Helper class for fetching the list of filetypes and their associated files.
     class FiletypesSection:
         def __init__(self, bytes, header):
-            self.filetypes = []
-
-            filetypesOffset = header.filetypesOffset
-            for i in range(header.filetypeCount):
-                currentFiletypeOffset = filetypesOffset + 16 * i
-                self.filetypes.append(Zar.Filetype(bytes, currentFiletypeOffset))
+            self.filetypes = [
+                Zar.Filetype(bytes, fileCount, fileListOffset, typeNameOffset)
+                for (fileCount, fileListOffset, typeNameOffset) in Zar.readTable(bytes, header.filetypesOffset, header.filetypeCount, "<III4x")
+            ]
 
         def __str__(self):
             return '\n\n'.join(map(lambda filetype: str(filetype), self.filetypes))
 
     class Filetype:
-        def __init__(self, bytes, filetypeOffset):
-            filetypeBytes = bytes[filetypeOffset:filetypeOffset+12]
-            (
-                self.fileCount,
-                self.fileListOffset,
-                self.typeNameOffset,
-            ) = filetypeBytes.unpack("III")
+        def __init__(self, bytes, fileCount, fileListOffset, typeNameOffset):
+            self.fileCount = fileCount
+            self.fileListOffset = fileListOffset
+            self.typeNameOffset = typeNameOffset
 
             self.typeName = readNullTerminatedString(bytes, self.typeNameOffset)
-            self.files = []
+            self.fileIndices = []
 
         def __str__(self):
             return '\n'.join([